@@ -4,6 +4,7 @@ import logging
 import os
 from typing import TypeGuard, Dict, Any, Optional, Tuple, TYPE_CHECKING
 
+from app.bedrock_limiter import invoke_with_concurrency_limit
 from app.config import BEDROCK_PRICING
 from app.config import DEFAULT_GENERATION_CONFIG as DEFAULT_CLAUDE_GENERATION_CONFIG
 from app.config import DEFAULT_MISTRAL_GENERATION_CONFIG
@@ -292,9 +293,12 @@ def call_converse_api(
     Returns:
         ConverseResponseTypeDef: The API response
     """
-    client = get_bedrock_runtime_client()
+    # Retried by `invoke_with_concurrency_limit` instead of botocore
+    client = get_bedrock_runtime_client(max_attempts=1)
 
-    return client.converse(**args)
+    return invoke_with_concurrency_limit(
+        args["modelId"], lambda: client.converse(**args)
+    )
 
 
 def calculate_price(
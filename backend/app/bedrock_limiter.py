@@ -0,0 +1,268 @@
+"""
+Adaptive concurrency limiting of Bedrock invocations.
+
+The concurrency of the invocations of each model is limited in the process by AIMD:
+the limit grows by one per window of successful invocations, and is halved when
+Bedrock throttles. Invocations over the limit wait in queue, instead of failing.
+Throttling and transient errors are retried with jittered backoff, as long as nothing
+has been streamed to the user.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, TypeVar
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+BEDROCK_REGION = os.environ.get("BEDROCK_REGION", "us-east-1")
+BEDROCK_INITIAL_CONCURRENCY = int(os.environ.get("BEDROCK_INITIAL_CONCURRENCY", 8))
+BEDROCK_MIN_CONCURRENCY = 1
+BEDROCK_MAX_CONCURRENCY = int(os.environ.get("BEDROCK_MAX_CONCURRENCY", 64))
+# Invocations waiting longer than this in queue fail with `BedrockQueueTimeoutError`
+BEDROCK_QUEUE_TIMEOUT_SECONDS = float(
+    os.environ.get("BEDROCK_QUEUE_TIMEOUT_SECONDS", 60)
+)
+BEDROCK_MAX_ATTEMPTS = int(os.environ.get("BEDROCK_MAX_ATTEMPTS", 4))
+BEDROCK_BACKOFF_BASE_SECONDS = 0.5
+BEDROCK_BACKOFF_MAX_SECONDS = 8.0
+# Throttles within this period after a decrease are caused by the same burst
+BEDROCK_DECREASE_INTERVAL_SECONDS = 1.0
+
+THROTTLING_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException"}
+RETRYABLE_ERROR_CODES = THROTTLING_ERROR_CODES | {
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+    "InternalServerException",
+}
+
+T = TypeVar("T")
+
+
+class BedrockQueueTimeoutError(Exception):
+    pass
+
+
+def _error_codes(error: BaseException) -> list[str]:
+    if isinstance(error, BaseExceptionGroup):
+        return [code for e in error.exceptions for code in _error_codes(e)]
+    if isinstance(error, ClientError):
+        return [error.response.get("Error", {}).get("Code", "")]
+    return []
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    """
+    Check if an error is a throttling by Bedrock, including the errors in the stream.
+
+    Args:
+        error: The error raised by the invocation
+
+    Returns:
+        bool: True if the invocation was throttled
+    """
+    return any(code in THROTTLING_ERROR_CODES for code in _error_codes(error))
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """
+    Check if an invocation failed with an error worth retrying.
+
+    Args:
+        error: The error raised by the invocation
+
+    Returns:
+        bool: True if all the errors are throttling or transient errors
+    """
+    codes = _error_codes(error)
+    return len(codes) > 0 and all(code in RETRYABLE_ERROR_CODES for code in codes)
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD concurrency limit shared by the threads of the process."""
+
+    def __init__(
+        self,
+        initial_limit: float = BEDROCK_INITIAL_CONCURRENCY,
+        min_limit: float = BEDROCK_MIN_CONCURRENCY,
+        max_limit: float = BEDROCK_MAX_CONCURRENCY,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+        self.throttles = 0
+        self.retries = 0
+        self.queued = 0
+        self.queue_timeouts = 0
+        self.queue_wait_seconds = 0.0
+
+    def acquire(self, timeout: float = BEDROCK_QUEUE_TIMEOUT_SECONDS) -> float:
+        """
+        Wait until the invocation is within the limit.
+
+        Args:
+            timeout: Maximum time to wait in queue
+
+        Returns:
+            float: The time waited in queue
+
+        Raises:
+            BedrockQueueTimeoutError: If the invocation is not admitted in time
+        """
+        start = time.monotonic()
+        with self.condition:
+            if self.in_flight >= int(self.limit):
+                self.queued += 1
+            admitted = self.condition.wait_for(
+                lambda: self.in_flight < int(self.limit), timeout
+            )
+            waited = time.monotonic() - start
+            self.queue_wait_seconds += waited
+            if not admitted:
+                self.queue_timeouts += 1
+                raise BedrockQueueTimeoutError(
+                    f"Waited {waited:.1f}s for Bedrock concurrency of {int(self.limit)}"
+                )
+            self.in_flight += 1
+
+        return waited
+
+    def release(self, throttled: bool = False):
+        """
+        Release the invocation, and adjust the limit by its outcome.
+
+        Args:
+            throttled: Whether the invocation was throttled
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttles += 1
+                now = time.monotonic()
+                if now - self.last_decrease >= BEDROCK_DECREASE_INTERVAL_SECONDS:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def metrics(self) -> dict:
+        with self.condition:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "throttles": self.throttles,
+                "retries": self.retries,
+                "queued": self.queued,
+                "queue_timeouts": self.queue_timeouts,
+                "queue_wait_seconds": self.queue_wait_seconds,
+            }
+
+
+# "<region>/<model id>" -> limiter
+_limiters: dict[str, AdaptiveConcurrencyLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_concurrency_limiter(
+    model_id: str, region: str = BEDROCK_REGION
+) -> AdaptiveConcurrencyLimiter:
+    """
+    Get the concurrency limiter of a model in a region, shared in the process.
+
+    Args:
+        model_id: The model id or the inference profile id
+        region: The region the model is invoked in
+
+    Returns:
+        AdaptiveConcurrencyLimiter: The limiter of the model
+    """
+    key = f"{region}/{model_id}"
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = AdaptiveConcurrencyLimiter()
+        return _limiters[key]
+
+
+def get_concurrency_metrics() -> dict[str, dict]:
+    """
+    Get the metrics of the limiters of all the models invoked in the process.
+
+    Returns:
+        dict: Throttles, retries and queue wait by region/model id
+    """
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {key: limiter.metrics() for key, limiter in limiters.items()}
+
+
+def _backoff_seconds(attempt: int) -> float:
+    # Full jitter, not to retry in sync with the other throttled invocations
+    return random.uniform(
+        0, min(BEDROCK_BACKOFF_MAX_SECONDS, BEDROCK_BACKOFF_BASE_SECONDS * 2**attempt)
+    )
+
+
+def invoke_with_concurrency_limit(
+    model_id: str,
+    invoke: Callable[[], T],
+    can_retry: Callable[[], bool] = lambda: True,
+    region: str = BEDROCK_REGION,
+    max_attempts: int = BEDROCK_MAX_ATTEMPTS,
+) -> T:
+    """
+    Invoke a model within its concurrency limit, retrying throttling and transient errors.
+
+    Args:
+        model_id: The model id or the inference profile id
+        invoke: Function to invoke the model
+        can_retry: Function to tell whether the failed invocation can be retried,
+            False once anything has been streamed to the user
+        region: The region the model is invoked in
+        max_attempts: Total attempts including the retries
+
+    Returns:
+        The result of the invocation
+
+    Raises:
+        BedrockQueueTimeoutError: If the invocation is not admitted in time
+    """
+    limiter = get_concurrency_limiter(model_id, region)
+    attempt = 0
+    while True:
+        waited = limiter.acquire()
+        if waited > 1:
+            logger.info(f"Waited {waited:.1f}s in queue for {region}/{model_id}")
+
+        try:
+            result = invoke()
+        except Exception as e:
+            throttled = is_throttling_error(e)
+            limiter.release(throttled=throttled)
+            if throttled:
+                logger.warning(
+                    f"Throttled by Bedrock: {region}/{model_id}: {limiter.metrics()}"
+                )
+
+            attempt += 1
+            if attempt >= max_attempts or not is_retryable_error(e) or not can_retry():
+                raise
+
+            with limiter.condition:
+                limiter.retries += 1
+            backoff = _backoff_seconds(attempt)
+            logger.info(f"Retrying {region}/{model_id} in {backoff:.2f}s: {e}")
+            time.sleep(backoff)
+            continue
+
+        limiter.release()
+        return result
@@ -0,0 +1,233 @@
+"""
+Health-scored routing of Bedrock invocations across regions.
+
+Each invocation is routed to the healthiest of `BEDROCK_REGION` and
+`BEDROCK_ROUTING_REGIONS`, scored per region and model by the recent time to first
+token, throttle rate and error rate. Throttling and transient errors fail over to the
+next region immediately, while the last region is retried with backoff.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Callable, TypeVar
+
+from app.bedrock_limiter import (
+    BEDROCK_MAX_ATTEMPTS,
+    invoke_with_concurrency_limit,
+    is_retryable_error,
+    is_throttling_error,
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+BEDROCK_REGION = os.environ.get("BEDROCK_REGION", "us-east-1")
+# Comma separated regions to route to, in addition to `BEDROCK_REGION`
+BEDROCK_ROUTING_REGIONS = [BEDROCK_REGION] + [
+    region.strip()
+    for region in os.environ.get("BEDROCK_ROUTING_REGIONS", "").split(",")
+    if region.strip() and region.strip() != BEDROCK_REGION
+]
+# Weight of the latest invocation in the moving averages
+HEALTH_SMOOTHING = 0.2
+# Throttles and errors are forgotten with this half-life, to route back to the region
+HEALTH_HALF_LIFE_SECONDS = 60.0
+# Time to first token assumed for the regions not invoked yet
+DEFAULT_TIME_TO_FIRST_TOKEN_SECONDS = 1.0
+THROTTLE_PENALTY = 10.0
+ERROR_PENALTY = 10.0
+# Prefer the regions in the configured order unless clearly healthier
+REGION_ORDER_PENALTY = 0.2
+
+T = TypeVar("T")
+
+
+class RegionRoute:
+    """A region to invoke a model in. Call `first_token` when the first token arrives."""
+
+    def __init__(self, region: str, model_id: str):
+        self.region = region
+        self.model_id = model_id
+        self.started = time.monotonic()
+        self.time_to_first_token: float | None = None
+
+    def first_token(self):
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.monotonic() - self.started
+
+
+class _RegionHealth:
+    def __init__(self):
+        self.time_to_first_token: float | None = None
+        self.throttle_rate = 0.0
+        self.error_rate = 0.0
+        self.updated = time.monotonic()
+
+    def _decay(self, now: float) -> float:
+        return 0.5 ** ((now - self.updated) / HEALTH_HALF_LIFE_SECONDS)
+
+    def record(self, time_to_first_token: float | None, throttled: bool, failed: bool):
+        now = time.monotonic()
+        decay = self._decay(now)
+        self.throttle_rate = self.throttle_rate * decay * (
+            1 - HEALTH_SMOOTHING
+        ) + HEALTH_SMOOTHING * float(throttled)
+        self.error_rate = self.error_rate * decay * (
+            1 - HEALTH_SMOOTHING
+        ) + HEALTH_SMOOTHING * float(failed and not throttled)
+        if time_to_first_token is not None:
+            self.time_to_first_token = (
+                time_to_first_token
+                if self.time_to_first_token is None
+                else self.time_to_first_token * (1 - HEALTH_SMOOTHING)
+                + HEALTH_SMOOTHING * time_to_first_token
+            )
+        self.updated = now
+
+    def score(self) -> float:
+        """Expected time to first token, penalized by the throttles and errors."""
+        decay = self._decay(time.monotonic())
+        time_to_first_token = (
+            self.time_to_first_token
+            if self.time_to_first_token is not None
+            else DEFAULT_TIME_TO_FIRST_TOKEN_SECONDS
+        )
+        return time_to_first_token * (
+            1
+            + THROTTLE_PENALTY * self.throttle_rate * decay
+            + ERROR_PENALTY * self.error_rate * decay
+        )
+
+
+# (region, model) -> health
+_health: dict[tuple[str, str], _RegionHealth] = {}
+_health_lock = threading.Lock()
+
+
+def record_invocation(
+    region: str,
+    model: str,
+    time_to_first_token: float | None = None,
+    error: BaseException | None = None,
+):
+    """
+    Record the outcome of an invocation to the health of the region.
+
+    Args:
+        region: The region invoked
+        model: The model name
+        time_to_first_token: Time until the first token, or the response
+        error: The error of the failed invocation
+    """
+    with _health_lock:
+        health = _health.setdefault((region, model), _RegionHealth())
+        health.record(
+            time_to_first_token,
+            throttled=error is not None and is_throttling_error(error),
+            failed=error is not None,
+        )
+
+
+def rank_regions(model: str, regions: list[str] | None = None) -> list[str]:
+    """
+    Rank the regions to invoke a model in, the healthiest first.
+
+    Args:
+        model: The model name
+        regions: The regions to rank, `BEDROCK_ROUTING_REGIONS` if None
+
+    Returns:
+        list[str]: The regions from the healthiest
+    """
+    regions = regions if regions is not None else BEDROCK_ROUTING_REGIONS
+    with _health_lock:
+        scores = {
+            region: _health.get((region, model), _RegionHealth()).score()
+            * (1 + REGION_ORDER_PENALTY * index)
+            for index, region in enumerate(regions)
+        }
+    return sorted(regions, key=lambda region: scores[region])
+
+
+def get_region_health() -> dict[str, dict]:
+    """
+    Get the health of the regions invoked in the process.
+
+    Returns:
+        dict: Score, time to first token, throttle rate and error rate by region/model
+    """
+    with _health_lock:
+        return {
+            f"{region}/{model}": {
+                "score": health.score(),
+                "time_to_first_token": health.time_to_first_token,
+                "throttle_rate": health.throttle_rate,
+                "error_rate": health.error_rate,
+            }
+            for (region, model), health in _health.items()
+        }
+
+
+def invoke_with_routing(
+    model: str,
+    get_model_id: Callable[[str], str],
+    invoke: Callable[[RegionRoute], T],
+    can_retry: Callable[[], bool] = lambda: True,
+    regions: list[str] | None = None,
+) -> T:
+    """
+    Invoke a model in the healthiest region, failing over to the others.
+
+    Args:
+        model: The model name
+        get_model_id: Function to get the model id in a region
+        invoke: Function to invoke the model in the region of the route
+        can_retry: Function to tell whether the failed invocation can be retried,
+            False once anything has been streamed to the user
+        regions: The regions to route to, `BEDROCK_ROUTING_REGIONS` if None
+
+    Returns:
+        The result of the invocation
+    """
+    ranked = rank_regions(model, regions)
+    for index, region in enumerate(ranked):
+        is_last = index == len(ranked) - 1
+        model_id = get_model_id(region)
+
+        def invoke_in_region() -> T:
+            route = RegionRoute(region, model_id)
+            try:
+                result = invoke(route)
+            except Exception as e:
+                # Errors of the request itself tell nothing about the region
+                if is_retryable_error(e):
+                    record_invocation(region, model, error=e)
+                raise
+            record_invocation(
+                region,
+                model,
+                time_to_first_token=(
+                    route.time_to_first_token
+                    if route.time_to_first_token is not None
+                    else time.monotonic() - route.started
+                ),
+            )
+            return result
+
+        try:
+            return invoke_with_concurrency_limit(
+                model_id,
+                invoke_in_region,
+                can_retry=can_retry,
+                region=region,
+                # Fail over immediately, retry with backoff only in the last region
+                max_attempts=BEDROCK_MAX_ATTEMPTS if is_last else 1,
+            )
+        except Exception as e:
+            if is_last or not is_retryable_error(e) or not can_retry():
+                raise
+            logger.warning(f"Failing over {model} from {region}: {e}")
+
+    raise AssertionError("No region to route to")
@@ -1,4 +1,6 @@
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
 import boto3
@@ -9,11 +11,14 @@ from app.repositories.api_publication import (
     find_usage_plan_by_id,
 )
 from app.repositories.common import RecordNotFoundError, decompose_bot_id
+from app.utils import delete_files_with_prefix_from_s3
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
 
 DOCUMENT_BUCKET = os.environ.get("DOCUMENT_BUCKET", "documents")
 BEDROCK_REGION = os.environ.get("BEDROCK_REGION", "us-east-1")
-
-s3_client = boto3.client("s3", BEDROCK_REGION)
+BOT_REMOVE_MAX_WORKERS = 4
 
 
 def delete_custom_bot_stack_by_bot_id(bot_id: str):
@@ -29,65 +34,78 @@ def delete_custom_bot_stack_by_bot_id(bot_id: str):
 def delete_from_s3(user_id: str, bot_id: str):
     """Delete all files in S3 bucket for the specified `user_id` and `bot_id`."""
     prefix = f"{user_id}/{bot_id}/"
-    try:
-        # List all objects with the specific prefix
-        objects_to_delete = s3_client.list_objects_v2(
-            Bucket=DOCUMENT_BUCKET, Prefix=prefix
-        )
-        if "Contents" in objects_to_delete:
-            # Prepare the list of objects to delete
-            delete_keys = [{"Key": obj["Key"]} for obj in objects_to_delete["Contents"]]
-            # Delete the objects
-            s3_client.delete_objects(
-                Bucket=DOCUMENT_BUCKET, Delete={"Objects": delete_keys}
-            )
-            print(f"Successfully deleted files from S3 for bot_id: {bot_id}")
-        else:
-            print("No files found to delete in S3.")
-    except Exception as e:
-        print(f"Error deleting files for bot_id: {bot_id}")
-        print(e)
-
-
-def handler(event: dict, context: Any) -> None:
-    """Bot removal handler.
-    This function is triggered by dynamodb stream when item is deleted.
-    Following resources are deleted asynchronously when bot is deleted:
-    - vector store record (postgres)
-    - s3 files
-    - cloudformation stack (if exists)
-    """
-
-    print(f"Received event: {event}")
-
-    # NOTE: batch size is 1
-    record = event["Records"][0]
-
-    pk = record["dynamodb"]["Keys"]["PK"]["S"]
-    sk = record["dynamodb"]["Keys"].get("SK", {}).get("S")
-    if not sk or "#BOT#" not in sk:
-        # Ignore non-bot items
-        print(f"Skipping event for SK: {sk}")
-        return
-
-    user_id = pk
-    bot_id = decompose_bot_id(sk)
+    deleted = delete_files_with_prefix_from_s3(DOCUMENT_BUCKET, prefix)
+    if deleted:
+        logger.info(f"Deleted {deleted} files from S3 for bot_id: {bot_id}")
+    else:
+        logger.info(f"No files found to delete in S3 for bot_id: {bot_id}")
 
-    delete_from_s3(user_id, bot_id)
-    delete_custom_bot_stack_by_bot_id(bot_id)
 
-    # Check if api published stack exists
+def delete_published_api(bot_id: str):
+    """Delete the api keys and the `ApiPublishmentStack` of the bot, if published."""
     try:
         stack = find_stack_by_bot_id(bot_id)
     except RecordNotFoundError:
-        print(f"Bot {bot_id} api published stack not found. Skipping deletion.")
+        logger.info(f"Bot {bot_id} api published stack not found. Skipping deletion.")
         return
 
     # Before delete cfn stack, delete all api keys
     if stack.api_usage_plan_id:  # Add type check
         usage_plan = find_usage_plan_by_id(stack.api_usage_plan_id)
-        for key_id in usage_plan.key_ids:
-            delete_api_key(key_id)
+        with ThreadPoolExecutor(max_workers=BOT_REMOVE_MAX_WORKERS) as executor:
+            list(executor.map(delete_api_key, usage_plan.key_ids))
 
     # Delete `ApiPublishmentStack` by CloudFormation
     delete_stack_by_bot_id(bot_id)
+
+
+def remove_bot(user_id: str, bot_id: str):
+    """Delete the resources of the bot concurrently.
+    Every deletion is idempotent, so a failed removal can be retried as a whole.
+    """
+    with ThreadPoolExecutor(max_workers=BOT_REMOVE_MAX_WORKERS) as executor:
+        futures = [
+            executor.submit(delete_from_s3, user_id, bot_id),
+            executor.submit(delete_custom_bot_stack_by_bot_id, bot_id),
+            executor.submit(delete_published_api, bot_id),
+        ]
+        # Wait for all of them before raising the first error
+        errors = [future.exception() for future in futures]
+
+    for error in errors:
+        if error is not None:
+            raise error
+
+
+def handler(event: dict, context: Any) -> dict:
+    """Bot removal handler.
+    This function is triggered by dynamodb stream when item is deleted.
+    Following resources are deleted asynchronously when bot is deleted:
+    - vector store record (postgres)
+    - s3 files
+    - cloudformation stack (if exists)
+    Only the failed records are reported to be retried
+    (`ReportBatchItemFailures` must be enabled on the event source).
+    """
+
+    logger.info(f"Received {len(event['Records'])} records")
+
+    failures = []
+    for record in event["Records"]:
+        pk = record["dynamodb"]["Keys"]["PK"]["S"]
+        sk = record["dynamodb"]["Keys"].get("SK", {}).get("S")
+        if not sk or "#BOT#" not in sk:
+            # Ignore non-bot items
+            logger.info(f"Skipping event for SK: {sk}")
+            continue
+
+        user_id = pk
+        bot_id = decompose_bot_id(sk)
+        try:
+            remove_bot(user_id, bot_id)
+
+        except Exception as e:
+            logger.exception(f"Failed to remove bot {bot_id}: {e}")
+            failures.append({"itemIdentifier": record["dynamodb"]["SequenceNumber"]})
+
+    return {"batchItemFailures": failures}
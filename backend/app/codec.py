@@ -0,0 +1,146 @@
+"""Serialization codecs for stored conversations and streamed payloads.
+
+JSON is encoded with orjson, which is several times faster than the stdlib `json`
+and emits UTF-8 directly. JSON payloads are written untagged, so they stay readable
+by older versions and by Athena queries over the exported table.
+
+Binary formats are prefixed with a format tag, so that items written with
+different formats can be read side by side:
+
+    <TAG_MARKER: 1 byte> <format tag: 1 byte> <body>
+
+JSON never starts with the tag marker, which is how untagged payloads are told apart.
+Compression is another tagged layer around an encoded payload, so a compressed
+body is itself either plain JSON or a tagged payload.
+"""
+
+import gzip
+import os
+from typing import Any, Literal, TypeGuard
+
+import msgpack
+import orjson
+
+CodecFormat = Literal["json", "msgpack"]
+Compression = Literal["none", "gzip"]
+
+TAG_MARKER = b"\x00"
+_FORMAT_TAGS: dict[CodecFormat, bytes] = {
+    "msgpack": b"m",
+}
+_COMPRESSION_TAGS: dict[Compression, bytes] = {
+    "gzip": b"g",
+}
+
+
+def _is_codec_format(format: str) -> TypeGuard[CodecFormat]:
+    return format in {"json", "msgpack"}
+
+
+def _is_compression(compression: str) -> TypeGuard[Compression]:
+    return compression in {"none", "gzip"}
+
+
+def _get_default_format() -> CodecFormat:
+    format = os.environ.get("CONVERSATION_CODEC", "json")
+    if not _is_codec_format(format):
+        raise ValueError(f"Unknown conversation codec: {format}")
+
+    return format
+
+
+def _get_default_compression() -> Compression:
+    compression = os.environ.get("CONVERSATION_COMPRESSION", "none")
+    if not _is_compression(compression):
+        raise ValueError(f"Unknown conversation compression: {compression}")
+
+    return compression
+
+
+# NOTE: Athena queries read `MessageMap` as a JSON string, so keep `json` without
+# compression unless the usage analysis is not needed.
+CONVERSATION_CODEC: CodecFormat = _get_default_format()
+CONVERSATION_COMPRESSION: Compression = _get_default_compression()
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode to UTF-8 JSON bytes."""
+    return orjson.dumps(obj)
+
+
+def loads(data: bytes | bytearray | memoryview | str) -> Any:
+    """Decode JSON bytes or string."""
+    return orjson.loads(data)
+
+
+def encode(
+    obj: Any,
+    format: CodecFormat | None = None,
+    compression: Compression | None = None,
+) -> bytes:
+    """Encode an object with the given format, then compress it.
+
+    Args:
+        obj: JSON compatible object to encode.
+        format: Codec format. JSON is written untagged, the others are tagged.
+            Defaults to `CONVERSATION_CODEC`.
+        compression: Compression algorithm. `none` leaves the payload as is.
+            Defaults to `CONVERSATION_COMPRESSION`.
+
+    Returns:
+        bytes: Encoded payload.
+    """
+    format = format or CONVERSATION_CODEC
+    compression = compression or CONVERSATION_COMPRESSION
+
+    if format == "json":
+        encoded = orjson.dumps(obj)
+
+    elif format == "msgpack":
+        encoded = TAG_MARKER + _FORMAT_TAGS["msgpack"] + msgpack.packb(obj)
+
+    else:
+        raise ValueError(f"Unknown codec format: {format}")
+
+    if compression == "none":
+        return encoded
+
+    elif compression == "gzip":
+        # NOTE: Fix mtime so that the same map always compresses to the same bytes
+        return (
+            TAG_MARKER
+            + _COMPRESSION_TAGS["gzip"]
+            + gzip.compress(encoded, compresslevel=6, mtime=0)
+        )
+
+    else:
+        raise ValueError(f"Unknown compression: {compression}")
+
+
+def is_tagged(data: bytes) -> bool:
+    """Whether the payload is binary, i.e. not plain JSON."""
+    return data.startswith(TAG_MARKER)
+
+
+def decode(data: bytes | str) -> Any:
+    """Decode a payload written by `encode` with any format and compression,
+    or plain JSON.
+
+    Args:
+        data: Encoded payload.
+
+    Returns:
+        Any: Decoded object.
+    """
+    if isinstance(data, str) or not is_tagged(data):
+        return orjson.loads(data)
+
+    tag = data[1:2]
+    if tag == _FORMAT_TAGS["msgpack"]:
+        return msgpack.unpackb(memoryview(data)[2:])
+
+    elif tag == _COMPRESSION_TAGS["gzip"]:
+        return decode(gzip.decompress(memoryview(data)[2:]))
+
+    else:
+        raise ValueError(f"Unknown format tag: {tag!r}")
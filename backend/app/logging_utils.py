@@ -0,0 +1,234 @@
+"""Size-capped logging of payloads.
+
+Pass payloads to the logger wrapped with `summarize`, as an argument to be formatted
+lazily by the logging module, not in an f-string:
+
+    logger.info("Found conversation: %s", summarize(conversation))
+
+The payload is only rendered if the record is emitted, with long strings truncated,
+binaries redacted and long collections cut. `LogBudgetFilter` samples the records with
+such payloads, and caps the total size of the records logged in each request.
+"""
+
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any
+
+from pydantic import BaseModel
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+LOG_MAX_FIELD_LENGTH = int(os.environ.get("LOG_MAX_FIELD_LENGTH", 200))
+LOG_MAX_ITEMS = int(os.environ.get("LOG_MAX_ITEMS", 10))
+LOG_MAX_DEPTH = 6
+# Rate of the records with payloads to be logged
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", 1.0))
+# Total size of the records logged in each request
+LOG_REQUEST_BUDGET_BYTES = int(os.environ.get("LOG_REQUEST_BUDGET_BYTES", 64 * 1024))
+# Length of the request body logged by `RequestLoggingMiddleware`
+LOG_REQUEST_BODY_PREFIX_LENGTH = 100
+
+# Values of these keys are never logged
+REDACTED_KEYS = {"authorization", "cookie", "x-api-key"}
+
+
+def _truncate(text: str, max_length: int) -> str:
+    if len(text) <= max_length:
+        return text
+    return f"{text[:max_length]}...({len(text)} chars)"
+
+
+def _summarize(value: Any, max_length: int, depth: int) -> Any:
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, str):
+        return _truncate(value, max_length)
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if depth >= LOG_MAX_DEPTH:
+        return f"<{type(value).__name__}>"
+
+    if isinstance(value, BaseModel):
+        # Read the fields as they are, not to serialize the whole model
+        items = [(name, getattr(value, name)) for name in type(value).model_fields]
+        return {
+            "__type__": type(value).__name__,
+            **_summarize_items(items, max_length, depth),
+        }
+    if isinstance(value, dict):
+        return _summarize_items(list(value.items()), max_length, depth)
+    if isinstance(value, (list, tuple, set)):
+        values = list(value)
+        summarized = [
+            _summarize(item, max_length, depth + 1) for item in values[:LOG_MAX_ITEMS]
+        ]
+        if len(values) > LOG_MAX_ITEMS:
+            summarized.append(f"...({len(values)} items)")
+        return summarized
+
+    return _truncate(str(value), max_length)
+
+
+def _summarize_items(items: list[tuple[Any, Any]], max_length: int, depth: int):
+    summarized = {}
+    for key, item in items[:LOG_MAX_ITEMS]:
+        if str(key).lower() in REDACTED_KEYS:
+            summarized[key] = "<redacted>"
+        else:
+            summarized[key] = _summarize(item, max_length, depth + 1)
+    if len(items) > LOG_MAX_ITEMS:
+        summarized["..."] = f"({len(items)} items)"
+    return summarized
+
+
+class _Summary:
+    def __init__(self, value: Any, max_length: int):
+        self.value = value
+        self.max_length = max_length
+
+    def __str__(self) -> str:
+        return str(_summarize(self.value, self.max_length, 0))
+
+    __repr__ = __str__
+
+
+def summarize(value: Any, max_length: int = LOG_MAX_FIELD_LENGTH) -> _Summary:
+    """Lazily rendered summary of a payload, to be passed as a logging argument."""
+    return _Summary(value, max_length)
+
+
+class _Budget:
+    def __init__(self, remaining: int):
+        self.remaining = remaining
+        self.exceeded = False
+        self.lock = threading.Lock()
+
+
+_request_budget: contextvars.ContextVar[_Budget | None] = contextvars.ContextVar(
+    "log_request_budget", default=None
+)
+
+
+def start_log_budget(budget_bytes: int = LOG_REQUEST_BUDGET_BYTES):
+    """Start the log budget of a request. Call at the beginning of each request.
+    Shared by the threads started with a copy of the current context.
+    """
+    _request_budget.set(_Budget(budget_bytes))
+
+
+class LogBudgetFilter(logging.Filter):
+    """Sample the records with payloads, and drop the records over the request budget.
+    Warnings and errors are always logged.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+
+        if (
+            LOG_PAYLOAD_SAMPLE_RATE < 1.0
+            and isinstance(record.args, tuple)
+            and any(isinstance(arg, _Summary) for arg in record.args)
+            and random.random() >= LOG_PAYLOAD_SAMPLE_RATE
+        ):
+            return False
+
+        budget = _request_budget.get()
+        if budget is None:
+            return True
+
+        # Format once here, not to be formatted again by the handler
+        message = record.getMessage()
+        record.msg = message
+        record.args = None
+
+        with budget.lock:
+            if budget.remaining >= len(message):
+                budget.remaining -= len(message)
+                return True
+
+            if budget.exceeded:
+                return False
+            budget.exceeded = True
+
+        record.msg = (
+            "Log budget of the request is exceeded, dropping INFO and DEBUG logs"
+        )
+        return True
+
+
+def install_log_budget_filter():
+    """Apply `LogBudgetFilter` to the handlers of the root logger."""
+    log_filter = LogBudgetFilter()
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, LogBudgetFilter) for f in handler.filters):
+            handler.addFilter(log_filter)
+
+
+class RequestLoggingMiddleware:
+    """Log the requests, with the size and the duration of each of them.
+    The body is passed through to the app as it is received, only a prefix of it
+    is kept to be logged.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_log_budget()
+        start = time.perf_counter()
+        logger.info("Request path: %s", scope["path"])
+        logger.info("Request method: %s", scope["method"])
+        logger.info(
+            "Request headers: %s",
+            summarize(
+                {
+                    key.decode("latin-1"): value.decode("latin-1")
+                    for key, value in scope["headers"]
+                }
+            ),
+        )
+
+        body_prefix = bytearray()
+        body_size = 0
+        status_code = None
+
+        async def receive_with_peek() -> Message:
+            nonlocal body_size
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                body_size += len(body)
+                remaining = LOG_REQUEST_BODY_PREFIX_LENGTH - len(body_prefix)
+                if remaining > 0:
+                    body_prefix.extend(body[:remaining])
+            return message
+
+        async def send_with_status(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_with_peek, send_with_status)
+        finally:
+            logger.info(
+                "Request body: %s...", body_prefix.decode("utf-8", errors="replace")
+            )
+            logger.info(
+                "Request completed: status %s, body %d bytes, %.3fs",
+                status_code,
+                body_size,
+                time.perf_counter() - start,
+            )
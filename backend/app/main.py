@@ -1,13 +1,17 @@
 import logging
+import math
 import os
 import traceback
 from typing import Callable
 
 from app.dependencies import get_current_user
+from app.logging_utils import RequestLoggingMiddleware, install_log_budget_filter
 from app.repositories.common import (
+    QuotaExceededError,
     RecordAccessNotAllowedError,
     RecordNotFoundError,
     ResourceConflictError,
+    compose_published_api_user_id,
 )
 from app.routes.admin import router as admin_router
 from app.routes.api_publication import router as api_publication_router
@@ -31,6 +35,7 @@ PUBLISHED_API_ID = os.environ.get("PUBLISHED_API_ID", None)
 is_published_api = PUBLISHED_API_ID is not None
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s - %(message)s")
+install_log_budget_filter()
 logger = logging.getLogger(__name__)
 
 if not is_published_api:
@@ -79,6 +84,14 @@ def error_handler_factory(status_code: int) -> Callable[[Request, Exception], Re
     return error_handler  # type: ignore
 
 
+def quota_exceeded_handler(_: Request, exc: QuotaExceededError) -> JSONResponse:
+    return JSONResponse(
+        {"errors": [str(exc)]},
+        status_code=429,
+        headers={"Retry-After": str(math.ceil(exc.retry_after_seconds))},
+    )
+
+
 app.add_exception_handler(RecordNotFoundError, error_handler_factory(404))
 app.add_exception_handler(FileNotFoundError, error_handler_factory(404))
 app.add_exception_handler(RecordAccessNotAllowedError, error_handler_factory(403))
@@ -88,6 +101,7 @@ app.add_exception_handler(AssertionError, error_handler_factory(400))
 app.add_exception_handler(PermissionError, error_handler_factory(403))
 app.add_exception_handler(ValidationError, error_handler_factory(422))
 app.add_exception_handler(ResourceConflictError, error_handler_factory(409))
+app.add_exception_handler(QuotaExceededError, quota_exceeded_handler)  # type: ignore
 app.add_exception_handler(Exception, error_handler_factory(500))
 
 
@@ -103,8 +117,9 @@ def add_current_user_to_request(request: Request, call_next: ASGIApp):
                 )
                 request.state.current_user = get_current_user(token)
         else:
+            assert PUBLISHED_API_ID is not None
             request.state.current_user = User(
-                id=f"PUBLISHED_API#{PUBLISHED_API_ID}",
+                id=compose_published_api_user_id(PUBLISHED_API_ID),
                 name=PUBLISHED_API_ID,  # type: ignore
                 groups=[],
             )
@@ -123,15 +138,5 @@ def add_current_user_to_request(request: Request, call_next: ASGIApp):
     return response
 
 
-@app.middleware("http")
-async def add_log_requests(request: Request, call_next: ASGIApp):
-    logger.info(f"Request path: {request.url.path}")
-    logger.info(f"Request method: {request.method}")
-    logger.info(f"Request headers: {request.headers}")
-
-    body = await request.body()
-    logger.info(f"Request body: {body.decode('utf-8')[:100]}...")
-
-    response = await call_next(request)  # type: ignore
-
-    return response
+# NOTE: Added last to be the outermost
+app.add_middleware(RequestLoggingMiddleware)
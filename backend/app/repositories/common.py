@@ -1,5 +1,8 @@
 import json
 import os
+import random
+import time
+import zlib
 from typing import Dict, List, Optional, Sequence
 
 import boto3
@@ -10,6 +13,17 @@ ACCOUNT = os.environ.get("ACCOUNT", "")
 REGION = os.environ.get("REGION", "ap-northeast-1")
 TABLE_ACCESS_ROLE_ARN = os.environ.get("TABLE_ACCESS_ROLE_ARN", "")
 TRANSACTION_BATCH_SIZE = 25
+BATCH_GET_ITEM_SIZE = 100
+BATCH_GET_MAX_ATTEMPTS = 8
+
+# NOTE: Do not change the shard count after deployment. Conversations stored with
+# another count would not be found.
+PUBLISHED_API_PARTITION_SHARDS = 16
+# Read the unsharded partition as well, for conversations stored before sharding.
+# Can be disabled once all of them are migrated.
+PUBLISHED_API_LEGACY_PARTITION_FALLBACK = (
+    os.environ.get("PUBLISHED_API_LEGACY_PARTITION_FALLBACK", "true").lower() == "true"
+)
 
 
 class RecordNotFoundError(Exception):
@@ -24,6 +38,54 @@ class ResourceConflictError(Exception):
     pass
 
 
+class QuotaExceededError(Exception):
+    def __init__(self, message: str, retry_after_seconds: float):
+        super().__init__(message)
+        self.retry_after_seconds = retry_after_seconds
+
+
+def compose_published_api_user_id(bot_id: str):
+    return f"PUBLISHED_API#{bot_id}"
+
+
+def decompose_published_api_user_id(user_id: str):
+    return user_id.split("#")[1]
+
+
+def is_published_api_user_id(user_id: str):
+    return user_id.startswith("PUBLISHED_API#")
+
+
+def compose_partition_key(user_id: str, conversation_id: str):
+    """Partition key of the items belonging to the conversation.
+    Conversations of a published API all belong to the same user, so they are
+    spread over shards derived from the conversation id to avoid a hot partition.
+    """
+    if not is_published_api_user_id(user_id):
+        return user_id
+
+    shard = zlib.crc32(conversation_id.encode("utf-8")) % PUBLISHED_API_PARTITION_SHARDS
+    return f"{user_id}#{shard}"
+
+
+def find_partition_keys(user_id: str, conversation_id: str | None = None):
+    """Partition keys which may hold items of the conversation, or of all the
+    conversations of the user if `conversation_id` is not given.
+    """
+    if not is_published_api_user_id(user_id):
+        return [user_id]
+
+    partition_keys = (
+        [compose_partition_key(user_id, conversation_id)]
+        if conversation_id is not None
+        else [f"{user_id}#{shard}" for shard in range(PUBLISHED_API_PARTITION_SHARDS)]
+    )
+    if PUBLISHED_API_LEGACY_PARTITION_FALLBACK:
+        partition_keys.append(user_id)
+
+    return partition_keys
+
+
 def compose_conv_id(user_id: str, conversation_id: str):
     # Add user_id prefix for row level security to match with `LeadingKeys` condition
     return f"{user_id}#CONV#{conversation_id}"
@@ -64,6 +126,25 @@ def decompose_related_document_source_id(composed_id: str):
     return composed_id.split("#")[-1]
 
 
+def compose_related_document_content_id(
+    user_id: str,
+    conversation_id: str,
+    content_hash: str,
+):
+    # Add user_id prefix for row level security to match with `LeadingKeys` condition
+    return f"{user_id}#RELATED_DOCUMENT_CONTENT#{conversation_id}#{content_hash}"
+
+
+def compose_idempotency_key_id(user_id: str, conversation_id: str, message_id: str):
+    # Add user_id prefix for row level security to match with `LeadingKeys` condition
+    return f"{user_id}#IDEMPOTENCY#{conversation_id}#{message_id}"
+
+
+def compose_webhook_id(user_id: str, api_key_id: str):
+    # Add user_id prefix for row level security to match with `LeadingKeys` condition
+    return f"{user_id}#WEBHOOK#{api_key_id}"
+
+
 def _get_aws_resource(service_name: str, user_id: Optional[str] = None):
     """Get AWS resource with optional row-level access control for DynamoDB.
     Ref: https://docs.aws.amazon.com/IAM/latest/UserGuide/reference_policies_examples_dynamodb_items.html
@@ -108,7 +189,14 @@ def _get_aws_resource(service_name: str, user_id: Optional[str] = None):
     if user_id:
         policy_document["Statement"][0]["Condition"] = {
             # Allow access to items with the same partition key as the user id
-            "ForAllValues:StringLike": {"dynamodb:LeadingKeys": [f"{user_id}*"]}
+            "ForAllValues:StringLike": {
+                "dynamodb:LeadingKeys": (
+                    # Including the shards, see `compose_partition_key`
+                    [user_id, f"{user_id}#*"]
+                    if is_published_api_user_id(user_id)
+                    else [f"{user_id}*"]
+                )
+            }
         }
 
     sts_client = boto3.client("sts")
@@ -141,3 +229,29 @@ def _get_table_public_client():
     Warning: No row-level access. Use for only limited use case.
     """
     return _get_aws_resource("dynamodb").Table(TABLE_NAME)
+
+
+def _batch_get_items(dynamodb, keys: list[dict], projection: str) -> list[dict]:
+    items: list[dict] = []
+    for i in range(0, len(keys), BATCH_GET_ITEM_SIZE):
+        request_items = {
+            TABLE_NAME: {
+                "Keys": keys[i : i + BATCH_GET_ITEM_SIZE],
+                "ProjectionExpression": projection,
+            }
+        }
+        for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            items.extend(response["Responses"].get(TABLE_NAME, []))
+            request_items = response.get("UnprocessedKeys") or {}
+            if not request_items:
+                break
+
+            # Back off with full jitter before retrying the keys throttled by DynamoDB
+            time.sleep(random.uniform(0, min(2**attempt * 0.1, 5)))
+        else:
+            raise RuntimeError(
+                f"Failed to get {len(request_items[TABLE_NAME]['Keys'])} items after {BATCH_GET_MAX_ATTEMPTS} attempts"
+            )
+
+    return items
@@ -1,26 +1,41 @@
-import json
+import hashlib
 import logging
 import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from decimal import Decimal as decimal
+from threading import Lock
+from typing import Callable, NamedTuple
 
 import boto3
+from app import codec
+from app.logging_utils import summarize
 from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import Binary
 from botocore.exceptions import ClientError
 from pydantic import TypeAdapter
 
 from app.repositories.common import (
+    TABLE_NAME,
     TRANSACTION_BATCH_SIZE,
     RecordNotFoundError,
+    _batch_get_items,
+    _get_aws_resource,
     _get_table_client,
     compose_conv_id,
+    compose_partition_key,
+    compose_related_document_content_id,
+    find_partition_keys,
     decompose_conv_id,
     compose_related_document_source_id,
     decompose_related_document_source_id,
 )
+from app.repositories.large_message_cache import LargeMessageCache
 from app.repositories.models.conversation import (
     ConversationMeta,
     ConversationModel,
     FeedbackModel,
+    LazyMessageMap,
     MessageModel,
     RelatedDocumentModel,
     ToolResultModel,
@@ -30,20 +45,125 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 THRESHOLD_LARGE_MESSAGE = 300 * 1024  # 300KB
+S3_DELETE_OBJECTS_SIZE = 1000
+DELETION_MAX_WORKERS = 8
+DELETION_MAX_ATTEMPTS = 8
 LARGE_MESSAGE_BUCKET = os.environ.get("LARGE_MESSAGE_BUCKET")
 
 BEDROCK_REGION = os.environ.get("BEDROCK_REGION", "us-east-1")
 s3_client = boto3.client("s3", BEDROCK_REGION)
+large_message_cache = LargeMessageCache()
+
+
+def _to_message_map_attribute(encoded: bytes) -> str | bytes:
+    # NOTE: Keep plain JSON as a string attribute for backward compatibility
+    return encoded if codec.is_tagged(encoded) else encoded.decode("utf-8")
+
+
+def _encode_message_map(message_map: dict) -> str | bytes:
+    return _to_message_map_attribute(codec.encode(message_map))
+
+
+def _decode_message_map(attribute: str | Binary | bytes) -> dict:
+    if isinstance(attribute, Binary):
+        # NOTE: The stubs lack `Binary.value`, and type `Binary.__bytes__` as str
+        return codec.decode(attribute.value)  # type: ignore[attr-defined]
+    return codec.decode(attribute)
+
+
+def _get_large_message(large_message_path: str) -> bytes:
+    """Get the large message map from S3, revalidating the cached one if exists."""
+    cached = large_message_cache.get(large_message_path)
+    try:
+        response = s3_client.get_object(
+            Bucket=LARGE_MESSAGE_BUCKET,
+            Key=large_message_path,
+            **({"IfNoneMatch": cached.etag} if cached is not None else {}),
+        )
+    except ClientError as e:
+        # Conditional GET responds with `304 Not Modified` if the cache is fresh
+        if cached is not None and e.response["Error"]["Code"] in (
+            "304",
+            "NotModified",
+        ):
+            logger.info(f"Large message cache hit: {large_message_path}")
+            return cached.body
+        else:
+            raise e
+
+    body = response["Body"].read()
+    large_message_cache.put(large_message_path, response["ETag"], body)
+    return body
+
+
+def _find_conversation_item(
+    table, user_id: str, conversation_id: str, consistent_read: bool = False
+) -> dict | None:
+    """Get the conversation item, looking in the partitions which may hold it.
+    See `find_partition_keys`.
+    """
+    for partition_key in find_partition_keys(user_id, conversation_id):
+        response = table.get_item(
+            Key={"PK": partition_key, "SK": compose_conv_id(user_id, conversation_id)},
+            ConsistentRead=consistent_read,
+        )
+        if "Item" in response:
+            return response["Item"]
+
+    return None
+
+
+def _migrate_conversation_item(table, user_id: str, item: dict) -> dict:
+    """Move a conversation stored before partition sharding, and its related
+    documents, to the sharded partition.
+    """
+    conversation_id = decompose_conv_id(item["SK"])
+    partition_key = compose_partition_key(user_id, conversation_id)
+    if item["PK"] == partition_key:
+        return item
+
+    logger.info(f"Migrating conversation {conversation_id} to {partition_key}")
+    migrated = {**item, "PK": partition_key}
+    try:
+        table.put_item(
+            Item=migrated,
+            # Do not overwrite the conversation if already migrated concurrently
+            ConditionExpression="attribute_not_exists(PK)",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise e
+        # Migrated concurrently, and possibly updated since. Not to return the
+        # stale legacy item, read the migrated one.
+        response = table.get_item(
+            Key={"PK": partition_key, "SK": item["SK"]}, ConsistentRead=True
+        )
+        migrated = response["Item"]
+
+    related_documents = _query_related_document_items(
+        table, item["PK"], f"{user_id}#RELATED_DOCUMENT#{conversation_id}#"
+    )
+    with table.batch_writer() as writer:
+        for related_document in related_documents:
+            writer.put_item(Item={**related_document, "PK": partition_key})
+
+    with table.batch_writer() as writer:
+        for related_document in related_documents:
+            writer.delete_item(Key={"PK": item["PK"], "SK": related_document["SK"]})
+        writer.delete_item(Key={"PK": item["PK"], "SK": item["SK"]})
+
+    return migrated
 
 
 def store_conversation(
     user_id: str, conversation: ConversationModel, threshold=THRESHOLD_LARGE_MESSAGE
 ):
-    logger.info(f"Storing conversation: {conversation.model_dump_json()}")
+    # NOTE: Do not dump the whole conversation here, it hydrates every message
+    logger.info(f"Storing conversation: {conversation.id}")
     table = _get_table_client(user_id)
 
     item_params = {
-        "PK": user_id,
+        "PK": compose_partition_key(user_id, conversation.id),
         "SK": compose_conv_id(user_id, conversation.id),
         "Title": conversation.title,
         "CreateTime": decimal(conversation.create_time),
@@ -57,10 +177,10 @@ def store_conversation(
     if conversation.bot_id:
         item_params["BotId"] = conversation.bot_id
 
-    message_map = {
-        k: v.model_dump(by_alias=True) for k, v in conversation.message_map.items()
-    }
-    message_map_size = len(json.dumps(message_map).encode("utf-8"))
+    message_map = conversation.dump_message_map()
+    # NOTE: The threshold applies to the encoded (and possibly compressed) size
+    encoded_message_map = codec.encode(message_map)
+    message_map_size = len(encoded_message_map)
     logger.info(f"Message map size: {message_map_size}")
     if message_map_size > threshold:
         logger.info(
@@ -70,18 +190,26 @@ def store_conversation(
         large_message_path = f"{user_id}/{conversation.id}/message_map.json"
         item_params["LargeMessagePath"] = large_message_path
         # Store all message in S3
-        s3_client.put_object(
+        response = s3_client.put_object(
             Bucket=LARGE_MESSAGE_BUCKET,
             Key=large_message_path,
-            Body=json.dumps(message_map),
+            Body=encoded_message_map,
         )
+        # The next turn in this container reads it back, so keep it in the cache
+        try:
+            large_message_cache.put(
+                large_message_path, response["ETag"], encoded_message_map
+            )
+        except Exception as e:
+            # Stored already, the cache is only to save the next read
+            logger.warning(f"Failed to cache the large message: {e}")
         # Store only `system` attribute in DynamoDB
-        item_params["MessageMap"] = json.dumps(
+        item_params["MessageMap"] = _encode_message_map(
             {k: v for k, v in message_map.items() if k == "system"}
         )
     else:
         item_params["IsLargeMessage"] = False
-        item_params["MessageMap"] = json.dumps(message_map)
+        item_params["MessageMap"] = _to_message_map_attribute(encoded_message_map)
 
     response = table.put_item(
         Item=item_params,
@@ -93,8 +221,33 @@ def find_conversation_by_user_id(user_id: str) -> list[ConversationMeta]:
     logger.info(f"Finding conversations for user: {user_id}")
     table = _get_table_client(user_id)
 
+    partition_keys = find_partition_keys(user_id)
+    if len(partition_keys) == 1:
+        conversations = _query_conversation_metas(table, user_id, partition_keys[0])
+    else:
+        # Conversations are spread over the shards, so merge them into the
+        # same order as a single partition
+        conversations = sorted(
+            {
+                conversation.id: conversation
+                for partition_key in reversed(partition_keys)
+                for conversation in _query_conversation_metas(
+                    table, user_id, partition_key
+                )
+            }.values(),
+            key=lambda conversation: conversation.id,
+            reverse=True,
+        )
+
+    logger.info("Found conversations: %s", summarize(conversations))
+    return conversations
+
+
+def _query_conversation_metas(
+    table, user_id: str, partition_key: str
+) -> list[ConversationMeta]:
     query_params = {
-        "KeyConditionExpression": Key("PK").eq(user_id)
+        "KeyConditionExpression": Key("PK").eq(partition_key)
         # NOTE: Need SK to fetch only conversations
         & Key("SK").begins_with(f"{user_id}#CONV#"),
         "ScanIndexForward": False,
@@ -107,7 +260,9 @@ def find_conversation_by_user_id(user_id: str) -> list[ConversationMeta]:
             create_time=float(item["CreateTime"]),
             title=item["Title"],
             # NOTE: all message has the same model
-            model=json.loads(item["MessageMap"]).get("system", {}).get("model", ""),
+            model=_decode_message_map(item["MessageMap"])
+            .get("system", {})
+            .get("model", ""),
             bot_id=item["BotId"] if "BotId" in item else None,
         )
         for item in response["Items"]
@@ -117,7 +272,7 @@ def find_conversation_by_user_id(user_id: str) -> list[ConversationMeta]:
     MAX_QUERY_COUNT = 5
     while "LastEvaluatedKey" in response:
         model = (
-            json.loads(response["Items"][0]["MessageMap"])
+            _decode_message_map(response["Items"][0]["MessageMap"])
             .get("system", {})
             .get("model", "")
         )
@@ -144,42 +299,58 @@ def find_conversation_by_user_id(user_id: str) -> list[ConversationMeta]:
             logger.warning(f"Query count exceeded {MAX_QUERY_COUNT}")
             break
 
-    logger.info(f"Found conversations: {conversations}")
     return conversations
 
 
-def find_conversation_by_id(user_id: str, conversation_id: str) -> ConversationModel:
+def find_conversation_by_id(
+    user_id: str,
+    conversation_id: str,
+    lazy: bool = True,
+    consistent_read: bool = False,
+) -> ConversationModel:
+    """Find a conversation.
+    By default, messages are validated lazily on access. Set `lazy` to False to
+    validate all messages up front, e.g. when migrating stored data.
+    Set `consistent_read` to read the conversation just written.
+    """
     logger.info(f"Finding conversation: {conversation_id}")
     table = _get_table_client(user_id)
-    response = table.query(
-        IndexName="SKIndex",
-        KeyConditionExpression=Key("SK").eq(compose_conv_id(user_id, conversation_id)),
-    )
-    if len(response["Items"]) == 0:
+    item = _find_conversation_item(table, user_id, conversation_id, consistent_read)
+    if item is None:
         raise RecordNotFoundError(f"No conversation found with id: {conversation_id}")
 
-    # NOTE: conversation is unique
-    item = response["Items"][0]
+    item = _migrate_conversation_item(table, user_id, item)
     if item.get("IsLargeMessage", False):
-        large_message_path = item["LargeMessagePath"]
-        response = s3_client.get_object(
-            Bucket=LARGE_MESSAGE_BUCKET, Key=large_message_path
+        message_map = codec.decode(_get_large_message(item["LargeMessagePath"]))
+    else:
+        message_map = _decode_message_map(item["MessageMap"])
+
+    if not lazy:
+        conv = ConversationModel(
+            id=decompose_conv_id(item["SK"]),
+            create_time=float(item["CreateTime"]),
+            title=item["Title"],
+            total_price=item.get("TotalPrice", 0),
+            message_map={
+                k: MessageModel.model_validate(v) for k, v in message_map.items()
+            },
+            last_message_id=item["LastMessageId"],
+            bot_id=item["BotId"] if "BotId" in item else None,
+            should_continue=item.get("ShouldContinue", False),
         )
-        message_map = json.loads(response["Body"].read().decode("utf-8"))
     else:
-        message_map = json.loads(item["MessageMap"])
-
-    conv = ConversationModel(
-        id=decompose_conv_id(item["SK"]),
-        create_time=float(item["CreateTime"]),
-        title=item["Title"],
-        total_price=item.get("TotalPrice", 0),
-        message_map={k: MessageModel.model_validate(v) for k, v in message_map.items()},
-        last_message_id=item["LastMessageId"],
-        bot_id=item["BotId"] if "BotId" in item else None,
-        should_continue=item.get("ShouldContinue", False),
-    )
-    logger.info(f"Found conversation: {conv}")
+        conv = ConversationModel.model_construct(
+            id=decompose_conv_id(item["SK"]),
+            create_time=float(item["CreateTime"]),
+            title=item["Title"],
+            total_price=float(item.get("TotalPrice", 0)),
+            message_map=LazyMessageMap(message_map),
+            last_message_id=item["LastMessageId"],
+            bot_id=item["BotId"] if "BotId" in item else None,
+            should_continue=bool(item.get("ShouldContinue", False)),
+        )
+
+    logger.info(f"Found conversation: {conv.id}")
     return conv
 
 
@@ -189,21 +360,24 @@ def delete_conversation_by_id(user_id: str, conversation_id: str):
 
     try:
         # Check if the conversation has a large message map
-        response = table.get_item(
-            Key={"PK": user_id, "SK": compose_conv_id(user_id, conversation_id)},
-            ProjectionExpression="IsLargeMessage, LargeMessagePath",
-        )
-
-        item = response.get("Item")
+        item = _find_conversation_item(table, user_id, conversation_id)
         if item and item.get("IsLargeMessage", False):
             # Delete the large message map from S3
             s3_client.delete_object(
                 Bucket=LARGE_MESSAGE_BUCKET, Key=item["LargeMessagePath"]
             )
+            large_message_cache.delete(item["LargeMessagePath"])
 
         # Delete the conversation from DynamoDB
         response = table.delete_item(
-            Key={"PK": user_id, "SK": compose_conv_id(user_id, conversation_id)},
+            Key={
+                "PK": (
+                    item["PK"]
+                    if item
+                    else compose_partition_key(user_id, conversation_id)
+                ),
+                "SK": compose_conv_id(user_id, conversation_id),
+            },
             ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
         )
         delete_related_documents(
@@ -222,67 +396,225 @@ def delete_conversation_by_id(user_id: str, conversation_id: str):
     return response
 
 
-def delete_conversation_by_user_id(user_id: str):
-    logger.info(f"Deleting ALL conversations for user: {user_id}")
-    table = _get_table_client(user_id)
-
-    query_params = {
-        "KeyConditionExpression": Key("PK").eq(user_id)
-        # NOTE: Need SK to fetch only conversations
-        & Key("SK").begins_with(f"{user_id}#CONV#"),
-        "ProjectionExpression": "SK, IsLargeMessage, LargeMessagePath",
-    }
+class DeletionProgress(NamedTuple):
+    deleted_items: int
+    deleted_objects: int
+
+
+class _BulkDeleter:
+    """Delete items and large message objects in parallel while paging.
+    Items are deleted with BatchWriteItem in segments of 25 and large message
+    objects with DeleteObjects in groups of 1,000. An item is deleted only after
+    its large message object, so that a deletion stopped halfway can be resumed
+    by running it again.
+    """
+
+    def __init__(
+        self,
+        table,
+        on_progress: Callable[[DeletionProgress], None] | None = None,
+    ):
+        # NOTE: Use the low-level client, which is thread safe unlike resources
+        self.client = table.meta.client
+        self.on_progress = on_progress
+
+        self._executor = ThreadPoolExecutor(max_workers=DELETION_MAX_WORKERS)
+        self._futures: list[Future] = []
+        # Items to be deleted, submitted in full segments
+        self._ready_keys: list[dict] = []
+        # Items waiting for their large message objects to be deleted
+        self._pending_keys: list[dict] = []
+        self._pending_paths: list[str] = []
+        self._lock = Lock()
+        self._deleted_items = 0
+        self._deleted_objects = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self._executor.shutdown(wait=True, cancel_futures=exc_type is not None)
+
+    @property
+    def progress(self) -> DeletionProgress:
+        with self._lock:
+            return DeletionProgress(self._deleted_items, self._deleted_objects)
+
+    def delete(self, key: dict, large_message_path: str | None = None):
+        if large_message_path is None:
+            self._ready_keys.append(key)
+            self._submit_items()
+            return
+
+        self._pending_keys.append(key)
+        self._pending_paths.append(large_message_path)
+        if len(self._pending_paths) >= S3_DELETE_OBJECTS_SIZE:
+            self._flush_large_messages()
+
+    def flush(self):
+        self._flush_large_messages()
+        self._submit_items(flush=True)
+        for future in self._futures:
+            future.result()
+
+        self._futures = []
+
+    def _flush_large_messages(self):
+        if self._pending_paths:
+            self._delete_objects(self._pending_paths)
+            self._ready_keys.extend(self._pending_keys)
+            self._submit_items()
+
+        self._pending_keys = []
+        self._pending_paths = []
+
+    def _submit_items(self, flush: bool = False):
+        """Submit the ready items in full segments, and the rest too if `flush`."""
+        while len(self._ready_keys) >= TRANSACTION_BATCH_SIZE or (
+            flush and self._ready_keys
+        ):
+            keys = self._ready_keys[:TRANSACTION_BATCH_SIZE]
+            self._ready_keys = self._ready_keys[TRANSACTION_BATCH_SIZE:]
+            self._futures.append(self._executor.submit(self._batch_delete_items, keys))
+
+        # Raise errors early and bound the number of segments in flight
+        while len(self._futures) > DELETION_MAX_WORKERS * 2:
+            self._futures.pop(0).result()
+
+    def _batch_delete_items(self, keys: list[dict]):
+        request_items = {
+            # NOTE: The client of a resource takes plain values, as the resource does
+            TABLE_NAME: [{"DeleteRequest": {"Key": dict(key)}} for key in keys]
+        }
+        for attempt in range(DELETION_MAX_ATTEMPTS):
+            response = self.client.batch_write_item(RequestItems=request_items)
+            request_items = response.get("UnprocessedItems") or {}
+            if not request_items:
+                break
 
-    def delete_batch(batch):
-        with table.batch_writer() as writer:
-            for item in batch:
-                writer.delete_item(Key={"PK": user_id, "SK": item["SK"]})
+            # Back off before retrying the items throttled by DynamoDB
+            time.sleep(min(2**attempt * 0.1, 5))
+        else:
+            raise RuntimeError(
+                f"Failed to delete {len(request_items[TABLE_NAME])} items after {DELETION_MAX_ATTEMPTS} attempts"
+            )
 
-    def delete_large_messages(items):
-        for item in items:
-            if item.get("IsLargeMessage", False):
-                s3_client.delete_object(
-                    Bucket=LARGE_MESSAGE_BUCKET, Key=item["LargeMessagePath"]
-                )
+        self._report(deleted_items=len(keys))
 
-    try:
-        response = table.query(
-            **query_params,
+    def _delete_objects(self, paths: list[str]):
+        response = s3_client.delete_objects(
+            Bucket=LARGE_MESSAGE_BUCKET,
+            Delete={"Objects": [{"Key": path} for path in paths], "Quiet": True},
         )
+        errors = response.get("Errors") or []
+        if errors:
+            raise RuntimeError(f"Failed to delete large messages: {errors[:5]}")
 
-        while True:
-            items = response.get("Items", [])
-            delete_large_messages(items)
+        for path in paths:
+            large_message_cache.delete(path)
 
-            for i in range(0, len(items), TRANSACTION_BATCH_SIZE):
-                batch = items[i : i + TRANSACTION_BATCH_SIZE]
-                delete_batch(batch)
+        self._report(deleted_objects=len(paths))
+
+    def _report(self, deleted_items: int = 0, deleted_objects: int = 0):
+        with self._lock:
+            self._deleted_items += deleted_items
+            self._deleted_objects += deleted_objects
+            progress = DeletionProgress(self._deleted_items, self._deleted_objects)
+
+        if self.on_progress:
+            self.on_progress(progress)
+
+
+def _query_pages(table, partition_key: str, sort_key_prefix: str, projection: str):
+    """Query the items page by page, to delete them while paging."""
+    query_params = {
+        "KeyConditionExpression": Key("PK").eq(partition_key)
+        & Key("SK").begins_with(sort_key_prefix),
+        "ProjectionExpression": projection,
+    }
+    while True:
+        response = table.query(**query_params)
+        yield response.get("Items", [])
+
+        if "LastEvaluatedKey" not in response:
+            break
+
+        query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
 
-            # Check if next page exists
-            if "LastEvaluatedKey" not in response:
-                break
 
-            # Load next page
-            query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
-            response = table.query(
-                **query_params,
+def _delete_related_document_items(
+    deleter: _BulkDeleter, table, user_id: str, conversation_id: str | None = None
+):
+    for partition_key in find_partition_keys(user_id, conversation_id):
+        for kind in ["RELATED_DOCUMENT", "RELATED_DOCUMENT_CONTENT"]:
+            sort_key_prefix = (
+                f"{user_id}#{kind}#{conversation_id}#"
+                if conversation_id
+                else f"{user_id}#{kind}#"
             )
+            for items in _query_pages(table, partition_key, sort_key_prefix, "SK"):
+                for item in items:
+                    deleter.delete({"PK": partition_key, "SK": item["SK"]})
 
-        delete_related_documents(user_id=user_id)
+
+def delete_conversation_by_user_id(
+    user_id: str,
+    on_progress: Callable[[DeletionProgress], None] | None = None,
+) -> DeletionProgress:
+    """Delete all conversations of the user with their related documents.
+    Items are deleted while paging, so running it again after an interruption
+    resumes the deletion.
+    """
+    logger.info(f"Deleting ALL conversations for user: {user_id}")
+    table = _get_table_client(user_id)
+
+    try:
+        with _BulkDeleter(table, on_progress=on_progress) as deleter:
+            for partition_key in find_partition_keys(user_id):
+                for items in _query_pages(
+                    table,
+                    partition_key,
+                    # NOTE: Need SK to fetch only conversations
+                    f"{user_id}#CONV#",
+                    "PK, SK, IsLargeMessage, LargeMessagePath",
+                ):
+                    for item in items:
+                        deleter.delete(
+                            {"PK": item["PK"], "SK": item["SK"]},
+                            large_message_path=(
+                                item["LargeMessagePath"]
+                                if item.get("IsLargeMessage", False)
+                                else None
+                            ),
+                        )
+
+            _delete_related_document_items(deleter, table, user_id)
 
     except ClientError as e:
         logger.error(f"An error occurred: {e.response['Error']['Message']}")
         raise e
 
+    logger.info(f"Deleted conversations for user {user_id}: {deleter.progress}")
+    return deleter.progress
+
 
 def change_conversation_title(user_id: str, conversation_id: str, new_title: str):
     logger.info(f"Updating conversation title: {conversation_id} to {new_title}")
     table = _get_table_client(user_id)
+    item = _find_conversation_item(table, user_id, conversation_id)
 
     try:
         response = table.update_item(
             Key={
-                "PK": user_id,
+                "PK": (
+                    item["PK"]
+                    if item
+                    else compose_partition_key(user_id, conversation_id)
+                ),
                 "SK": compose_conv_id(user_id, conversation_id),
             },
             UpdateExpression="set Title=:t",
@@ -298,7 +630,7 @@ def change_conversation_title(user_id: str, conversation_id: str, new_title: str
         else:
             raise e
 
-    logger.info(f"Updated conversation title response: {response}")
+    logger.info("Updated conversation title response: %s", summarize(response))
 
     return response
 
@@ -308,38 +640,90 @@ def update_feedback(
 ):
     logger.info(f"Updating feedback for conversation: {conversation_id}")
     table = _get_table_client(user_id)
-    conv = find_conversation_by_id(user_id, conversation_id)
+    # NOTE: Read-modify-write, so read the latest conversation
+    conv = find_conversation_by_id(user_id, conversation_id, consistent_read=True)
     message_map = conv.message_map
     message_map[message_id].feedback = feedback
 
     response = table.update_item(
         Key={
-            "PK": user_id,
+            # NOTE: `find_conversation_by_id` has migrated the conversation if needed
+            "PK": compose_partition_key(user_id, conversation_id),
             "SK": compose_conv_id(user_id, conversation_id),
         },
         UpdateExpression="set MessageMap = :m",
-        ExpressionAttributeValues={
-            ":m": json.dumps(
-                {k: v.model_dump(by_alias=True) for k, v in message_map.items()}
-            )
-        },
+        ExpressionAttributeValues={":m": _encode_message_map(conv.dump_message_map())},
         ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
         ReturnValues="UPDATED_NEW",
     )
-    logger.info(f"Updated feedback response: {response}")
+    logger.info("Updated feedback response: %s", summarize(response))
     return response
 
 
+def _hash_content(content: dict) -> str:
+    return hashlib.sha256(codec.dumps(content)).hexdigest()
+
+
 def store_related_documents(
     user_id: str,
     conversation_id: str,
     related_documents: list[RelatedDocumentModel],
 ):
-    table = _get_table_client(user_id)
+    """Store related documents of a turn.
+    The same chunk is often cited turn after turn, so the contents are stored once
+    per conversation keyed by their hash, and referred from the per-turn items.
+    """
+    dynamodb = _get_aws_resource("dynamodb", user_id=user_id)
+    table = dynamodb.Table(TABLE_NAME)
+    partition_key = compose_partition_key(user_id, conversation_id)
+
+    contents: dict[str, dict] = {}
+    content_hashes: list[str] = []
+    for related_document in related_documents:
+        content = related_document.content.model_dump(by_alias=True)
+        content_hash = _hash_content(content)
+        contents.setdefault(content_hash, content)
+        content_hashes.append(content_hash)
+
+    # NOTE: Reading the keys is cheaper than writing the contents again
+    stored_content_ids = {
+        item["SK"]
+        for item in _batch_get_items(
+            dynamodb,
+            [
+                {
+                    "PK": partition_key,
+                    "SK": compose_related_document_content_id(
+                        user_id=user_id,
+                        conversation_id=conversation_id,
+                        content_hash=content_hash,
+                    ),
+                }
+                for content_hash in contents.keys()
+            ],
+            projection="SK",
+        )
+    }
+
     with table.batch_writer() as writer:
-        for related_document in related_documents:
+        for content_hash, content in contents.items():
+            content_id = compose_related_document_content_id(
+                user_id=user_id,
+                conversation_id=conversation_id,
+                content_hash=content_hash,
+            )
+            if content_id not in stored_content_ids:
+                writer.put_item(
+                    Item={
+                        "PK": partition_key,
+                        "SK": content_id,
+                        "Content": content,
+                    }
+                )
+
+        for related_document, content_hash in zip(related_documents, content_hashes):
             item_params = {
-                "PK": user_id,
+                "PK": partition_key,
                 "SK": compose_related_document_source_id(
                     user_id=user_id,
                     conversation_id=conversation_id,
@@ -347,28 +731,72 @@ def store_related_documents(
                 ),
                 "SourceName": related_document.source_name,
                 "SourceLink": related_document.source_link,
-                "Content": related_document.content.model_dump(by_alias=True),
+                "ContentHash": content_hash,
             }
             writer.put_item(Item=item_params)
 
 
+def _to_related_document(item: dict, content: dict) -> RelatedDocumentModel:
+    return RelatedDocumentModel(
+        content=TypeAdapter(ToolResultModel).validate_python(content),
+        source_id=decompose_related_document_source_id(composed_id=item["SK"]),
+        source_name=item["SourceName"],
+        source_link=item["SourceLink"],
+    )
+
+
 def find_related_documents_by_conversation_id(
     user_id: str,
     conversation_id: str,
 ) -> list[RelatedDocumentModel]:
     table = _get_table_client(user_id)
-    related_documents: list[RelatedDocumentModel] = []
+
+    items: list[dict] = []
+    for partition_key in find_partition_keys(user_id, conversation_id):
+        items = _query_related_document_items(
+            table,
+            partition_key,
+            f"{user_id}#RELATED_DOCUMENT#{conversation_id}#",
+        )
+        if items:
+            break
+
+    contents: dict[str, dict] = {}
+    if any("Content" not in item for item in items):
+        contents = {
+            decompose_related_document_source_id(composed_id=content_item["SK"]): (
+                content_item["Content"]
+            )
+            for content_item in _query_related_document_items(
+                table,
+                items[0]["PK"],
+                f"{user_id}#RELATED_DOCUMENT_CONTENT#{conversation_id}#",
+            )
+        }
+
+    return [
+        _to_related_document(
+            item,
+            # NOTE: Documents stored before deduplication have the content inline
+            item["Content"] if "Content" in item else contents[item["ContentHash"]],
+        )
+        for item in items
+    ]
+
+
+def _query_related_document_items(
+    table, partition_key: str, sort_key_prefix: str, projection: str | None = None
+) -> list[dict]:
+    items: list[dict] = []
 
     last_evaluated_key = None
     while True:
         response = table.query(
             KeyConditionExpression=(
-                Key("PK").eq(user_id)
-                & Key("SK").begins_with(
-                    f"{user_id}#RELATED_DOCUMENT#{conversation_id}#"
-                )
+                Key("PK").eq(partition_key) & Key("SK").begins_with(sort_key_prefix)
             ),
             ScanIndexForward=False,
+            **({"ProjectionExpression": projection} if projection is not None else {}),
             **(
                 {
                     "ExclusiveStartKey": last_evaluated_key,
@@ -377,91 +805,97 @@ def find_related_documents_by_conversation_id(
                 else {}
             ),
         )
-        related_documents.extend(
-            RelatedDocumentModel(
-                content=TypeAdapter(ToolResultModel).validate_python(item["Content"]),
-                source_id=decompose_related_document_source_id(composed_id=item["SK"]),
-                source_name=item["SourceName"],
-                source_link=item["SourceLink"],
-            )
-            for item in response.get("Items") or []
-        )
+        items.extend(response.get("Items") or [])
 
         last_evaluated_key = response.get("LastEvaluatedKey")
         if last_evaluated_key is None:
             break
 
-    return related_documents
+    return items
 
 
 def find_related_document_by_id(
     user_id: str,
     conversation_id: str,
     source_id: str,
+    consistent_read: bool = False,
 ) -> RelatedDocumentModel:
     table = _get_table_client(user_id)
-    response = table.query(
-        IndexName="SKIndex",
-        KeyConditionExpression=(
-            Key("SK").eq(
-                compose_related_document_source_id(
+    for partition_key in find_partition_keys(user_id, conversation_id):
+        response = table.get_item(
+            Key={
+                "PK": partition_key,
+                "SK": compose_related_document_source_id(
                     user_id=user_id,
                     conversation_id=conversation_id,
                     source_id=source_id,
-                )
-            )
-        ),
-    )
-    if len(response["Items"]) == 0:
+                ),
+            },
+            ConsistentRead=consistent_read,
+        )
+        if "Item" in response:
+            break
+
+    else:
         raise RecordNotFoundError(
             f"No related document found with id: {conversation_id}#{source_id}"
         )
 
-    item = response["Items"][0]
-    return RelatedDocumentModel(
-        content=TypeAdapter(ToolResultModel).validate_python(item["Content"]),
-        source_id=source_id,
-        source_name=item["SourceName"],
-        source_link=item["SourceLink"],
+    item = response["Item"]
+    if "Content" in item:
+        # Stored before deduplication
+        return _to_related_document(item, item["Content"])
+
+    content_response = table.get_item(
+        Key={
+            "PK": partition_key,
+            "SK": compose_related_document_content_id(
+                user_id=user_id,
+                conversation_id=conversation_id,
+                content_hash=item["ContentHash"],
+            ),
+        },
+        ConsistentRead=consistent_read,
     )
+    if "Item" not in content_response:
+        raise RecordNotFoundError(
+            f"No related document content found with id: {conversation_id}#{source_id}"
+        )
 
+    return _to_related_document(item, content_response["Item"]["Content"])
 
-def delete_related_documents(user_id: str, conversation_id: str | None = None):
-    table = _get_table_client(user_id)
-    sort_keys: list[str] = []
 
-    last_evaluated_key = None
-    while True:
-        response = table.query(
-            KeyConditionExpression=(
-                Key("PK").eq(user_id)
-                & Key("SK").begins_with(
-                    f"{user_id}#RELATED_DOCUMENT#{conversation_id}#"
-                    if conversation_id
-                    else f"{user_id}#RELATED_DOCUMENT#"
-                )
-            ),
-            ProjectionExpression="SK",
-            ScanIndexForward=False,
-            **(
-                {
-                    "ExclusiveStartKey": last_evaluated_key,
-                }
-                if last_evaluated_key is not None
-                else {}
+def find_related_document_source_links(
+    user_id: str,
+    conversation_id: str,
+    source_ids: list[str],
+) -> dict[str, str]:
+    """Find the source links of the given related documents, keyed by source id.
+    Only the links are read, not the contents. Missing documents are omitted.
+    """
+    dynamodb = _get_aws_resource("dynamodb", user_id=user_id)
+    # NOTE: Conversations read before are already in their own partition,
+    # see `_migrate_conversation_item`
+    partition_key = compose_partition_key(user_id, conversation_id)
+    keys = [
+        {
+            "PK": partition_key,
+            "SK": compose_related_document_source_id(
+                user_id=user_id,
+                conversation_id=conversation_id,
+                source_id=source_id,
             ),
-        )
-        sort_keys.extend(item["SK"] for item in response.get("Items") or [])
+        }
+        for source_id in dict.fromkeys(source_ids)
+    ]
 
-        last_evaluated_key = response.get("LastEvaluatedKey")
-        if last_evaluated_key is None:
-            break
+    return {
+        decompose_related_document_source_id(composed_id=item["SK"]): item["SourceLink"]
+        for item in _batch_get_items(dynamodb, keys, projection="SK, SourceLink")
+    }
 
-    with table.batch_writer() as writer:
-        for sort_key in sort_keys:
-            writer.delete_item(
-                Key={
-                    "PK": user_id,
-                    "SK": sort_key,
-                },
-            )
+
+def delete_related_documents(user_id: str, conversation_id: str | None = None):
+    table = _get_table_client(user_id)
+    with _BulkDeleter(table) as deleter:
+        _delete_related_document_items(deleter, table, user_id, conversation_id)
@@ -11,6 +11,7 @@ from typing import Literal
 import boto3
 from app.config import DEFAULT_GENERATION_CONFIG as DEFAULT_CLAUDE_GENERATION_CONFIG
 from app.config import DEFAULT_MISTRAL_GENERATION_CONFIG
+from app.logging_utils import summarize
 from app.repositories.common import (
     RecordNotFoundError,
     _get_table_client,
@@ -36,11 +37,13 @@ from app.repositories.models.custom_bot_guardrails import BedrockGuardrailsModel
 from app.repositories.models.custom_bot_kb import BedrockKnowledgeBaseModel
 from app.routes.schemas.bot import BotMetaOutput, type_sync_status
 from app.utils import get_current_time
-from boto3.dynamodb.conditions import Attr, Key
+from boto3.dynamodb.conditions import Attr, ConditionBase, Key
 from botocore.exceptions import ClientError
 
 TABLE_NAME = os.environ.get("TABLE_NAME", "")
 ENABLE_MISTRAL = os.environ.get("ENABLE_MISTRAL", "") == "true"
+# Only the published bots have this attribute, so that `PublishedBotIndex` is sparse
+PUBLISHED_BOT_PARTITION = "PUBLISHED_BOT"
 
 DEFAULT_GENERATION_CONFIG = (
     DEFAULT_MISTRAL_GENERATION_CONFIG
@@ -66,7 +69,7 @@ class BotUpdateError(Exception):
 
 def store_bot(user_id: str, custom_bot: BotModel):
     table = _get_table_client(user_id)
-    logger.info(f"Storing bot: {custom_bot}")
+    logger.info("Storing bot: %s", summarize(custom_bot))
 
     item = {
         "PK": user_id,
@@ -83,15 +86,21 @@ def store_bot(user_id: str, custom_bot: BotModel):
         "SyncStatus": custom_bot.sync_status,
         "SyncStatusReason": custom_bot.sync_status_reason,
         "LastExecId": custom_bot.sync_last_exec_id,
-        "ApiPublishmentStackName": custom_bot.published_api_stack_name,
-        "ApiPublishedDatetime": custom_bot.published_api_datetime,
-        "ApiPublishCodeBuildId": custom_bot.published_api_codebuild_id,
         "DisplayRetrievedChunks": custom_bot.display_retrieved_chunks,
         "ConversationQuickStarters": [
             starter.model_dump() for starter in custom_bot.conversation_quick_starters
         ],
         "ActiveModels": custom_bot.active_models.model_dump(),  # type: ignore[attr-defined]
     }
+    # NOTE: `ApiPublishedDatetime` is the sort key of `PublishedBotIndex`, which
+    # must be a number if exists. Omit the publication of unpublished bots.
+    for name, value in [
+        ("ApiPublishmentStackName", custom_bot.published_api_stack_name),
+        ("ApiPublishedDatetime", custom_bot.published_api_datetime),
+        ("ApiPublishCodeBuildId", custom_bot.published_api_codebuild_id),
+    ]:
+        if value is not None:
+            item[name] = value
     if custom_bot.bedrock_knowledge_base:
         item["BedrockKnowledgeBase"] = custom_bot.bedrock_knowledge_base.model_dump()
     if custom_bot.bedrock_guardrails:
@@ -184,7 +193,7 @@ def update_bot(
 
 def store_alias(user_id: str, alias: BotAliasModel):
     table = _get_table_client(user_id)
-    logger.info(f"Storing alias: {alias}")
+    logger.info("Storing alias: %s", summarize(alias))
 
     item = {
         "PK": user_id,
@@ -414,21 +423,23 @@ def find_private_bots_by_user_id(
     if limit:
         bots = bots[:limit]
 
-    logger.info(f"Found all private bots: {bots}")
+    logger.info("Found all private bots: %s", summarize(bots))
     return bots
 
 
-def find_private_bot_by_id(user_id: str, bot_id: str) -> BotModel:
+def find_private_bot_by_id(
+    user_id: str, bot_id: str, consistent_read: bool = False
+) -> BotModel:
     """Find private bot."""
     table = _get_table_client(user_id)
     logger.info(f"Finding bot with id: {bot_id}")
-    response = table.query(
-        IndexName="SKIndex",
-        KeyConditionExpression=Key("SK").eq(compose_bot_id(user_id, bot_id)),
+    response = table.get_item(
+        Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
+        ConsistentRead=consistent_read,
     )
-    if len(response["Items"]) == 0:
+    if "Item" not in response:
         raise RecordNotFoundError(f"Bot with id {bot_id} not found")
-    item = response["Items"][0]
+    item = response["Item"]
 
     if "OriginalBotId" in item:
         raise RecordNotFoundError(f"Bot with id {bot_id} is alias")
@@ -498,7 +509,7 @@ def find_private_bot_by_id(user_id: str, bot_id: str) -> BotModel:
         ),
     )
 
-    logger.info(f"Found bot: {bot}")
+    logger.info("Found bot: %s", summarize(bot))
     return bot
 
 
@@ -579,21 +590,23 @@ def find_public_bot_by_id(bot_id: str) -> BotModel:
             else default_active_models  # for backward compatibility
         ),
     )
-    logger.info(f"Found public bot: {bot}")
+    logger.info("Found public bot: %s", summarize(bot))
     return bot
 
 
-def find_alias_by_id(user_id: str, alias_id: str) -> BotAliasModel:
+def find_alias_by_id(
+    user_id: str, alias_id: str, consistent_read: bool = False
+) -> BotAliasModel:
     """Find alias bot by id."""
     table = _get_table_client(user_id)
     logger.info(f"Finding alias bot with id: {alias_id}")
-    response = table.query(
-        IndexName="SKIndex",
-        KeyConditionExpression=Key("SK").eq(compose_bot_alias_id(user_id, alias_id)),
+    response = table.get_item(
+        Key={"PK": user_id, "SK": compose_bot_alias_id(user_id, alias_id)},
+        ConsistentRead=consistent_read,
     )
-    if len(response["Items"]) == 0:
+    if "Item" not in response:
         raise RecordNotFoundError(f"Alias bot with id {alias_id} not found")
-    item = response["Items"][0]
+    item = response["Item"]
 
     bot = BotAliasModel(
         id=decompose_bot_alias_id(item["SK"]),
@@ -614,7 +627,7 @@ def find_alias_by_id(user_id: str, alias_id: str) -> BotAliasModel:
         ),
     )
 
-    logger.info(f"Found alias: {bot}")
+    logger.info("Found alias: %s", summarize(bot))
     return bot
 
 
@@ -623,13 +636,7 @@ def update_bot_visibility(user_id: str, bot_id: str, visible: bool):
     table = _get_table_client(user_id)
     logger.info(f"Making bot public: {bot_id}")
 
-    response = table.query(
-        IndexName="SKIndex",
-        KeyConditionExpression=Key("SK").eq(compose_bot_id(user_id, bot_id)),
-    )
-    if len(response["Items"]) == 0:
-        raise RecordNotFoundError(f"Bot with id {bot_id} not found")
-
+    # NOTE: Missing bot is detected by the condition expression
     try:
         if visible:
             # To visible (open to public)
@@ -665,13 +672,14 @@ def update_bot_publication(
     try:
         response = table.update_item(
             Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
-            UpdateExpression="SET ApiPublishmentStackName = :val, ApiPublishedDatetime = :time, ApiPublishCodeBuildId = :build_id",
+            UpdateExpression="SET ApiPublishmentStackName = :val, ApiPublishedDatetime = :time, ApiPublishCodeBuildId = :build_id, PublishedBotPartition = :partition",
             # NOTE: Stack naming rule: ApiPublishmentStack{published_api_id}.
             # See bedrock-chat-stack.ts > `ApiPublishmentStack`
             ExpressionAttributeValues={
                 ":val": f"ApiPublishmentStack{published_api_id}",
                 ":time": current_time,
                 ":build_id": build_id,
+                ":partition": PUBLISHED_BOT_PARTITION,
             },
             ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
         )
@@ -690,7 +698,7 @@ def delete_bot_publication(user_id: str, bot_id: str):
     try:
         response = table.update_item(
             Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
-            UpdateExpression="REMOVE ApiPublishmentStackName, ApiPublishedDatetime, ApiPublishCodeBuildId",
+            UpdateExpression="REMOVE ApiPublishmentStackName, ApiPublishedDatetime, ApiPublishCodeBuildId, PublishedBotPartition",
             ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
         )
     except ClientError as e:
@@ -786,13 +794,15 @@ async def find_public_bots_by_ids(bot_ids: list[str]) -> list[BotMetaWithStackIn
 def find_all_published_bots(
     limit: int = 1000, next_token: str | None = None
 ) -> tuple[list[BotMetaWithStackInfo], str | None]:
-    """Find all published bots. This method is intended for administrator use."""
+    """Find all published bots, newest first. This method is intended for administrator use."""
     table = _get_table_public_client()
 
     query_params = {
-        "IndexName": "PublicBotIdIndex",
-        "FilterExpression": Attr("ApiPublishmentStackName").exists()
-        & Attr("ApiPublishmentStackName").ne(None),
+        "IndexName": "PublishedBotIndex",
+        "KeyConditionExpression": Key("PublishedBotPartition").eq(
+            PUBLISHED_BOT_PARTITION
+        ),
+        "ScanIndexForward": False,
         "Limit": limit,
     }
     if next_token:
@@ -800,7 +810,7 @@ def find_all_published_bots(
             base64.b64decode(next_token).decode("utf-8")
         )
 
-    response = table.scan(**query_params)
+    response = table.query(**query_params)
 
     bots = [
         BotMetaWithStackInfo(
@@ -826,8 +836,74 @@ def find_all_published_bots(
 
     next_token = None
     if "LastEvaluatedKey" in response:
+        # NOTE: `ApiPublishedDatetime` is a number, which is epoch milliseconds
         next_token = base64.b64encode(
-            json.dumps(response["LastEvaluatedKey"]).encode("utf-8")
+            json.dumps(response["LastEvaluatedKey"], default=int).encode("utf-8")
         ).decode("utf-8")
 
     return bots, next_token
+
+
+def backfill_published_bot_index() -> int:
+    """Add the bots published before `PublishedBotIndex` to the index, and remove the
+    null publication attributes of the other bots, which are not allowed for the
+    sort key of the index.
+    Run once after the deployment which adds the index. Returns the number of bots added.
+    """
+    table = _get_table_public_client()
+
+    publication_attributes = [
+        "ApiPublishmentStackName",
+        "ApiPublishedDatetime",
+        "ApiPublishCodeBuildId",
+    ]
+    published = (
+        Attr("ApiPublishmentStackName").exists()
+        & Attr("ApiPublishmentStackName").ne(None)
+        & Attr("PublishedBotPartition").not_exists()
+    )
+    has_null: ConditionBase = Attr(publication_attributes[0]).attribute_type("NULL")
+    for name in publication_attributes[1:]:
+        has_null |= Attr(name).attribute_type("NULL")
+
+    scan_params = {
+        "FilterExpression": published | has_null,
+        "ProjectionExpression": ", ".join(["PK", "SK", *publication_attributes]),
+    }
+    count = 0
+    while True:
+        response = table.scan(**scan_params)
+        for item in response["Items"]:
+            update_params: dict = {
+                "Key": {"PK": item["PK"], "SK": item["SK"]},
+                # Not to recreate a bot deleted after the scan
+                "ConditionExpression": "attribute_exists(PK)",
+            }
+            clauses = []
+            is_published = item.get("ApiPublishmentStackName") is not None
+            if is_published:
+                clauses.append("SET PublishedBotPartition = :partition")
+                update_params["ExpressionAttributeValues"] = {
+                    ":partition": PUBLISHED_BOT_PARTITION
+                }
+            null_attributes = [
+                name
+                for name in publication_attributes
+                if name in item and item[name] is None
+            ]
+            if null_attributes:
+                clauses.append(f"REMOVE {', '.join(null_attributes)}")
+
+            try:
+                table.update_item(UpdateExpression=" ".join(clauses), **update_params)
+                if is_published:
+                    count += 1
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise e
+                logger.info(f"Bot {item['SK']} has been deleted")
+
+        if "LastEvaluatedKey" not in response:
+            return count
+
+        scan_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
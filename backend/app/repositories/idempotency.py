@@ -0,0 +1,149 @@
+import logging
+import time
+
+from botocore.exceptions import ClientError
+
+from app.repositories.common import (
+    RecordNotFoundError,
+    _get_table_client,
+    compose_idempotency_key_id,
+    compose_partition_key,
+)
+from app.repositories.models.idempotency import MessageStatusModel
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# A turn which is still in progress after the lease, e.g. because the Lambda
+# timed out, may be processed again. Same as the maximum Lambda timeout.
+IDEMPOTENCY_LEASE_SECONDS = 15 * 60
+# Removed by the table TTL after this period
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+
+STATUS_PENDING = "PENDING"
+STATUS_IN_PROGRESS = "IN_PROGRESS"
+STATUS_COMPLETED = "COMPLETED"
+STATUS_FAILED = "FAILED"
+
+
+def _compose_key(user_id: str, conversation_id: str, message_id: str):
+    return {
+        "PK": compose_partition_key(user_id, conversation_id),
+        "SK": compose_idempotency_key_id(user_id, conversation_id, message_id),
+    }
+
+
+def _to_message_status(item: dict) -> MessageStatusModel:
+    return MessageStatusModel(
+        status=item["Status"],
+        api_key_id=item.get("ApiKeyId"),
+    )
+
+
+def store_pending_message(
+    user_id: str,
+    conversation_id: str,
+    message_id: str,
+    api_key_id: str | None = None,
+):
+    """Record a message accepted for asynchronous processing.
+    The item is the idempotency key of the message as well.
+    """
+    table = _get_table_client(user_id)
+    item = {
+        **_compose_key(user_id, conversation_id, message_id),
+        "Status": STATUS_PENDING,
+        "expire": int(time.time()) + IDEMPOTENCY_TTL_SECONDS,
+    }
+    if api_key_id:
+        item["ApiKeyId"] = api_key_id
+
+    table.put_item(Item=item)
+
+
+def find_message_status(
+    user_id: str,
+    conversation_id: str,
+    message_id: str,
+    consistent_read: bool = False,
+) -> MessageStatusModel:
+    table = _get_table_client(user_id)
+    response = table.get_item(
+        Key=_compose_key(user_id, conversation_id, message_id),
+        ConsistentRead=consistent_read,
+    )
+    if "Item" not in response:
+        raise RecordNotFoundError(f"No status found for message: {message_id}")
+
+    return _to_message_status(response["Item"])
+
+
+def acquire_idempotency_key(
+    user_id: str, conversation_id: str, message_id: str
+) -> MessageStatusModel | None:
+    """Mark the message as in progress.
+    Returns None if the message has been processed or is being processed already.
+    """
+    table = _get_table_client(user_id)
+    now = int(time.time())
+
+    try:
+        # NOTE: Update rather than put, to keep the API key of the pending item
+        response = table.update_item(
+            Key=_compose_key(user_id, conversation_id, message_id),
+            UpdateExpression="set #status = :in_progress, LeaseExpire = :lease_expire, #expire = :expire",
+            ConditionExpression="attribute_not_exists(PK) OR #status IN (:pending, :failed) OR (#status = :in_progress AND LeaseExpire < :now)",
+            ExpressionAttributeNames={"#status": "Status", "#expire": "expire"},
+            ExpressionAttributeValues={
+                ":pending": STATUS_PENDING,
+                ":in_progress": STATUS_IN_PROGRESS,
+                ":failed": STATUS_FAILED,
+                ":now": now,
+                ":lease_expire": now + IDEMPOTENCY_LEASE_SECONDS,
+                ":expire": now + IDEMPOTENCY_TTL_SECONDS,
+            },
+            ReturnValues="ALL_NEW",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            logger.info(f"Message {message_id} has already been processed")
+            return None
+        else:
+            raise e
+
+    return _to_message_status(response["Attributes"])
+
+
+def complete_idempotency_key(user_id: str, conversation_id: str, message_id: str):
+    table = _get_table_client(user_id)
+    table.update_item(
+        Key=_compose_key(user_id, conversation_id, message_id),
+        UpdateExpression="set #status = :completed",
+        ExpressionAttributeNames={"#status": "Status"},
+        ExpressionAttributeValues={":completed": STATUS_COMPLETED},
+    )
+
+
+def release_idempotency_key(
+    user_id: str, conversation_id: str, message_id: str, failed: bool = False
+):
+    """Put a message back to pending when its processing failed, so that it can be
+    processed again on redelivery. Set `failed` if it will not be redelivered.
+    """
+    table = _get_table_client(user_id)
+    try:
+        table.update_item(
+            Key=_compose_key(user_id, conversation_id, message_id),
+            UpdateExpression="set #status = :status",
+            ConditionExpression="#status = :in_progress",
+            ExpressionAttributeNames={"#status": "Status"},
+            ExpressionAttributeValues={
+                ":in_progress": STATUS_IN_PROGRESS,
+                ":status": STATUS_FAILED if failed else STATUS_PENDING,
+            },
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            logger.warning(f"Message {message_id} is not in progress")
+        else:
+            raise e
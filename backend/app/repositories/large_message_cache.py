@@ -0,0 +1,137 @@
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+LARGE_MESSAGE_CACHE_DIR = os.environ.get(
+    "LARGE_MESSAGE_CACHE_DIR", "/tmp/large_message_cache"
+)
+LARGE_MESSAGE_CACHE_MEMORY_BYTES = int(
+    os.environ.get("LARGE_MESSAGE_CACHE_MEMORY_BYTES", 64 * 1024 * 1024)  # 64MB
+)
+LARGE_MESSAGE_CACHE_DISK_BYTES = int(
+    os.environ.get("LARGE_MESSAGE_CACHE_DISK_BYTES", 256 * 1024 * 1024)  # 256MB
+)
+
+
+class CachedBlob(NamedTuple):
+    etag: str
+    body: bytes
+
+
+class LargeMessageCache:
+    """Size-bounded LRU cache of large message blobs, keyed by S3 key.
+    Blobs are kept in memory and in a local directory (`/tmp` on Lambda), so that a
+    warm container does not download the same blob again on every turn. The ETag
+    is stored with the body, to be revalidated with a conditional GET.
+    """
+
+    def __init__(
+        self,
+        directory: str = LARGE_MESSAGE_CACHE_DIR,
+        max_memory_bytes: int = LARGE_MESSAGE_CACHE_MEMORY_BYTES,
+        max_disk_bytes: int = LARGE_MESSAGE_CACHE_DISK_BYTES,
+    ):
+        self.directory = Path(directory)
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory: OrderedDict[str, CachedBlob] = OrderedDict()
+        self._memory_bytes = 0
+        # Size of the blobs on disk written by this process, in LRU order
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> CachedBlob | None:
+        with self._lock:
+            blob = self._memory.get(key)
+            if blob is not None:
+                self._memory.move_to_end(key)
+                return blob
+
+            path = self._path(key)
+            try:
+                etag = path.with_suffix(".etag").read_text()
+                body = path.read_bytes()
+            except OSError:
+                return None
+
+            blob = CachedBlob(etag=etag, body=body)
+            self._put_memory(key, blob)
+            if key in self._disk:
+                self._disk.move_to_end(key)
+
+            return blob
+
+    def put(self, key: str, etag: str, body: bytes):
+        blob = CachedBlob(etag=etag, body=body)
+        with self._lock:
+            self._put_memory(key, blob)
+            self._put_disk(key, blob)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._delete_memory(key)
+            self._delete_disk(key)
+
+    def _put_memory(self, key: str, blob: CachedBlob):
+        self._delete_memory(key)
+        if len(blob.body) > self.max_memory_bytes:
+            return
+
+        self._memory[key] = blob
+        self._memory_bytes += len(blob.body)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted.body)
+
+    def _delete_memory(self, key: str):
+        blob = self._memory.pop(key, None)
+        if blob is not None:
+            self._memory_bytes -= len(blob.body)
+
+    def _put_disk(self, key: str, blob: CachedBlob):
+        self._delete_disk(key)
+        if len(blob.body) > self.max_disk_bytes:
+            return
+
+        path = self._path(key)
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file, so that a partial write is never served
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_bytes(blob.body)
+            tmp_path.replace(path)
+            path.with_suffix(".etag").write_text(blob.etag)
+
+        except OSError as e:
+            logger.warning(f"Failed to write large message cache: {e}")
+            return
+
+        self._disk[key] = len(blob.body)
+        self._disk_bytes += len(blob.body)
+        while self._disk_bytes > self.max_disk_bytes:
+            evicted_key, _ = next(iter(self._disk.items()))
+            self._delete_disk(evicted_key)
+
+    def _delete_disk(self, key: str):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+
+        path = self._path(key)
+        try:
+            path.with_suffix(".etag").unlink(missing_ok=True)
+            path.unlink(missing_ok=True)
+        except OSError as e:
+            logger.warning(f"Failed to delete large message cache: {e}")
@@ -3,7 +3,16 @@ from __future__ import annotations
 import json
 import re
 from pathlib import Path
-from typing import Annotated, Any, Literal, Self, TypeGuard, TYPE_CHECKING
+from typing import (
+    Annotated,
+    Any,
+    Iterator,
+    Literal,
+    Self,
+    TypeGuard,
+    TYPE_CHECKING,
+    cast,
+)
 from urllib.parse import urlparse
 
 from app.repositories.models.common import Base64EncodedBytes
@@ -35,7 +44,15 @@ from mypy_boto3_bedrock_runtime.type_defs import (
     ToolUseBlockOutputTypeDef,
     ToolUseBlockTypeDef,
 )
-from pydantic import BaseModel, Discriminator, Field, JsonValue, field_validator
+from pydantic import (
+    BaseModel,
+    Discriminator,
+    Field,
+    JsonValue,
+    SerializerFunctionWrapHandler,
+    field_serializer,
+    field_validator,
+)
 
 if TYPE_CHECKING:
     from app.agents.tools.agent_tool import ToolRunResult
@@ -646,6 +663,53 @@ class MessageModel(BaseModel):
         )
 
 
+class LazyMessageMap(dict[str, MessageModel]):
+    """Message map which keeps the stored dicts and validates them on access.
+    Only the messages the caller actually touches (usually the active branch) are
+    hydrated. Entries which have never been accessed are written back as is by
+    `dump_items`, without a round trip through pydantic.
+    """
+
+    def __init__(self, stored: dict[str, dict[str, Any]]):
+        # The stored dicts are replaced with the models on the first access
+        super().__init__(cast(dict[str, MessageModel], stored))
+
+    def __getitem__(self, key: str) -> MessageModel:
+        value = super().__getitem__(key)
+        if not isinstance(value, MessageModel):
+            value = MessageModel.model_validate(value)
+            super().__setitem__(key, value)
+
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self else default
+
+    def pop(self, key: str, *args: Any) -> Any:
+        if key in self:
+            value = self[key]
+            super().__delitem__(key)
+            return value
+
+        return super().pop(key, *args)
+
+    def values(self) -> Iterator[MessageModel]:  # type: ignore[override]
+        return (self[key] for key in self)
+
+    def items(self) -> Iterator[tuple[str, MessageModel]]:  # type: ignore[override]
+        return ((key, self[key]) for key in self)
+
+    def dump_items(self) -> Iterator[tuple[str, dict[str, Any]]]:
+        """Yield the entries as `model_dump(by_alias=True)` would, reusing the
+        stored dicts for messages which have not been hydrated.
+        """
+        for key, value in super().items():
+            if isinstance(value, MessageModel):
+                yield key, value.model_dump(by_alias=True)
+            else:
+                yield key, value
+
+
 class ConversationModel(BaseModel):
     id: str
     create_time: float
@@ -656,6 +720,24 @@ class ConversationModel(BaseModel):
     bot_id: str | None
     should_continue: bool
 
+    @field_serializer("message_map", mode="wrap")
+    def serialize_message_map(
+        self,
+        message_map: dict[str, MessageModel],
+        handler: SerializerFunctionWrapHandler,
+    ) -> dict[str, Any]:
+        if isinstance(message_map, LazyMessageMap):
+            return handler(dict(message_map.items()))
+
+        return handler(message_map)
+
+    def dump_message_map(self) -> dict[str, dict[str, Any]]:
+        """Dump `message_map` for storage."""
+        if isinstance(self.message_map, LazyMessageMap):
+            return dict(self.message_map.dump_items())
+
+        return {k: v.model_dump(by_alias=True) for k, v in self.message_map.items()}
+
 
 class ConversationMeta(BaseModel):
     id: str
@@ -0,0 +1,11 @@
+from typing import Literal
+
+from pydantic import BaseModel
+
+type_message_status = Literal["PENDING", "IN_PROGRESS", "COMPLETED", "FAILED"]
+
+
+class MessageStatusModel(BaseModel):
+    status: type_message_status
+    # API key the message was sent with, to notify its webhook
+    api_key_id: str | None
@@ -3,60 +3,109 @@ import logging
 import os
 import re
 import time
-from datetime import date, timedelta
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
 from functools import partial
+from typing import AsyncIterator
 
 import boto3
 from app.repositories.custom_bot import find_public_bots_by_ids
 from app.repositories.models.usage_analysis import UsagePerBot, UsagePerUser
+from app.repositories.usage_rollup import find_usage_sorted_by_price
+from app.repositories.user_directory import find_emails_by_user_ids
 
 REGION = os.environ.get("REGION", "us-east-1")
 USAGE_ANALYSIS_DATABASE = os.environ.get(
     "USAGE_ANALYSIS_DATABASE", "bedrockchatstack_usage_analysis"
 )
 USAGE_ANALYSIS_TABLE = os.environ.get("USAGE_ANALYSIS_TABLE", "ddb_export")
+# Compacted from `USAGE_ANALYSIS_TABLE` hourly, see `s3_exporter/compaction.py`.
+# Queries read the exported JSON if not set, or for the hours not compacted.
+USAGE_ANALYSIS_COMPACT_TABLE = os.environ.get("USAGE_ANALYSIS_COMPACT_TABLE", "")
 USAGE_ANALYSIS_WORKGROUP = os.environ.get(
     "USAGE_ANALYSIS_WORKGROUP", "bedrockchatstack_wg"
 )
 USAGE_ANALYSIS_OUTPUT_LOCATION = os.environ.get(
     "USAGE_ANALYSIS_OUTPUT_LOCATION", "s3://bedrockchatstack-athena-results"
 )
-USER_POOL_ID = os.environ.get("USER_POOL_ID", "us-east-1_XXXXXXXXX")
+# Rows per page of the query results, the maximum of Athena
 QUERY_LIMIT = 1000
+# Identical queries within the period reuse the previous result on Athena
+ATHENA_RESULT_REUSE_MINUTES = 10
+ATHENA_POLL_INITIAL_INTERVAL_SECONDS = 0.2
+ATHENA_POLL_MAX_INTERVAL_SECONDS = 5
+ATHENA_CACHE_SIZE = 64
+ATHENA_CACHE_TTL_SECONDS = 60
+ATHENA_CLOSED_RANGE_CACHE_TTL_SECONDS = 60 * 60
 
 
 logger = logging.getLogger(__name__)
 athena = boto3.client("athena", region_name = REGION)
 
+# Normalized query -> (expiration, rows)
+_query_cache: OrderedDict[tuple[str, str, str], tuple[float, list[dict]]] = (
+    OrderedDict()
+)
+
 
 def _find_cognito_user_by_id(user_id: str) -> dict | None:
     """Find user by id from cognito."""
-    cognito = boto3.client("cognito-idp")
-    try:
-        response = cognito.admin_get_user(UserPoolId=USER_POOL_ID, Username=user_id)
-    except cognito.exceptions.UserNotFoundException:
+    users = find_emails_by_user_ids([user_id])
+    if user_id not in users:
         return None
-    user_attributes = response["UserAttributes"]
-
-    email = next(
-        (attr["Value"] for attr in user_attributes if attr["Name"] == "email"), None
-    )
 
     return {
         "id": user_id,
-        "email": email,
+        "email": users[user_id],
     }
 
 
 async def _find_cognito_users_by_ids(user_ids: list[str]) -> list[dict]:
-    """Find users by ids from cognito."""
+    """Find users by ids from cognito, through the user directory cache."""
     loop = asyncio.get_running_loop()
-    tasks = [
-        loop.run_in_executor(None, partial(_find_cognito_user_by_id, user_id))
+    emails = await loop.run_in_executor(
+        None, partial(find_emails_by_user_ids, user_ids)
+    )
+    return [
+        {"id": user_id, "email": emails[user_id]}
         for user_id in user_ids
+        if user_id in emails
     ]
-    results = await asyncio.gather(*tasks)
-    return [result for result in results if result is not None]
+
+
+def _normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip()
+
+
+def _cache_ttl_seconds(end: datetime) -> int:
+    """Results of a range which is no longer exported can be kept longer."""
+    if end < datetime.now() - timedelta(days=1):
+        return ATHENA_CLOSED_RANGE_CACHE_TTL_SECONDS
+    return ATHENA_CACHE_TTL_SECONDS
+
+
+async def _wait_query_execution(execution_id: str):
+    """Poll the query execution with exponential backoff until it finishes."""
+    loop = asyncio.get_running_loop()
+    interval = ATHENA_POLL_INITIAL_INTERVAL_SECONDS
+    while True:
+        query_execution = await loop.run_in_executor(
+            None, partial(athena.get_query_execution, QueryExecutionId=execution_id)
+        )
+        status = query_execution["QueryExecution"]["Status"]
+        logger.debug(f"status: {status['State']}")
+        if status["State"] == "SUCCEEDED":
+            statistics = query_execution["QueryExecution"].get("Statistics", {})
+            if statistics.get("ResultReuseInformation", {}).get("ReusedPreviousResult"):
+                logger.info(f"Reused the previous result for {execution_id}")
+            return
+        elif status["State"] in ("FAILED", "CANCELLED"):
+            reason = status.get("StateChangeReason", status["State"])
+            logger.error(f"query failed.")
+            raise Exception(reason)
+
+        await asyncio.sleep(interval)
+        interval = min(interval * 2, ATHENA_POLL_MAX_INTERVAL_SECONDS)
 
 
 async def run_athena_query(
@@ -64,66 +113,211 @@ async def run_athena_query(
     database: str,
     workgroup: str,
     output_location: str,
-    query_limit: int = QUERY_LIMIT,
-):
-    """Run athena query."""
-    query_execution = athena.start_query_execution(
-        QueryString=query,
-        QueryExecutionContext={"Database": database},
-        WorkGroup=workgroup,
-        ResultConfiguration={
-            "OutputLocation": output_location,
-        },
+    page_size: int = QUERY_LIMIT,
+    cache_ttl_seconds: int = ATHENA_CACHE_TTL_SECONDS,
+) -> AsyncIterator[dict]:
+    """Run athena query and yield the result rows, excluding the header.
+    Results are cached in process, and reused by Athena within `ATHENA_RESULT_REUSE_MINUTES`.
+    """
+    cache_key = (_normalize_query(query), database, workgroup)
+    cached = _query_cache.get(cache_key)
+    if cached is not None and cached[0] > time.monotonic():
+        logger.debug("Using the cached query result")
+        for row in cached[1]:
+            yield row
+        return
+
+    loop = asyncio.get_running_loop()
+    query_execution = await loop.run_in_executor(
+        None,
+        partial(
+            athena.start_query_execution,
+            QueryString=query,
+            QueryExecutionContext={"Database": database},
+            WorkGroup=workgroup,
+            ResultConfiguration={
+                "OutputLocation": output_location,
+            },
+            ResultReuseConfiguration={
+                "ResultReuseByAgeConfiguration": {
+                    "Enabled": True,
+                    "MaxAgeInMinutes": ATHENA_RESULT_REUSE_MINUTES,
+                }
+            },
+        ),
     )
     execution_id = query_execution["QueryExecutionId"]
     logger.debug(f"query_execution_id: {execution_id}")
 
-    # Wait until query completed
+    await _wait_query_execution(execution_id)
+
+    # Get query results page by page
+    rows = []
+    params = {"QueryExecutionId": execution_id, "MaxResults": page_size}
+    is_first_page = True
     while True:
-        query_execution = athena.get_query_execution(QueryExecutionId=execution_id)
-        status = query_execution["QueryExecution"]["Status"]["State"]
-        logger.debug(f"status: {status}")
-        if status == "SUCCEEDED":
+        results = await loop.run_in_executor(
+            None, partial(athena.get_query_results, **params)
+        )
+        page = results["ResultSet"]["Rows"]
+        if is_first_page:
+            # The first row is the header
+            page = page[1:]
+            is_first_page = False
+
+        for row in page:
+            rows.append(row)
+            yield row
+
+        if "NextToken" not in results:
             break
-        elif status == "FAILED":
-            reason = query_execution["QueryExecution"]["Status"]["StateChangeReason"]
-            logger.error(f"query failed.")
-            raise Exception(reason)
-        else:
-            await asyncio.sleep(1)
+        params["NextToken"] = results["NextToken"]
 
-    # Get query results
-    results = athena.get_query_results(
-        QueryExecutionId=execution_id, MaxResults=query_limit
-    )
-    return results
+    _query_cache[cache_key] = (time.monotonic() + cache_ttl_seconds, rows)
+    _query_cache.move_to_end(cache_key)
+    while len(_query_cache) > ATHENA_CACHE_SIZE:
+        _query_cache.popitem(last=False)
 
 
-async def find_bots_sorted_by_price(
-    limit: int = 20,
-    from_: str | None = None,
-    to_: str | None = None,
-) -> list[UsagePerBot]:
-    """Find bots sorted by price. This is intended to be used by admin.
-    - start: start date of the period to be analyzed. The format is `YYYYMMDDHH`.
-    - end: end date of the period to be analyzed. The format is `YYYYMMDDHH`.
+async def _find_uncompacted_ranges(
+    start: datetime, end: datetime
+) -> list[tuple[str, str]]:
+    """Find the hours not compacted in the range, such as the ones exported before the
+    compaction was deployed, as ranges of consecutive hours in `YYYY/MM/DD/HH` format.
+    Hours without any conversation have no compacted files, so they are included too.
     """
-    assert 1 <= limit <= 1000, "Limit must be between 1 and 1000."
+    query = f"""
+SELECT DISTINCT
+    datehour
+FROM
+    {USAGE_ANALYSIS_DATABASE}.{USAGE_ANALYSIS_COMPACT_TABLE}
+WHERE
+    datehour BETWEEN '{start:%Y/%m/%d/%H}' AND '{end:%Y/%m/%d/%H}';
+"""
+    compacted = {
+        row["Data"][0]["VarCharValue"]
+        async for row in run_athena_query(
+            query,
+            USAGE_ANALYSIS_DATABASE,
+            USAGE_ANALYSIS_WORKGROUP,
+            USAGE_ANALYSIS_OUTPUT_LOCATION,
+            cache_ttl_seconds=_cache_ttl_seconds(end),
+        )
+    }
+
+    ranges: list[tuple[str, str]] = []
+    current = start
+    previous_compacted = True
+    while current <= end:
+        datehour = current.strftime("%Y/%m/%d/%H")
+        if datehour not in compacted:
+            if previous_compacted:
+                ranges.append((datehour, datehour))
+            else:
+                ranges[-1] = (ranges[-1][0], datehour)
+        previous_compacted = datehour in compacted
+        current += timedelta(hours=1)
+
+    return ranges
+
+
+def _compose_compact_table_query(
+    column: str,
+    limit: int,
+    from_str: str,
+    to_str: str,
+    uncompacted_ranges: list[tuple[str, str]],
+) -> str:
+    """Sum the latest price of the conversations updated in the range by `column`.
+    The compacted table has the latest image of each conversation per hour already,
+    the export is read only for `uncompacted_ranges`.
+    """
+    export_query = ""
+    if uncompacted_ranges:
+        datehour_condition = " OR ".join(
+            f"datehour BETWEEN '{first}' AND '{last}'"
+            for first, last in uncompacted_ranges
+        )
+        export_query = f"""
+        UNION ALL
+        SELECT
+            Keys.PK.S AS pk,
+            Keys.SK.S AS sk,
+            NewImage.BotId.S AS bot_id,
+            CAST(NewImage.TotalPrice.N AS DECIMAL(20,10)) AS total_price,
+            CAST(Metadata.WriteTimestampMicros.N AS BIGINT) AS write_timestamp_micros
+        FROM
+            {USAGE_ANALYSIS_DATABASE}.{USAGE_ANALYSIS_TABLE}
+        WHERE
+            ({datehour_condition})
+            AND Keys.SK.S LIKE '%#CONV#%'
+            AND NewImage IS NOT NULL"""
+
+    return f"""
+SELECT
+    {column},
+    SUM(total_price) AS TotalPrice
+FROM (
+    SELECT
+        MAX_BY({column}, write_timestamp_micros) AS {column},
+        MAX_BY(total_price, write_timestamp_micros) AS total_price
+    FROM (
+        SELECT
+            pk,
+            sk,
+            bot_id,
+            total_price,
+            write_timestamp_micros
+        FROM
+            {USAGE_ANALYSIS_DATABASE}.{USAGE_ANALYSIS_COMPACT_TABLE}
+        WHERE
+            datehour BETWEEN '{from_str}' AND '{to_str}'{export_query}
+    )
+    GROUP BY
+        pk,
+        sk
+)
+GROUP BY
+    {column}
+ORDER BY
+    TotalPrice DESC
+LIMIT {limit};
+"""
+
 
+def _parse_range(from_: str | None, to_: str | None) -> tuple[datetime, datetime]:
+    """Parse the period to be analyzed. The format is `YYYYMMDDHH`, defaults to today."""
     assert (from_ and to_) or (
         not from_ and not to_
     ), "Both from_ and to_ must be specified or omitted."
 
     if from_ is not None and to_ is not None:
-        from_str = re.sub(r"(\d{4})(\d{2})(\d{2})(\d{2})", r"\1/\2/\3/\4", from_)  # type: ignore
-        to_str = re.sub(r"(\d{4})(\d{2})(\d{2})(\d{2})", r"\1/\2/\3/\4", to_)  # type: ignore
+        return (
+            datetime.strptime(from_, "%Y%m%d%H"),
+            datetime.strptime(to_, "%Y%m%d%H"),
+        )
+
+    today = datetime.combine(date.today(), datetime.min.time())
+    return today, today.replace(hour=23)
+
+
+async def _find_bots_sorted_by_price_from_athena(
+    limit: int, start: datetime, end: datetime
+) -> list[tuple[str, float]]:
+    from_str = start.strftime("%Y/%m/%d/%H")
+    to_str = end.strftime("%Y/%m/%d/%H")
+
+    if USAGE_ANALYSIS_COMPACT_TABLE:
+        query = _compose_compact_table_query(
+            "bot_id",
+            limit,
+            from_str,
+            to_str,
+            await _find_uncompacted_ranges(start, end),
+        )
     else:
-        today = date.today()
-        from_str = today.strftime("%Y/%m/%d/00")
-        to_str = today.strftime("%Y/%m/%d/23")
-
-    # To avoid duplication of conversation, apply most the latest conversation by using subquery
-    query = f"""
+        # To avoid duplication of conversation, apply most the latest conversation by using subquery
+        query = f"""
 WITH LatestRecords AS (
     SELECT
         newimage.BotId.S AS BotId,
@@ -133,7 +327,7 @@ WITH LatestRecords AS (
         {USAGE_ANALYSIS_DATABASE}.{USAGE_ANALYSIS_TABLE}
     WHERE
         datehour BETWEEN '{from_str}' AND '{to_str}'
-        AND Keys.SK.S LIKE CONCAT(Keys.PK.S, '#CONV#%')
+        AND Keys.SK.S LIKE '%#CONV#%'
     GROUP BY
         newimage.BotId.S,
         newimage.SK.S
@@ -148,7 +342,7 @@ PreAggregatedData AS (
         {USAGE_ANALYSIS_DATABASE}.{USAGE_ANALYSIS_TABLE} d
     WHERE
         datehour BETWEEN '{from_str}' AND '{to_str}'
-        AND d.Keys.SK.S LIKE CONCAT(d.Keys.PK.S, '#CONV#%')
+        AND d.Keys.SK.S LIKE '%#CONV#%'
 ),
 AggregatedData AS (
     SELECT
@@ -172,30 +366,45 @@ LIMIT {limit};
 """
 
     logger.debug(query)
-    response = await run_athena_query(
-        query,
-        USAGE_ANALYSIS_DATABASE,
-        USAGE_ANALYSIS_WORKGROUP,
-        USAGE_ANALYSIS_OUTPUT_LOCATION,
-    )
-    rows = response["ResultSet"]["Rows"][1:]
+    return [
+        (
+            row["Data"][0]["VarCharValue"],
+            float(row["Data"][1].get("VarCharValue", 0)),
+        )
+        async for row in run_athena_query(
+            query,
+            USAGE_ANALYSIS_DATABASE,
+            USAGE_ANALYSIS_WORKGROUP,
+            USAGE_ANALYSIS_OUTPUT_LOCATION,
+            cache_ttl_seconds=_cache_ttl_seconds(end),
+        )
+        if row["Data"][0].get("VarCharValue", None) is not None
+    ]
+
+
+async def find_bots_sorted_by_price(
+    limit: int = 20,
+    from_: str | None = None,
+    to_: str | None = None,
+) -> list[UsagePerBot]:
+    """Find bots sorted by price. This is intended to be used by admin.
+    - start: start date of the period to be analyzed. The format is `YYYYMMDDHH`.
+    - end: end date of the period to be analyzed. The format is `YYYYMMDDHH`.
+    """
+    assert 1 <= limit <= 1000, "Limit must be between 1 and 1000."
+
+    start, end = _parse_range(from_, to_)
+    prices = await find_usage_sorted_by_price("BOT", limit, start, end)
+    if prices is None:
+        prices = await _find_bots_sorted_by_price_from_athena(limit, start, end)
 
     # Fetch bot meta data from dynamodb
-    bots = await find_public_bots_by_ids(
-        bot_ids=[
-            item["Data"][0]["VarCharValue"]
-            for item in rows
-            if item["Data"][0].get("VarCharValue", None) is not None
-        ]
-    )
+    bots = await find_public_bots_by_ids(bot_ids=[bot_id for bot_id, _ in prices])
     bots_dict = {bot.id: bot for bot in bots}
 
     # Join bot meta data and usage data
     bot_usage = []
-    for row in rows:
-        bot_id = row["Data"][0].get("VarCharValue", "")
-        total_price = float(row["Data"][1].get("VarCharValue", 0))
-
+    for bot_id, total_price in prices:
         bot = bots_dict.get(bot_id)
 
         if bot:
@@ -214,27 +423,23 @@ LIMIT {limit};
     return bot_usage
 
 
-async def find_users_sorted_by_price(
-    limit: int = 20,
-    from_: str | None = None,
-    to_: str | None = None,
-) -> list[UsagePerUser]:
-    assert 1 <= limit <= 1000, "Limit must be between 1 and 1000."
-
-    assert (from_ and to_) or (
-        not from_ and not to_
-    ), "Both from_ and to_ must be specified or omitted."
-
-    if from_ is not None and to_ is not None:
-        from_str = re.sub(r"(\d{4})(\d{2})(\d{2})(\d{2})", r"\1/\2/\3/\4", from_)  # type: ignore
-        to_str = re.sub(r"(\d{4})(\d{2})(\d{2})(\d{2})", r"\1/\2/\3/\4", to_)  # type: ignore
+async def _find_users_sorted_by_price_from_athena(
+    limit: int, start: datetime, end: datetime
+) -> list[tuple[str, float]]:
+    from_str = start.strftime("%Y/%m/%d/%H")
+    to_str = end.strftime("%Y/%m/%d/%H")
+
+    if USAGE_ANALYSIS_COMPACT_TABLE:
+        query = _compose_compact_table_query(
+            "pk",
+            limit,
+            from_str,
+            to_str,
+            await _find_uncompacted_ranges(start, end),
+        )
     else:
-        today = date.today()
-        from_str = today.strftime("%Y/%m/%d/00")
-        to_str = today.strftime("%Y/%m/%d/23")
-
-    # To avoid duplication of conversation, apply most the latest conversation by using subquery
-    query = f"""
+        # To avoid duplication of conversation, apply most the latest conversation by using subquery
+        query = f"""
 WITH LatestRecords AS (
     SELECT
         newimage.PK.S AS UserId,
@@ -244,7 +449,7 @@ WITH LatestRecords AS (
         {USAGE_ANALYSIS_DATABASE}.{USAGE_ANALYSIS_TABLE}
     WHERE
         datehour BETWEEN '{from_str}' AND '{to_str}'
-        AND Keys.SK.S LIKE CONCAT(Keys.PK.S, '#CONV#%')
+        AND Keys.SK.S LIKE '%#CONV#%'
     GROUP BY
         newimage.PK.S,
         newimage.SK.S
@@ -259,7 +464,7 @@ PreAggregatedData AS (
         {USAGE_ANALYSIS_DATABASE}.{USAGE_ANALYSIS_TABLE} d
     WHERE
         datehour BETWEEN '{from_str}' AND '{to_str}'
-        AND d.Keys.SK.S LIKE CONCAT(d.Keys.PK.S, '#CONV#%')
+        AND d.Keys.SK.S LIKE '%#CONV#%'
 ),
 AggregatedData AS (
     SELECT
@@ -283,27 +488,40 @@ LIMIT {limit};
 """
 
     logger.debug(query)
-    response = await run_athena_query(
-        query,
-        USAGE_ANALYSIS_DATABASE,
-        USAGE_ANALYSIS_WORKGROUP,
-        USAGE_ANALYSIS_OUTPUT_LOCATION,
-    )
-    rows = response["ResultSet"]["Rows"][1:]
+    return [
+        (
+            row["Data"][0]["VarCharValue"],
+            float(row["Data"][1].get("VarCharValue", 0)),
+        )
+        async for row in run_athena_query(
+            query,
+            USAGE_ANALYSIS_DATABASE,
+            USAGE_ANALYSIS_WORKGROUP,
+            USAGE_ANALYSIS_OUTPUT_LOCATION,
+            cache_ttl_seconds=_cache_ttl_seconds(end),
+        )
+        if row["Data"][0].get("VarCharValue", None) is not None
+    ]
+
+
+async def find_users_sorted_by_price(
+    limit: int = 20,
+    from_: str | None = None,
+    to_: str | None = None,
+) -> list[UsagePerUser]:
+    assert 1 <= limit <= 1000, "Limit must be between 1 and 1000."
+
+    start, end = _parse_range(from_, to_)
+    prices = await find_usage_sorted_by_price("USER", limit, start, end)
+    if prices is None:
+        prices = await _find_users_sorted_by_price_from_athena(limit, start, end)
 
     users = await _find_cognito_users_by_ids(
-        user_ids=[
-            item["Data"][0]["VarCharValue"]
-            for item in rows
-            if item["Data"][0].get("VarCharValue", None) is not None
-        ]
+        user_ids=[user_id for user_id, _ in prices]
     )
     users_dict = {user["id"]: user for user in users}
     usages = []
-    for row in rows:
-        user_id = row["Data"][0].get("VarCharValue", "")
-        total_price = float(row["Data"][1].get("VarCharValue", 0))
-
+    for user_id, total_price in prices:
         user = users_dict.get(user_id)
         if user:
             usages.append(
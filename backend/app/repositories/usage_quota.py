@@ -0,0 +1,181 @@
+import logging
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from app.repositories.common import QuotaExceededError, _get_table_public_client
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Token buckets limiting the tokens consumed by each user and bot, per model.
+# Each bucket is stored on the conversation table as an atomic counter of the tokens
+# consumed, against the tokens filled at the rate since the epoch:
+#   PK, SK: USAGE_QUOTA#{USER | BOT}#{id}#{model}
+#   Consumed: never less than `filled - capacity`, so that idle time fills
+#   the bucket up to its capacity only
+# The limits are disabled with 0.
+USAGE_QUOTA_PREFIX = "USAGE_QUOTA"
+QUOTA_USER_TOKENS_PER_MINUTE = int(os.environ.get("QUOTA_USER_TOKENS_PER_MINUTE", 0))
+QUOTA_BOT_TOKENS_PER_MINUTE = int(os.environ.get("QUOTA_BOT_TOKENS_PER_MINUTE", 0))
+# Capacity of the buckets, as the minutes of tokens to be consumed at once
+QUOTA_BURST_MINUTES = float(os.environ.get("QUOTA_BURST_MINUTES", 1))
+# Turns over the limit wait for the bucket to be refilled up to this period,
+# and are rejected if it takes longer
+QUOTA_MAX_WAIT_SECONDS = float(os.environ.get("QUOTA_MAX_WAIT_SECONDS", 10))
+# Consumed counts are cached in process for this period, not to read the table
+# on every turn. Charges of the other containers are seen after this delay.
+QUOTA_CACHE_TTL_SECONDS = 5
+# Removed by the table TTL after this idle period, when they are full anyway
+QUOTA_TTL_SECONDS = 24 * 60 * 60
+
+# Bucket key -> (expiration, consumed)
+_cache: dict[str, tuple[float, int]] = {}
+_cache_lock = threading.Lock()
+
+
+class _Bucket:
+    def __init__(self, key: str, tokens_per_minute: int):
+        self.key = key
+        self.rate = tokens_per_minute / 60
+        self.capacity = int(tokens_per_minute * QUOTA_BURST_MINUTES)
+
+    def filled(self, now: float) -> int:
+        return int(now * self.rate)
+
+    def balance(self, consumed: int, now: float) -> int:
+        return min(self.capacity, self.filled(now) - consumed)
+
+
+def _compose_bucket_key(entity: str, id: str, model: str) -> str:
+    return f"{USAGE_QUOTA_PREFIX}#{entity}#{id}#{model}"
+
+
+def _find_buckets(user_id: str, bot_id: str | None, model: str) -> list[_Bucket]:
+    buckets = []
+    if QUOTA_USER_TOKENS_PER_MINUTE > 0:
+        buckets.append(
+            _Bucket(
+                _compose_bucket_key("USER", user_id, model),
+                QUOTA_USER_TOKENS_PER_MINUTE,
+            )
+        )
+    if bot_id and QUOTA_BOT_TOKENS_PER_MINUTE > 0:
+        buckets.append(
+            _Bucket(
+                _compose_bucket_key("BOT", bot_id, model), QUOTA_BOT_TOKENS_PER_MINUTE
+            )
+        )
+    return buckets
+
+
+def _cache_consumed(key: str, consumed: int):
+    with _cache_lock:
+        _cache[key] = (time.monotonic() + QUOTA_CACHE_TTL_SECONDS, consumed)
+
+
+def _find_consumed(table, bucket: _Bucket) -> int:
+    with _cache_lock:
+        cached = _cache.get(bucket.key)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+
+    response = table.get_item(
+        Key={"PK": bucket.key, "SK": bucket.key}, ProjectionExpression="Consumed"
+    )
+    # A new bucket is full
+    consumed = int(
+        response.get("Item", {}).get(
+            "Consumed", bucket.filled(time.time()) - bucket.capacity
+        )
+    )
+    _cache_consumed(bucket.key, consumed)
+    return consumed
+
+
+def admit_turn(user_id: str, bot_id: str | None, model: str):
+    """Wait until the buckets of the user and the bot have tokens left for the model.
+    Raises `QuotaExceededError` if they are not refilled within `QUOTA_MAX_WAIT_SECONDS`.
+    """
+    buckets = _find_buckets(user_id, bot_id, model)
+    if not buckets:
+        return
+
+    table = _get_table_public_client()
+    deadline = time.monotonic() + QUOTA_MAX_WAIT_SECONDS
+    while True:
+        now = time.time()
+        try:
+            # Seconds until every bucket has a token
+            wait_seconds = max(
+                (1 - bucket.balance(_find_consumed(table, bucket), now)) / bucket.rate
+                for bucket in buckets
+            )
+        except ClientError as e:
+            # Not to stop all the turns on a failure of the table
+            logger.warning(f"Failed to find the token quota, admitting: {e}")
+            return
+
+        if wait_seconds <= 0:
+            return
+
+        if time.monotonic() + wait_seconds > deadline:
+            raise QuotaExceededError(
+                f"Token quota of {model} exceeded, retry after {wait_seconds:.0f} seconds",
+                retry_after_seconds=wait_seconds,
+            )
+
+        logger.info(f"Waiting {wait_seconds:.1f}s for the token quota of {model}")
+        # Check again at least once per cache period, for the charges by the others
+        time.sleep(min(wait_seconds, QUOTA_CACHE_TTL_SECONDS))
+
+
+def charge_tokens(user_id: str, bot_id: str | None, model: str, token_count: int):
+    """Charge the tokens consumed by a turn to the buckets of the user and the bot.
+    Failures are only logged, not to fail the turn which has been stored already.
+    """
+    buckets = _find_buckets(user_id, bot_id, model)
+    if not buckets:
+        return
+
+    table = _get_table_public_client()
+    for bucket in buckets:
+        now = time.time()
+        floor = bucket.filled(now) - bucket.capacity
+        try:
+            response = table.update_item(
+                Key={"PK": bucket.key, "SK": bucket.key},
+                UpdateExpression="ADD Consumed :tokens SET #expire = :expire",
+                ExpressionAttributeNames={"#expire": "expire"},
+                ExpressionAttributeValues={
+                    ":tokens": token_count,
+                    ":expire": int(now) + QUOTA_TTL_SECONDS,
+                },
+                ReturnValues="UPDATED_NEW",
+            )
+            consumed = int(response["Attributes"]["Consumed"])
+
+            if consumed - token_count < floor:
+                # Filled over the capacity while idle. Raise to the floor,
+                # unless charged by another turn meanwhile.
+                try:
+                    table.update_item(
+                        Key={"PK": bucket.key, "SK": bucket.key},
+                        UpdateExpression="SET Consumed = :consumed",
+                        ConditionExpression="Consumed = :current",
+                        ExpressionAttributeValues={
+                            ":consumed": floor + token_count,
+                            ":current": consumed,
+                        },
+                    )
+                    consumed = floor + token_count
+                except ClientError as e:
+                    if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                        raise e
+
+            _cache_consumed(bucket.key, consumed)
+
+        except ClientError as e:
+            logger.warning(f"Failed to charge the token quota {bucket.key}: {e}")
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from functools import partial
+from typing import Literal, NamedTuple
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+from app.repositories.common import TABLE_NAME, _get_table_public_client
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Usage of every chat turn is added to the counters of the hour and the day,
+# so that the admin can find the usage without scanning the exported table.
+# Items are stored on the conversation table, under their own partitions:
+#   PK: USAGE_ROLLUP#{H<YYYYMMDDHH> | D<YYYYMMDD>}#{shard}
+#   SK: BOT#{bot_id} | USER#{user_id}
+USAGE_ROLLUP_PREFIX = "USAGE_ROLLUP"
+# Every turn writes to the same period, so it is split into shards by the counter
+USAGE_ROLLUP_SHARDS = 4
+# Hourly counters are only needed for the edges of a range, daily ones are kept
+USAGE_ROLLUP_HOURLY_RETENTION_DAYS = 92
+# Longer ranges are left to Athena
+USAGE_ROLLUP_MAX_PERIODS = 64
+# Counters are written by a worker thread, off the response path. The table client
+# is reused until its assumed role credentials (1 hour by default) get close to expiry.
+USAGE_ROLLUP_CLIENT_TTL_SECONDS = 30 * 60
+
+type_usage_entity = Literal["BOT", "USER"]
+
+_SINCE_KEY = {
+    "PK": f"{USAGE_ROLLUP_PREFIX}#SINCE",
+    "SK": f"{USAGE_ROLLUP_PREFIX}#SINCE",
+}
+_since_recorded = False
+
+
+class _Usage(NamedTuple):
+    user_id: str
+    bot_id: str | None
+    hour: datetime
+    price: float
+    input_token_count: int
+    output_token_count: int
+
+
+_usage_queue: queue.Queue[_Usage] = queue.Queue()
+_worker: threading.Thread | None = None
+_worker_lock = threading.Lock()
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _compose_partition_key(period: str, sk: str):
+    shard = zlib.crc32(sk.encode()) % USAGE_ROLLUP_SHARDS
+    return f"{USAGE_ROLLUP_PREFIX}#{period}#{shard}"
+
+
+def _split_range(start: datetime, end: datetime) -> list[str]:
+    """Split the hours from `start` to `end` (inclusive) into as many whole days as possible."""
+    periods = []
+    current = start
+    while current <= end:
+        if current.hour == 0 and current.replace(hour=23) <= end:
+            periods.append(f"D{current:%Y%m%d}")
+            current += timedelta(days=1)
+        else:
+            periods.append(f"H{current:%Y%m%d%H}")
+            current += timedelta(hours=1)
+    return periods
+
+
+def _record_since(table, hour: datetime):
+    """Record when the rollup started, once per container."""
+    global _since_recorded
+    if _since_recorded:
+        return
+
+    try:
+        table.put_item(
+            Item={**_SINCE_KEY, "Since": f"{hour:%Y%m%d%H}"},
+            ConditionExpression="attribute_not_exists(PK)",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise e
+
+    _since_recorded = True
+
+
+def record_usage(
+    user_id: str,
+    bot_id: str | None,
+    price: float,
+    input_token_count: int,
+    output_token_count: int,
+):
+    """Add the usage of a chat turn to the rollup counters.
+    The counters are updated by the worker thread, this only queues the usage.
+    """
+    global _worker
+    _usage_queue.put(
+        _Usage(
+            user_id=user_id,
+            bot_id=bot_id,
+            hour=_utc_now().replace(minute=0, second=0, microsecond=0),
+            price=price,
+            input_token_count=input_token_count,
+            output_token_count=output_token_count,
+        )
+    )
+
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(
+                target=_run_worker, args=(_usage_queue,), daemon=True
+            )
+            _worker.start()
+
+
+def _run_worker(usage_queue: queue.Queue[_Usage]):
+    table = None
+    table_expiration = 0.0
+    while True:
+        usage = usage_queue.get()
+        try:
+            if table is None or time.monotonic() >= table_expiration:
+                table = _get_table_public_client()
+                table_expiration = time.monotonic() + USAGE_ROLLUP_CLIENT_TTL_SECONDS
+
+            _write_usage(table, usage)
+
+        except Exception as e:
+            # Not to fail the turn which has been stored already
+            logger.exception(f"Failed to record usage of {usage.user_id}: {e}")
+
+        finally:
+            usage_queue.task_done()
+
+
+def _write_usage(table, usage: _Usage):
+    hourly_expire = int(time.time()) + USAGE_ROLLUP_HOURLY_RETENTION_DAYS * 24 * 60 * 60
+
+    entities = [f"USER#{usage.user_id}"]
+    if usage.bot_id:
+        entities.append(f"BOT#{usage.bot_id}")
+
+    values = {
+        ":price": Decimal(str(usage.price)),
+        ":input": usage.input_token_count,
+        ":output": usage.output_token_count,
+        ":one": 1,
+    }
+    _record_since(table, usage.hour)
+
+    for sk in entities:
+        table.update_item(
+            Key={
+                "PK": _compose_partition_key(f"H{usage.hour:%Y%m%d%H}", sk),
+                "SK": sk,
+            },
+            UpdateExpression="ADD TotalPrice :price, InputTokens :input, OutputTokens :output, Turns :one SET #expire = :expire",
+            ExpressionAttributeNames={"#expire": "expire"},
+            ExpressionAttributeValues={**values, ":expire": hourly_expire},
+        )
+        table.update_item(
+            Key={
+                "PK": _compose_partition_key(f"D{usage.hour:%Y%m%d}", sk),
+                "SK": sk,
+            },
+            UpdateExpression="ADD TotalPrice :price, InputTokens :input, OutputTokens :output, Turns :one",
+            ExpressionAttributeValues=values,
+        )
+
+
+def _query_partition(client, pk: str, entity: type_usage_entity) -> list[dict]:
+    items = []
+    query_params = {
+        "TableName": TABLE_NAME,
+        "KeyConditionExpression": Key("PK").eq(pk)
+        & Key("SK").begins_with(f"{entity}#"),
+        "ProjectionExpression": "SK, TotalPrice",
+    }
+    while True:
+        response = client.query(**query_params)
+        items.extend(response["Items"])
+        if "LastEvaluatedKey" not in response:
+            return items
+
+        query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+async def find_usage_sorted_by_price(
+    entity: type_usage_entity,
+    limit: int,
+    start: datetime,
+    end: datetime,
+) -> list[tuple[str, float]] | None:
+    """Find the ids of bots or users and their total price in the hours from
+    `start` to `end` (inclusive, UTC), sorted by the price.
+    Returns None if the range is not covered by the rollup.
+    """
+    periods = _split_range(start, end)
+    if len(periods) > USAGE_ROLLUP_MAX_PERIODS:
+        logger.info(f"Too many periods to use the rollup: {len(periods)}")
+        return None
+
+    hours = [period for period in periods if period.startswith("H")]
+    retention_start = _utc_now() - timedelta(days=USAGE_ROLLUP_HOURLY_RETENTION_DAYS)
+    if hours and datetime.strptime(hours[0], "H%Y%m%d%H") < retention_start:
+        logger.info("Hourly rollup has expired in the range")
+        return None
+
+    loop = asyncio.get_running_loop()
+    table = _get_table_public_client()
+    response = await loop.run_in_executor(None, partial(table.get_item, Key=_SINCE_KEY))
+    since = response.get("Item", {}).get("Since")
+    # The first hour may be partial
+    if since is None or start <= datetime.strptime(since, "%Y%m%d%H"):
+        logger.info(f"Rollup does not cover the range, since: {since}")
+        return None
+
+    tasks = [
+        loop.run_in_executor(
+            None,
+            partial(
+                _query_partition,
+                table.meta.client,
+                f"{USAGE_ROLLUP_PREFIX}#{period}#{shard}",
+                entity,
+            ),
+        )
+        for period in periods
+        for shard in range(USAGE_ROLLUP_SHARDS)
+    ]
+    results = await asyncio.gather(*tasks)
+
+    total_prices: dict[str, Decimal] = defaultdict(Decimal)
+    for items in results:
+        for item in items:
+            entity_id = item["SK"].split("#", 1)[1]
+            total_prices[entity_id] += item["TotalPrice"]
+
+    return sorted(
+        ((entity_id, float(price)) for entity_id, price in total_prices.items()),
+        key=lambda usage: usage[1],
+        reverse=True,
+    )[:limit]
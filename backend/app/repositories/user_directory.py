@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError
+
+from app.repositories.common import TABLE_NAME, _batch_get_items, _get_aws_resource
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+USER_POOL_ID = os.environ.get("USER_POOL_ID", "us-east-1_XXXXXXXXX")
+# Store the emails on the conversation table as well, shared by all the containers.
+# The entries are also written by the `add_user_to_groups` Cognito trigger.
+USER_DIRECTORY_TABLE_CACHE_ENABLED = (
+    os.environ.get("USER_DIRECTORY_TABLE_CACHE_ENABLED", "true").lower() == "true"
+)
+USER_DIRECTORY_PREFIX = "USER_DIRECTORY"
+USER_DIRECTORY_CACHE_TTL_SECONDS = 60 * 60
+# Least recently used users are evicted over this count
+USER_DIRECTORY_CACHE_MAX_ENTRIES = 10000
+# Removed by the table TTL after this period, to follow email changes
+USER_DIRECTORY_TABLE_TTL_SECONDS = 7 * 24 * 60 * 60
+# Cognito `AdminGetUser` is throttled per account, far below the Lambda concurrency
+COGNITO_MAX_WORKERS = 4
+COGNITO_REQUESTS_PER_SECOND = 20
+
+cognito = boto3.client("cognito-idp")
+
+# User id -> (expiration, email) in LRU order. The email is None for an unknown user.
+_cache: OrderedDict[str, tuple[float, str | None]] = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class _RateLimiter:
+    """Space out the calls evenly to at most `rate` per second, across threads."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+_cognito_rate_limiter = _RateLimiter(COGNITO_REQUESTS_PER_SECOND)
+
+
+def compose_user_directory_key(user_id: str) -> dict:
+    key = f"{USER_DIRECTORY_PREFIX}#{user_id}"
+    return {"PK": key, "SK": key}
+
+
+def _find_email_from_cognito(user_id: str) -> str | None:
+    _cognito_rate_limiter.wait()
+    try:
+        response = cognito.admin_get_user(UserPoolId=USER_POOL_ID, Username=user_id)
+    except cognito.exceptions.UserNotFoundException:
+        return None
+
+    return next(
+        (
+            attr["Value"]
+            for attr in response["UserAttributes"]
+            if attr["Name"] == "email"
+        ),
+        None,
+    )
+
+
+def _find_emails_from_table(dynamodb, user_ids: list[str]) -> dict[str, str]:
+    items = _batch_get_items(
+        dynamodb,
+        [compose_user_directory_key(user_id) for user_id in user_ids],
+        "PK, Email",
+    )
+    return {item["PK"].split("#", 1)[1]: item["Email"] for item in items}
+
+
+def _store_emails_to_table(dynamodb, emails: dict[str, str]):
+    expire = int(time.time()) + USER_DIRECTORY_TABLE_TTL_SECONDS
+    with dynamodb.Table(TABLE_NAME).batch_writer() as batch:
+        for user_id, email in emails.items():
+            batch.put_item(
+                Item={
+                    **compose_user_directory_key(user_id),
+                    "Email": email,
+                    "expire": expire,
+                }
+            )
+
+
+def find_emails_by_user_ids(user_ids: list[str]) -> dict[str, str]:
+    """Find the emails of the users from the cache, then DynamoDB, then Cognito.
+    Users not found are omitted from the result.
+    """
+    now = time.monotonic()
+    emails: dict[str, str] = {}
+    missing: list[str] = []
+    with _cache_lock:
+        for user_id in dict.fromkeys(user_ids):
+            cached = _cache.get(user_id)
+            if cached is None or cached[0] <= now:
+                _cache.pop(user_id, None)
+                missing.append(user_id)
+                continue
+
+            _cache.move_to_end(user_id)
+            if cached[1] is not None:
+                emails[user_id] = cached[1]
+
+    if not missing:
+        return emails
+
+    found: dict[str, str | None] = {}
+    dynamodb = None
+    if USER_DIRECTORY_TABLE_CACHE_ENABLED:
+        dynamodb = _get_aws_resource("dynamodb")
+        found.update(_find_emails_from_table(dynamodb, missing))
+        missing = [user_id for user_id in missing if user_id not in found]
+
+    if missing:
+        logger.info(f"Finding {len(missing)} users from Cognito")
+        with ThreadPoolExecutor(max_workers=COGNITO_MAX_WORKERS) as executor:
+            fetched = dict(
+                zip(missing, executor.map(_find_email_from_cognito, missing))
+            )
+        found.update(fetched)
+
+        if dynamodb is not None:
+            try:
+                _store_emails_to_table(
+                    dynamodb,
+                    {
+                        user_id: email
+                        for user_id, email in fetched.items()
+                        if email is not None
+                    },
+                )
+            except ClientError as e:
+                logger.warning(f"Failed to store the user directory: {e}")
+
+    expiration = time.monotonic() + USER_DIRECTORY_CACHE_TTL_SECONDS
+    with _cache_lock:
+        for user_id, email in found.items():
+            _cache[user_id] = (expiration, email)
+            _cache.move_to_end(user_id)
+        while len(_cache) > USER_DIRECTORY_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+    emails.update(
+        {user_id: email for user_id, email in found.items() if email is not None}
+    )
+    return emails
@@ -0,0 +1,44 @@
+import logging
+
+from app.repositories.common import (
+    _get_table_client,
+    _get_table_public_client,
+    compose_published_api_user_id,
+    compose_webhook_id,
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Webhooks notified of the messages of the asynchronous published API, configured
+# per API key by the owner of the bot:
+#   PK: PUBLISHED_API#{bot_id}
+#   SK: PUBLISHED_API#{bot_id}#WEBHOOK#{api_key_id}
+#   Url: https url to post the `MessageStatusOutput` to
+
+
+def _compose_key(bot_id: str, api_key_id: str):
+    user_id = compose_published_api_user_id(bot_id)
+    return {"PK": user_id, "SK": compose_webhook_id(user_id, api_key_id)}
+
+
+def store_webhook(bot_id: str, api_key_id: str, url: str):
+    """Store the webhook of an API key.
+    Warning: No row-level access. Check the permission of the bot before calling.
+    """
+    table = _get_table_public_client()
+    table.put_item(Item={**_compose_key(bot_id, api_key_id), "Url": url})
+
+
+def find_webhook_url(bot_id: str, api_key_id: str) -> str | None:
+    table = _get_table_client(compose_published_api_user_id(bot_id))
+    response = table.get_item(Key=_compose_key(bot_id, api_key_id))
+    return response.get("Item", {}).get("Url")
+
+
+def delete_webhook(bot_id: str, api_key_id: str):
+    """Delete the webhook of an API key.
+    Warning: No row-level access. Check the permission of the bot before calling.
+    """
+    table = _get_table_public_client()
+    table.delete_item(Key=_compose_key(bot_id, api_key_id))
@@ -1,26 +1,64 @@
+import asyncio
 import json
+import logging
 import os
-from time import sleep
-from app.repositories.conversation import find_related_documents_by_conversation_id, find_related_document_by_id
+from functools import partial
+from time import time
+from app.repositories.conversation import (
+    find_related_document_by_id,
+    find_related_document_source_links,
+    find_related_documents_by_conversation_id,
+)
 import boto3
+from app.repositories.common import (
+    RecordNotFoundError,
+    decompose_published_api_user_id,
+    is_published_api_user_id,
+)
+from app.repositories.idempotency import (
+    STATUS_COMPLETED,
+    STATUS_FAILED,
+    find_message_status,
+    store_pending_message,
+)
 from app.routes.schemas.conversation import ChatInput, Conversation, MessageInput, RelatedDocument
 from app.routes.schemas.published_api import (
     ChatInputWithoutBotId,
     ChatOutputWithoutBotId,
     MessageRequestedResponse,
+    MessageStatusOutput,
 )
 from app.usecases.chat import chat, fetch_conversation
 from app.user import User
 from fastapi import APIRouter, HTTPException, Request
 from ulid import ULID
 
-from app.routes.schemas.conversation import MessageOutput
+from app.routes.schemas.conversation import (
+    JsonToolResult,
+    MessageOutput,
+    ToolResultContent,
+)
+
+logger = logging.getLogger(__name__)
 
 REGION = os.environ.get("REGION", "us-east-1")
 router = APIRouter(tags=["published_api"])
 
 sqs_client = boto3.client("sqs", region_name=REGION)
 QUEUE_URL = os.environ.get("QUEUE_URL", "")
+# NOTE: API Gateway times out after 29 seconds
+MAX_WAIT_SECONDS = 20
+POLL_INTERVAL_SECONDS = 1
+
+
+def _find_api_key_id(request: Request) -> str | None:
+    """Id of the API key of the request, in the request context of API Gateway
+    forwarded by the Lambda Web Adapter.
+    """
+    request_context = request.headers.get("x-amzn-request-context")
+    if request_context is None:
+        return None
+    return json.loads(request_context).get("identity", {}).get("apiKeyId")
 
 
 @router.get("/health")
@@ -37,7 +75,9 @@ def post_message(request: Request, message_input: ChatInputWithoutBotId):
     # Extract bot_id from `current_user.id`
     # NOTE: user_id naming rule is implemented on `add_current_user_to_request` method
     bot_id = (
-        current_user.id.split("#")[1] if "#" in current_user.id else current_user.id
+        decompose_published_api_user_id(current_user.id)
+        if is_published_api_user_id(current_user.id)
+        else current_user.id
     )
 
     # Generate conversation id if not provided
@@ -63,6 +103,13 @@ def post_message(request: Request, message_input: ChatInputWithoutBotId):
     )
 
     try:
+        # Record the status first, so that polls do not miss the message
+        store_pending_message(
+            user_id=current_user.id,
+            conversation_id=conversation_id,
+            message_id=response_message_id,
+            api_key_id=_find_api_key_id(request),
+        )
         _ = sqs_client.send_message(
             QueueUrl=QUEUE_URL, MessageBody=chat_input.model_dump_json()
         )
@@ -91,6 +138,20 @@ def get_message(request: Request, conversation_id: str, message_id: str):
     """Get specified message in a conversation. If the message does not exist, it will return 404."""
     current_user: User = request.state.current_user
 
+    # Answer pending messages without loading the conversation
+    try:
+        message_status = find_message_status(
+            current_user.id, conversation_id, message_id
+        )
+        if message_status.status != STATUS_COMPLETED:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Message {message_id} is {message_status.status.lower()}",
+            )
+    except RecordNotFoundError:
+        # The status is expired or has never been recorded
+        pass
+
     conversation = fetch_conversation(current_user.id, conversation_id)
     input_message = conversation.message_map.get(message_id, None)
     if input_message is None:
@@ -106,7 +167,6 @@ def get_message(request: Request, conversation_id: str, message_id: str):
             detail=f"Message {message_id} not found in conversation {conversation_id}",
         )
 
-    print("Enhancing message")
     # Enhance the message with source links
     enhanced_message = enhance_message_with_source_links(
         user_id=current_user.id,
@@ -157,51 +217,75 @@ def get_related_document(
 
 
 def enhance_message_with_source_links(user_id: str, conversation_id: str, message: MessageOutput):
-    """Add source_url to each source_id in the thinking_log."""
+    """Add source_url to each source_id in the thinking_log, in place.
+    Only the related documents cited by the message are read."""
+    if not message.thinking_log:
+        return message
+
+    json_results = [
+        tool_result.json_
+        for log in message.thinking_log
+        for content in log.content
+        if isinstance(content, ToolResultContent)
+        for tool_result in content.body.content
+        if isinstance(tool_result, JsonToolResult)
+    ]
+    if not json_results:
+        return message
+
     try:
-        # Fetch the related documents
-        related_documents = find_related_documents_by_conversation_id(
+        source_links = find_related_document_source_links(
             user_id=user_id,
             conversation_id=conversation_id,
+            source_ids=[result.source_id for result in json_results],
         )
+    except Exception as e:
+        logger.exception(f"Error enhancing message with related documents: {e}")
+        return message
 
-        print("While enhancing message: " + str(related_documents))
-        print("hasattr(message, 'thinking_log') = " + str(hasattr(message, 'thinking_log')))
-
-        # Create a mapping of source_id to source_link from related documents
-        source_id_to_url = {}
-        for doc in related_documents:
-            if hasattr(doc, 'source_id') and hasattr(doc, 'source_link'):
-                source_id_to_url[doc.source_id] = doc.source_link
-
-        # Process thinking_log if it exists
-        if hasattr(message, 'thinking_log'):
-            print("Successful append related Documents")
-            message_dict = message.model_dump()  # Convert Pydantic model to dictionary
-
-            # Iterate through thinking_log messages
-            if 'thinking_log' in message_dict and message_dict['thinking_log']:
-                for message_entry in message_dict['thinking_log']:
-                    if 'content' in message_entry:
-                        for content_item in message_entry['content']:
-                            # Look for toolResult contentType
-                            if content_item.get('content_type') == 'toolResult':
-                                if 'body' in content_item and 'content' in content_item['body']:
-                                    for tool_result in content_item['body']['content']:
-                                        # Look for JSON tool results with source_id
-                                        if 'json_' in tool_result:
-                                            json_content = tool_result['json_']
-                                            if 'source_id' in json_content:
-                                                source_id = json_content['source_id']
-                                                if source_id in source_id_to_url:
-                                                    # Add source_url to the JSON object
-                                                    json_content['source_url'] = source_id_to_url[source_id]
-
-            return MessageOutput(**message_dict)  # Convert back to MessageOutput object
+    for result in json_results:
+        if result.source_id in source_links:
+            result.source_url = source_links[result.source_id]
 
-        return message
+    return message
 
-    except Exception as e:
-        print(f"Error enhancing message with related documents: {e}")
-        return message
 
+@router.get(
+    "/conversation/{conversation_id}/{message_id}/status",
+    response_model=MessageStatusOutput,
+)
+async def get_message_status(
+    request: Request, conversation_id: str, message_id: str, wait_seconds: int = 0
+) -> MessageStatusOutput:
+    """Get the processing status of a message. Waits up to `wait_seconds` (max 20)
+    for the message to be completed or failed (long polling).
+    If the status does not exist, it will return 404."""
+    current_user: User = request.state.current_user
+
+    # NOTE: Wait without holding a worker of the threadpool
+    loop = asyncio.get_running_loop()
+    deadline = time() + min(max(wait_seconds, 0), MAX_WAIT_SECONDS)
+    while True:
+        message_status = await loop.run_in_executor(
+            None,
+            partial(
+                find_message_status,
+                current_user.id,
+                conversation_id,
+                message_id,
+                consistent_read=True,
+            ),
+        )
+        if (
+            message_status.status in (STATUS_COMPLETED, STATUS_FAILED)
+            or time() + POLL_INTERVAL_SECONDS > deadline
+        ):
+            break
+
+        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+    return MessageStatusOutput(
+        conversation_id=conversation_id,
+        message_id=message_id,
+        status=message_status.status,
+    )
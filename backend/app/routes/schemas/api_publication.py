@@ -1,7 +1,7 @@
 from typing import Literal
 
 from app.routes.schemas.base import BaseSchema
-from pydantic import Field, root_validator
+from pydantic import Field, root_validator, validator
 
 
 class PublishedApiQuota(BaseSchema):
@@ -75,6 +75,17 @@ class BotPublishOutput(BaseSchema):
 
 class ApiKeyInput(BaseSchema):
     description: str
+    webhook_url: str | None = Field(
+        None,
+        description="""HTTPS url to be notified with `MessageStatusOutput` when a message
+        sent with the key is completed or failed. The status can be polled instead.""",
+    )
+
+    @validator("webhook_url")
+    def validate_webhook_url(cls, v):
+        if v is not None and not v.startswith("https://"):
+            raise ValueError("Webhook url must be https")
+        return v
 
 
 class ApiKeyOutput(BaseSchema):
@@ -83,3 +94,4 @@ class ApiKeyOutput(BaseSchema):
     value: str
     enabled: bool
     created_date: int
+    webhook_url: str | None = None
@@ -1,5 +1,6 @@
 from app.routes.schemas.base import BaseSchema
 from app.routes.schemas.conversation import Content, MessageOutput, type_model_name
+from app.repositories.models.idempotency import type_message_status
 from pydantic import Field
 
 
@@ -27,3 +28,9 @@ class ChatOutputWithoutBotId(BaseSchema):
 class MessageRequestedResponse(BaseSchema):
     conversation_id: str
     message_id: str
+
+
+class MessageStatusOutput(BaseSchema):
+    conversation_id: str
+    message_id: str
+    status: type_message_status
@@ -1,25 +1,211 @@
 import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import requests
+
+from app import codec
+from app.logging_utils import install_log_budget_filter, start_log_budget, summarize
+from app.repositories.common import QuotaExceededError, compose_published_api_user_id
+from app.repositories.idempotency import (
+    acquire_idempotency_key,
+    complete_idempotency_key,
+    release_idempotency_key,
+)
+from app.repositories.webhook import find_webhook_url
 from app.routes.schemas.conversation import (
     ChatInput,
 )
+from app.routes.schemas.published_api import MessageStatusOutput
 from app.usecases.chat import chat, chat_output_from_message
 
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+install_log_budget_filter()
+
+# NOTE: Each record is a whole chat turn, which mostly waits for Bedrock
+SQS_CONSUMER_MAX_WORKERS = int(os.environ.get("SQS_CONSUMER_MAX_WORKERS", 10))
+CALLBACK_TIMEOUT_SECONDS = 10
+# Same as the `maxReceiveCount` of the queue. Messages failed on the last receive
+# are moved to the dead-letter queue, and reported as failed.
+SQS_MAX_RECEIVE_COUNT = int(os.environ.get("SQS_MAX_RECEIVE_COUNT", 2))
+
+
+def notify_webhook(
+    bot_id: str, api_key_id: str | None, message_status: MessageStatusOutput
+):
+    """Post the message status to the webhook of the API key the message was sent
+    with. Failures are only logged, the client can still poll the status.
+    """
+    if api_key_id is None:
+        return
+
+    webhook_url = find_webhook_url(bot_id, api_key_id)
+    if webhook_url is None:
+        return
+
+    try:
+        response = requests.post(
+            webhook_url,
+            data=message_status.model_dump_json(by_alias=True),
+            headers={"Content-Type": "application/json"},
+            timeout=CALLBACK_TIMEOUT_SECONDS,
+        )
+        response.raise_for_status()
+
+    except requests.RequestException as e:
+        logger.warning(f"Failed to notify {webhook_url}: {e}")
+
+
+def process_record(record: dict):
+    message_body = codec.loads(record["body"])
+    chat_input = ChatInput(**message_body)
+    if chat_input.bot_id is None:
+        raise ValueError("Messages of the published API must have a bot id")
+    user_id = compose_published_api_user_id(chat_input.bot_id)
+
+    # NOTE: The message id is issued on `post_message`, so a redelivered message
+    # has the same id
+    message_id = chat_input.message.message_id
+    if message_id is None:
+        conversation, message = chat(user_id=user_id, chat_input=chat_input)
+        _log_chat_result(conversation, message)
+        return
+
+    message_status = acquire_idempotency_key(
+        user_id, chat_input.conversation_id, message_id
+    )
+    if message_status is None:
+        logger.info(f"Skipping duplicate message: {message_id}")
+        return
+
+    try:
+        conversation, message = chat(user_id=user_id, chat_input=chat_input)
+
+    except Exception:
+        receive_count = int(
+            record.get("attributes", {}).get("ApproximateReceiveCount", 1)
+        )
+        failed = receive_count >= SQS_MAX_RECEIVE_COUNT
+        release_idempotency_key(
+            user_id, chat_input.conversation_id, message_id, failed=failed
+        )
+        if failed:
+            notify_webhook(
+                chat_input.bot_id,
+                message_status.api_key_id,
+                MessageStatusOutput(
+                    conversation_id=chat_input.conversation_id,
+                    message_id=message_id,
+                    status="FAILED",
+                ),
+            )
+        raise
+
+    complete_idempotency_key(user_id, chat_input.conversation_id, message_id)
+    notify_webhook(
+        chat_input.bot_id,
+        message_status.api_key_id,
+        MessageStatusOutput(
+            conversation_id=chat_input.conversation_id,
+            message_id=message_id,
+            status="COMPLETED",
+        ),
+    )
+    _log_chat_result(conversation, message)
+
+
+def _log_chat_result(conversation, message):
+    chat_result = chat_output_from_message(
+        conversation=conversation,
+        message=message,
+    )
+    logger.info("Chat result: %s", summarize(chat_result))
+
+
+def _process_record_with_latency(record: dict) -> bool:
+    start_log_budget()
+    start = time.perf_counter()
+    try:
+        process_record(record)
+        succeeded = True
+
+    except QuotaExceededError as e:
+        # Redelivered after the visibility timeout, when the quota is refilled
+        logger.warning(f"Deferred message {record['messageId']}: {e}")
+        succeeded = False
+
+    except Exception as e:
+        logger.exception(f"Failed to process message {record['messageId']}: {e}")
+        succeeded = False
+
+    logger.info(
+        f"Processed message {record['messageId']} in "
+        f"{time.perf_counter() - start:.3f}s (succeeded: {succeeded})"
+    )
+    return succeeded
+
+
+def _conversation_key(record: dict) -> str:
+    try:
+        conversation_id = codec.loads(record["body"]).get("conversationId")
+    except Exception:
+        conversation_id = None
+    # Records not parsed are processed on their own, to fail in `process_record`
+    return conversation_id or f"MESSAGE#{record['messageId']}"
+
+
+def _process_records_in_order(records: list[dict]) -> list[bool]:
+    """Process the records of a conversation one by one, as each message is
+    the parent of the next one.
+    """
+    results: list[bool] = []
+    for record in records:
+        if results and not results[-1]:
+            # Redelivered with the failed message, not to answer out of order
+            logger.warning(
+                f"Deferred message {record['messageId']} after the failed one"
+            )
+            results.append(False)
+            continue
+        results.append(_process_record_with_latency(record))
+    return results
+
 
 def handler(event, context):
     """SQS consumer.
     This is used for async invocation for published api.
+    Records of different conversations are processed concurrently, those of the same
+    conversation in order. Only the failed ones are reported to be redelivered
+    (`ReportBatchItemFailures` must be enabled on the event source).
     """
-    for record in event["Records"]:
-        message_body = json.loads(record["body"])
-        chat_input = ChatInput(**message_body)
-        user_id = f"PUBLISHED_API#{chat_input.bot_id}"
+    records = event["Records"]
+    groups: dict[str, list[dict]] = {}
+    for record in records:
+        groups.setdefault(_conversation_key(record), []).append(record)
 
-        conversation, message = chat(user_id=user_id, chat_input=chat_input)
-        chat_result = chat_output_from_message(
-            conversation=conversation,
-            message=message,
-        )
-        print(chat_result)
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(SQS_CONSUMER_MAX_WORKERS, len(groups)))
+    ) as executor:
+        group_results = list(executor.map(_process_records_in_order, groups.values()))
+
+    succeeded_by_id = {
+        record["messageId"]: succeeded
+        for group, results in zip(groups.values(), group_results)
+        for record, succeeded in zip(group, results)
+    }
+    failures = [
+        {"itemIdentifier": record["messageId"]}
+        for record in records
+        if not succeeded_by_id[record["messageId"]]
+    ]
+    if failures:
+        logger.warning(f"{len(failures)} of {len(records)} messages failed")
 
-    return {"statusCode": 200, "body": json.dumps("Processing completed")}
+    return {
+        "statusCode": 200,
+        "body": json.dumps("Processing completed"),
+        "batchItemFailures": failures,
+    }
@@ -1,9 +1,16 @@
 import json
 import logging
-from typing import Callable, TypedDict, TypeGuard
+from typing import TYPE_CHECKING, Callable, TypedDict, TypeGuard
 
 from app.agents.tools.agent_tool import AgentTool
-from app.bedrock import calculate_price, compose_args_for_converse_api
+from app.bedrock import (
+    BEDROCK_REGION,
+    calculate_price,
+    compose_args_for_converse_api,
+    get_model_id,
+)
+from app.bedrock_router import RegionRoute, invoke_with_routing
+from app.logging_utils import summarize
 from app.repositories.models.conversation import (
     SimpleMessageModel,
     ContentModel,
@@ -30,6 +37,9 @@ from mypy_boto3_bedrock_runtime.literals import (
     StopReasonType,
 )
 
+if TYPE_CHECKING:
+    from mypy_boto3_bedrock_runtime.type_defs import ConverseStreamRequestTypeDef
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
@@ -150,6 +160,7 @@ class ConverseApiStreamHandler:
         self.tools = tools
         self.on_stream = on_stream
         self.on_thinking = on_thinking
+        self.has_streamed = False
 
     def run(
         self,
@@ -168,220 +179,246 @@ class ConverseApiStreamHandler:
                 grounding_source=grounding_source,
                 tools=self.tools,
             )
-            logger.info(f"args for converse_stream: {args}")
-
-            client = get_bedrock_runtime_client()
-            response = client.converse_stream(**args)
-
-            current_message = _PartialMessage(
-                role="assistant",
-                contents=(
-                    {
-                        index: _content_model_to_partial_content(content=content)
-                        for index, content in enumerate(
-                            message_for_continue_generate.content
-                        )
-                    }
-                    if message_for_continue_generate is not None
-                    else {}
+            logger.info("args for converse_stream: %s", summarize(args))
+
+            self.has_streamed = False
+            return invoke_with_routing(
+                self.model,
+                lambda region: get_model_id(self.model, bedrock_region=region),
+                lambda route: self._converse_stream(
+                    route, args, message_for_continue_generate
                 ),
+                # Never replay what has been streamed to the user
+                can_retry=lambda: not self.has_streamed,
+                # The guardrail must be invoked in the region it is created in
+                regions=[BEDROCK_REGION] if "guardrailConfig" in args else None,
             )
-            current_errors: list[Exception] = []
-            stop_reason: StopReasonType = "end_turn"
-            input_token_count = 0
-            output_token_count = 0
-            for event in response["stream"]:
-                logger.debug(f"event: {event}")
-                if "messageStart" in event:
-                    message_start = event["messageStart"]
-                    current_message["role"] = message_start["role"]
-
-                elif "contentBlockStart" in event:
-                    content_block_start = event["contentBlockStart"]
-                    index = content_block_start["contentBlockIndex"]
-                    start = content_block_start.get("start", {})
-                    tool_use = start.get("toolUse")
-                    if tool_use is not None:
-                        tool_use_id = tool_use["toolUseId"]
-                        tool_name = tool_use["name"]
-
-                        tool_use_content: _PartialToolUseContent = {
-                            "tool_use": {
+
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            raise e
+
+    def _converse_stream(
+        self,
+        route: RegionRoute,
+        args: "ConverseStreamRequestTypeDef",
+        message_for_continue_generate: SimpleMessageModel | None,
+    ) -> OnStopInput:
+        # Retried by `invoke_with_routing` instead of botocore
+        client = get_bedrock_runtime_client(route.region, max_attempts=1)
+        response = client.converse_stream(**{**args, "modelId": route.model_id})
+
+        current_message = _PartialMessage(
+            role="assistant",
+            contents=(
+                {
+                    index: _content_model_to_partial_content(content=content)
+                    for index, content in enumerate(
+                        message_for_continue_generate.content
+                    )
+                }
+                if message_for_continue_generate is not None
+                else {}
+            ),
+        )
+        current_errors: list[Exception] = []
+        stop_reason: StopReasonType = "end_turn"
+        input_token_count = 0
+        output_token_count = 0
+        for event in response["stream"]:
+            logger.debug("event: %s", summarize(event))
+            if "messageStart" in event:
+                message_start = event["messageStart"]
+                current_message["role"] = message_start["role"]
+
+            elif "contentBlockStart" in event:
+                content_block_start = event["contentBlockStart"]
+                index = content_block_start["contentBlockIndex"]
+                start = content_block_start.get("start", {})
+                tool_use = start.get("toolUse")
+                if tool_use is not None:
+                    tool_use_id = tool_use["toolUseId"]
+                    tool_name = tool_use["name"]
+
+                    tool_use_content: _PartialToolUseContent = {
+                        "tool_use": {
+                            "tool_use_id": tool_use_id,
+                            "name": tool_name,
+                            "input": "",
+                        }
+                    }
+                    current_message["contents"][index] = tool_use_content
+
+            elif "contentBlockDelta" in event:
+                route.first_token()
+                content_block_delta = event["contentBlockDelta"]
+                index = content_block_delta["contentBlockIndex"]
+                delta = content_block_delta["delta"]
+                if "toolUse" in delta:
+                    input = delta["toolUse"]["input"]
+                    if index in current_message["contents"]:
+                        content = current_message["contents"][index]
+                        if _is_tool_use_content(content=content):
+                            content["tool_use"]["input"] += input
+
+                elif "text" in delta:
+                    text = delta["text"]
+                    if index in current_message["contents"]:
+                        content = current_message["contents"][index]
+                        if _is_text_content(content=content):
+                            content["text"] += text
+
+                    else:
+                        text_content: _PartialTextContent = {
+                            "text": text,
+                        }
+                        current_message["contents"][index] = text_content
+
+                    if self.on_stream:
+                        # Not to retry once anything has been streamed to the user
+                        self.has_streamed = True
+                        self.on_stream(text)
+
+            elif "contentBlockStop" in event:
+                content_block_stop = event["contentBlockStop"]
+                index = content_block_stop["contentBlockIndex"]
+                content = current_message["contents"][index]
+                if _is_tool_use_content(content=content):
+                    tool_use = content["tool_use"]
+                    tool_use_id = tool_use["tool_use_id"]
+                    tool_name = tool_use["name"]
+                    input = json.loads(tool_use["input"] or "{}")
+
+                    if self.on_thinking:
+                        self.has_streamed = True
+                        self.on_thinking(
+                            {
                                 "tool_use_id": tool_use_id,
                                 "name": tool_name,
-                                "input": "",
+                                "input": input,
                             }
-                        }
-                        current_message["contents"][index] = tool_use_content
-
-                elif "contentBlockDelta" in event:
-                    content_block_delta = event["contentBlockDelta"]
-                    index = content_block_delta["contentBlockIndex"]
-                    delta = content_block_delta["delta"]
-                    if "toolUse" in delta:
-                        input = delta["toolUse"]["input"]
-                        if index in current_message["contents"]:
-                            content = current_message["contents"][index]
-                            if _is_tool_use_content(content=content):
-                                content["tool_use"]["input"] += input
-
-                    elif "text" in delta:
-                        text = delta["text"]
-                        if index in current_message["contents"]:
-                            content = current_message["contents"][index]
-                            if _is_text_content(content=content):
-                                content["text"] += text
-
-                        else:
-                            text_content: _PartialTextContent = {
-                                "text": text,
-                            }
-                            current_message["contents"][index] = text_content
-
-                        if self.on_stream:
-                            self.on_stream(text)
-
-                elif "contentBlockStop" in event:
-                    content_block_stop = event["contentBlockStop"]
-                    index = content_block_stop["contentBlockIndex"]
-                    content = current_message["contents"][index]
-                    if _is_tool_use_content(content=content):
-                        tool_use = content["tool_use"]
-                        tool_use_id = tool_use["tool_use_id"]
-                        tool_name = tool_use["name"]
-                        input = json.loads(tool_use["input"] or "{}")
-
-                        if self.on_thinking:
-                            self.on_thinking(
-                                {
-                                    "tool_use_id": tool_use_id,
-                                    "name": tool_name,
-                                    "input": input,
-                                }
-                            )
-
-                elif "messageStop" in event:
-                    stop_reason = event["messageStop"]["stopReason"]
-
-                elif "metadata" in event:
-                    metadata = event["metadata"]
-                    usage = metadata["usage"]
-                    input_token_count = usage["inputTokens"]
-                    output_token_count = usage["outputTokens"]
-
-                elif "modelStreamErrorException" in event:
-                    exception = event["modelStreamErrorException"]
-                    message = exception.get("message")
-                    original_status_code = exception.get("originalStatusCode")
-                    original_message = exception.get("originalMessage")
-                    current_errors.append(
-                        client.exceptions.ModelStreamErrorException(
-                            error_response={
-                                "Error": {
-                                    "Code": "ModelStreamErrorException",
-                                    "Message": message,
-                                    "OriginalStatusCode": original_status_code,
-                                    "OriginalMessage": original_message,
-                                },
-                            },
-                            operation_name="ConverseStream",
                         )
-                    )
 
-                elif "throttlingException" in event:
-                    exception = event["throttlingException"]
-                    message = exception.get("message")
-                    current_errors.append(
-                        client.exceptions.ThrottlingException(
-                            error_response={
-                                "Error": {
-                                    "Code": "ThrottlingException",
-                                    "Message": message,
-                                },
+            elif "messageStop" in event:
+                stop_reason = event["messageStop"]["stopReason"]
+
+            elif "metadata" in event:
+                metadata = event["metadata"]
+                usage = metadata["usage"]
+                input_token_count = usage["inputTokens"]
+                output_token_count = usage["outputTokens"]
+
+            elif "modelStreamErrorException" in event:
+                exception = event["modelStreamErrorException"]
+                message = exception.get("message")
+                original_status_code = exception.get("originalStatusCode")
+                original_message = exception.get("originalMessage")
+                current_errors.append(
+                    client.exceptions.ModelStreamErrorException(
+                        error_response={
+                            "Error": {
+                                "Code": "ModelStreamErrorException",
+                                "Message": message,
+                                "OriginalStatusCode": original_status_code,
+                                "OriginalMessage": original_message,
                             },
-                            operation_name="ConverseStream",
-                        )
+                        },
+                        operation_name="ConverseStream",
                     )
-
-                elif "internalServerException" in event:
-                    exception = event["internalServerException"]
-                    message = exception.get("message")
-                    current_errors.append(
-                        client.exceptions.InternalServerException(
-                            error_response={
-                                "Error": {
-                                    "Code": "InternalServerException",
-                                    "Message": message,
-                                },
+                )
+
+            elif "throttlingException" in event:
+                exception = event["throttlingException"]
+                message = exception.get("message")
+                current_errors.append(
+                    client.exceptions.ThrottlingException(
+                        error_response={
+                            "Error": {
+                                "Code": "ThrottlingException",
+                                "Message": message,
                             },
-                            operation_name="ConverseStream",
-                        )
+                        },
+                        operation_name="ConverseStream",
                     )
-
-                elif "serviceUnavailableException" in event:
-                    exception = event["serviceUnavailableException"]
-                    message = exception.get("message")
-                    current_errors.append(
-                        client.exceptions.ServiceUnavailableException(
-                            error_response={
-                                "Error": {
-                                    "Code": "ServiceUnavailableException",
-                                    "Message": message,
-                                },
+                )
+
+            elif "internalServerException" in event:
+                exception = event["internalServerException"]
+                message = exception.get("message")
+                current_errors.append(
+                    client.exceptions.InternalServerException(
+                        error_response={
+                            "Error": {
+                                "Code": "InternalServerException",
+                                "Message": message,
                             },
-                            operation_name="ConverseStream",
-                        )
+                        },
+                        operation_name="ConverseStream",
                     )
-
-                elif "validationException" in event:
-                    exception = event["validationException"]
-                    message = exception.get("message")
-                    current_errors.append(
-                        client.exceptions.ValidationException(
-                            error_response={
-                                "Error": {
-                                    "Code": "ValidationException",
-                                    "Message": message,
-                                },
+                )
+
+            elif "serviceUnavailableException" in event:
+                exception = event["serviceUnavailableException"]
+                message = exception.get("message")
+                current_errors.append(
+                    client.exceptions.ServiceUnavailableException(
+                        error_response={
+                            "Error": {
+                                "Code": "ServiceUnavailableException",
+                                "Message": message,
                             },
-                            operation_name="ConverseStream",
-                        )
+                        },
+                        operation_name="ConverseStream",
                     )
+                )
+
+            elif "validationException" in event:
+                exception = event["validationException"]
+                message = exception.get("message")
+                current_errors.append(
+                    client.exceptions.ValidationException(
+                        error_response={
+                            "Error": {
+                                "Code": "ValidationException",
+                                "Message": message,
+                            },
+                        },
+                        operation_name="ConverseStream",
+                    )
+                )
+
+        if len(current_errors) > 0:
+            if len(current_errors) == 1:
+                raise current_errors[0]
+
+            else:
+                raise ExceptionGroup("Exceptions in ConverseStream", current_errors)
+
+        # Append entire completion as the last message
+        message = MessageModel(
+            role="assistant",
+            content=[
+                _content_model_from_partial_content(content=content)
+                for _, content in sorted(current_message["contents"].items())
+            ],
+            model=self.model,
+            children=[],
+            parent=None,
+            create_time=get_current_time(),
+            feedback=None,
+            used_chunks=None,
+            thinking_log=None,
+        )
 
-            if len(current_errors) > 0:
-                if len(current_errors) == 1:
-                    raise current_errors[0]
-
-                else:
-                    raise ExceptionGroup("Exceptions in ConverseStream", current_errors)
-
-            # Append entire completion as the last message
-            message = MessageModel(
-                role="assistant",
-                content=[
-                    _content_model_from_partial_content(content=content)
-                    for _, content in sorted(current_message["contents"].items())
-                ],
-                model=self.model,
-                children=[],
-                parent=None,
-                create_time=get_current_time(),
-                feedback=None,
-                used_chunks=None,
-                thinking_log=None,
-            )
-
-            price = calculate_price(self.model, input_token_count, output_token_count)
-
-            result = OnStopInput(
-                message=message,
-                stop_reason=stop_reason,
-                input_token_count=input_token_count,
-                output_token_count=output_token_count,
-                price=price,
-            )
-            return result
+        price = calculate_price(
+            self.model, input_token_count, output_token_count, region=route.region
+        )
 
-        except Exception as e:
-            logger.error(f"Error: {e}")
-            raise e
+        result = OnStopInput(
+            message=message,
+            stop_reason=stop_reason,
+            input_token_count=input_token_count,
+            output_token_count=output_token_count,
+            price=price,
+        )
+        return result
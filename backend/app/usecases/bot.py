@@ -71,10 +71,11 @@ from app.utils import (
     compose_upload_temp_s3_path,
     compose_upload_temp_s3_prefix,
     delete_file_from_s3,
+    delete_files_from_s3,
     delete_files_with_prefix_from_s3,
     generate_presigned_url,
     get_current_time,
-    move_file_in_s3,
+    move_files_in_s3,
 )
 from boto3.dynamodb.conditions import Attr, Key
 from botocore.exceptions import ClientError
@@ -110,17 +111,26 @@ def _update_s3_documents_by_diff(
         added_filenames: List of new filenames to add
         deleted_filenames: List of existing filenames to delete
     """
-    for filename in added_filenames:
-        tmp_path = compose_upload_temp_s3_path(user_id, bot_id, filename)
-        document_path = compose_upload_document_s3_path(user_id, bot_id, filename)
-        move_file_in_s3(DOCUMENT_BUCKET, tmp_path, document_path)
-
-    for filename in deleted_filenames:
-        document_path = compose_upload_document_s3_path(user_id, bot_id, filename)
+    move_files_in_s3(
+        DOCUMENT_BUCKET,
+        [
+            (
+                compose_upload_temp_s3_path(user_id, bot_id, filename),
+                compose_upload_document_s3_path(user_id, bot_id, filename),
+            )
+            for filename in added_filenames
+        ],
+    )
 
-        # Ignore errors when deleting a non-existent file from the S3 bucket used in knowledge bases.
-        # This allows users to update bot if the uploaded file is missing after the bot is created.
-        delete_file_from_s3(DOCUMENT_BUCKET, document_path, ignore_not_exist=True)
+    # Non-existent files are ignored when deleting from the S3 bucket used in knowledge bases.
+    # This allows users to update bot if the uploaded file is missing after the bot is created.
+    delete_files_from_s3(
+        DOCUMENT_BUCKET,
+        [
+            compose_upload_document_s3_path(user_id, bot_id, filename)
+            for filename in deleted_filenames
+        ],
+    )
 
 
 def create_new_bot(user_id: str, bot_input: BotInput) -> BotOutput:
@@ -15,6 +15,7 @@ from app.agents.tools.agent_tool import (
 from app.agents.tools.knowledge import create_knowledge_tool
 from app.agents.utils import get_tool_by_name
 from app.bedrock import call_converse_api, compose_args_for_converse_api
+from app.logging_utils import summarize
 from app.prompt import build_rag_prompt, get_prompt_to_cite_tool_results
 from app.repositories.conversation import (
     RecordNotFoundError,
@@ -37,6 +38,8 @@ from app.repositories.models.custom_bot import (
     BotModel,
     ConversationQuickStarterModel,
 )
+from app.repositories.usage_quota import admit_turn, charge_tokens
+from app.repositories.usage_rollup import record_usage
 from app.routes.schemas.conversation import (
     ChatInput,
     ChatOutput,
@@ -93,7 +96,7 @@ def prepare_conversation(
     try:
         # Fetch existing conversation
         conversation = find_conversation_by_id(user_id, chat_input.conversation_id)
-        logger.info(f"Found conversation: {conversation}")
+        logger.info("Found conversation: %s", summarize(conversation))
         parent_id = chat_input.message.parent_message_id
         if chat_input.message.parent_message_id == "system" and chat_input.bot_id:
             # The case editing first user message and use bot
@@ -297,6 +300,8 @@ def chat(
     Returns:
         tuple[ConversationModel, MessageModel]: The updated conversation and the generated message
     """
+    admit_turn(user_id, chat_input.bot_id, chat_input.message.model)
+
     user_msg_id, conversation, bot = prepare_conversation(user_id, chat_input)
 
     tools = (
@@ -352,7 +357,9 @@ def chat(
                     )
 
                 search_results = search_related_docs(bot=bot, query=content.body)
-                logger.info(f"Search results from vector store: {search_results}")
+                logger.info(
+                    "Search results from vector store: %s", summarize(search_results)
+                )
 
                 if on_tool_result:
                     on_tool_result(
@@ -425,6 +432,10 @@ def chat(
     )
 
     thinking_log: list[SimpleMessageModel] = []
+    # Usage of this turn, including the tool use iterations
+    price = 0.0
+    input_token_count = 0
+    output_token_count = 0
     while True:
         result = stream_handler.run(
             messages=messages,
@@ -436,6 +447,9 @@ def chat(
         stop_reason = result["stop_reason"]
 
         conversation.total_price += result["price"]
+        price += result["price"]
+        input_token_count += result["input_token_count"]
+        output_token_count += result["output_token_count"]
         conversation.should_continue = stop_reason == "max_tokens"
 
         if stop_reason != "tool_use":
@@ -533,6 +547,20 @@ def chat(
         related_documents=related_documents,
     )
 
+    record_usage(
+        user_id=user_id,
+        bot_id=chat_input.bot_id,
+        price=price,
+        input_token_count=input_token_count,
+        output_token_count=output_token_count,
+    )
+    charge_tokens(
+        user_id,
+        chat_input.bot_id,
+        chat_input.message.model,
+        input_token_count + output_token_count,
+    )
+
     if on_stop:
         on_stop(result)
 
@@ -18,6 +18,7 @@ from app.repositories.custom_bot import (
     update_bot_publication,
 )
 from app.repositories.models.custom_bot import BotModel
+from app.repositories.webhook import delete_webhook, find_webhook_url, store_webhook
 from app.routes.schemas.api_publication import (
     ApiKeyInput,
     ApiKeyOutput,
@@ -275,6 +276,7 @@ def remove_bot_publication(user: User, bot_id: str):
         usage_plan = find_usage_plan_by_id(stack.api_usage_plan_id)  # type: ignore
         for key_id in usage_plan.key_ids:
             delete_api_key(key_id)
+            delete_webhook(bot_id, key_id)
 
     # Delete `ApiPublishmentStack` by CloudFormation
     delete_stack_by_bot_id(bot_id)
@@ -325,6 +327,7 @@ def fetch_api_key(user: User, bot_id: str, api_key: str) -> ApiKeyOutput:
         description=key.description,
         enabled=key.enabled,
         created_date=key.created_date,
+        webhook_url=find_webhook_url(bot_id, key.id),
     )
 
 
@@ -338,11 +341,12 @@ def create_new_api_key(
     - Verifies the bot exists and is published
     - Creates a new API key with the specified description
     - Associates the API key with the bot's usage plan
+    - Stores the webhook of the API key, if specified
 
     Args:
         user: The requesting user
         bot_id: The ID of the published bot
-        api_key_input: Input containing the API key description
+        api_key_input: Input containing the API key description and webhook url
 
     Returns:
         ApiKeyOutput: The created API key details
@@ -361,12 +365,16 @@ def create_new_api_key(
 
     # Create API Key
     key = create_api_key(usage_plan.id, api_key_input.description)
+    if api_key_input.webhook_url is not None:
+        store_webhook(bot_id, key.id, api_key_input.webhook_url)
+
     return ApiKeyOutput(
         id=key.id,
         value="",
         description=key.description,
         enabled=key.enabled,
         created_date=key.created_date,
+        webhook_url=api_key_input.webhook_url,
     )
 
 
@@ -377,7 +385,7 @@ def remove_api_key(user: User, bot_id: str, api_key_id: str):
     This function:
     - Verifies the bot exists and is published
     - Checks if the API key is associated with the bot
-    - Deletes the API key
+    - Deletes the API key and its webhook
 
     Args:
         user: The requesting user
@@ -405,4 +413,5 @@ def remove_api_key(user: User, bot_id: str, api_key_id: str):
 
     # Delete API Key
     delete_api_key(api_key_id)
+    delete_webhook(bot_id, api_key_id)
     return
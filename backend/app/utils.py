@@ -8,6 +8,7 @@ including AWS service clients, S3 operations, and time helpers.
 import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Any, Literal
 
@@ -23,6 +24,11 @@ BEDROCK_REGION = os.environ.get("BEDROCK_REGION", "us-east-1")
 PUBLISH_API_CODEBUILD_PROJECT_NAME = os.environ.get(
     "PUBLISH_API_CODEBUILD_PROJECT_NAME", ""
 )
+S3_MAX_WORKERS = 8
+S3_DELETE_OBJECTS_SIZE = 1000
+# Objects larger than this cannot be copied with a single `CopyObject`
+S3_MAX_COPY_OBJECT_SIZE = 5 * 1024**3  # 5GB
+S3_COPY_PART_SIZE = 512 * 1024**2  # 512MB
 
 
 def snake_to_camel(snake_str):
@@ -63,17 +69,28 @@ def get_bedrock_client(region=BEDROCK_REGION):
     return client
 
 
-def get_bedrock_runtime_client(region=BEDROCK_REGION):
+def get_bedrock_runtime_client(region=BEDROCK_REGION, max_attempts: int | None = None):
     """
     Get a Bedrock runtime client for the specified region.
 
     Args:
         region: The AWS region for the Bedrock runtime service
+        max_attempts: Total attempts of each call including retries by botocore,
+            the default retry configuration if None
 
     Returns:
         boto3.client: A Bedrock runtime client
     """
-    client = boto3.client("bedrock-runtime", region_name=region)
+    if max_attempts is None:
+        client = boto3.client("bedrock-runtime", region_name=region)
+    else:
+        client = boto3.client(
+            "bedrock-runtime",
+            region_name=region,
+            config=Config(
+                retries={"mode": "standard", "total_max_attempts": max_attempts}
+            ),
+        )
     return client
 
 
@@ -241,24 +258,88 @@ def delete_file_from_s3(bucket: str, key: str, ignore_not_exist: bool = False):
     return response
 
 
-def delete_files_with_prefix_from_s3(bucket: str, prefix: str):
+def _delete_objects_in_s3(client, bucket: str, keys: list[str]) -> int:
+    response = client.delete_objects(
+        Bucket=bucket,
+        Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+    )
+    errors = response.get("Errors") or []
+    if errors:
+        raise RuntimeError(
+            f"Failed to delete {len(errors)} objects from s3://{bucket}: {errors[:5]}"
+        )
+    return len(keys)
+
+
+def delete_files_from_s3(bucket: str, keys: list[str]) -> int:
     """
-    Delete all objects with the given prefix from the given bucket.
+    Delete files from S3.
 
-    This function deletes all files in an S3 bucket that match the specified prefix.
+    This function deletes the given objects with `DeleteObjects` in groups of
+    1,000 keys, sending the requests in parallel. Objects which do not exist
+    are ignored.
 
     Args:
         bucket: The S3 bucket name
-        prefix: The prefix of the objects to delete
+        keys: The object keys in the bucket
+
+    Returns:
+        int: The number of deleted objects
+
+    Raises:
+        RuntimeError: If some of the objects could not be deleted
     """
     client = boto3.client("s3", region_name=BEDROCK_REGION)
-    response = client.list_objects_v2(Bucket=bucket, Prefix=prefix)
+    with ThreadPoolExecutor(max_workers=S3_MAX_WORKERS) as executor:
+        futures = [
+            executor.submit(
+                _delete_objects_in_s3,
+                client,
+                bucket,
+                keys[i : i + S3_DELETE_OBJECTS_SIZE],
+            )
+            for i in range(0, len(keys), S3_DELETE_OBJECTS_SIZE)
+        ]
+        return sum(future.result() for future in futures)
 
-    if "Contents" not in response:
-        return
 
-    for obj in response["Contents"]:
-        client.delete_object(Bucket=bucket, Key=obj["Key"])
+def delete_files_with_prefix_from_s3(bucket: str, prefix: str) -> int:
+    """
+    Delete all objects with the given prefix from the given bucket.
+
+    This function lists every page of objects matching the specified prefix and
+    deletes them with `DeleteObjects` (up to 1,000 keys per request), sending the
+    requests in parallel.
+
+    Args:
+        bucket: The S3 bucket name
+        prefix: The prefix of the objects to delete
+
+    Returns:
+        int: The number of deleted objects
+
+    Raises:
+        RuntimeError: If some of the objects could not be deleted
+    """
+    client = boto3.client("s3", region_name=BEDROCK_REGION)
+    paginator = client.get_paginator("list_objects_v2")
+
+    with ThreadPoolExecutor(max_workers=S3_MAX_WORKERS) as executor:
+        # NOTE: A page has at most 1,000 keys, the limit of `DeleteObjects`
+        futures = [
+            executor.submit(
+                _delete_objects_in_s3,
+                client,
+                bucket,
+                [obj["Key"] for obj in page["Contents"]],
+            )
+            for page in paginator.paginate(Bucket=bucket, Prefix=prefix)
+            if page.get("Contents")
+        ]
+        deleted = sum(future.result() for future in futures)
+
+    logger.info(f"Deleted {deleted} objects from s3://{bucket}/{prefix}")
+    return deleted
 
 
 def check_if_file_exists_in_s3(bucket: str, key: str):
@@ -288,36 +369,84 @@ def check_if_file_exists_in_s3(bucket: str, key: str):
     return True
 
 
-def move_file_in_s3(bucket: str, key: str, new_key: str):
-    """
-    Move a file within S3 by copying and deleting the original.
+def _multipart_copy_object_in_s3(
+    client, bucket: str, key: str, new_key: str, size: int
+):
+    upload_id = client.create_multipart_upload(Bucket=bucket, Key=new_key)["UploadId"]
+
+    def copy_part(part_number: int, start: int) -> dict:
+        end = min(start + S3_COPY_PART_SIZE, size) - 1
+        response = client.upload_part_copy(
+            Bucket=bucket,
+            Key=new_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            CopySource={"Bucket": bucket, "Key": key},
+            CopySourceRange=f"bytes={start}-{end}",
+        )
+        return {"PartNumber": part_number, "ETag": response["CopyPartResult"]["ETag"]}
+
+    starts = range(0, size, S3_COPY_PART_SIZE)
+    try:
+        with ThreadPoolExecutor(max_workers=S3_MAX_WORKERS) as executor:
+            parts = list(executor.map(copy_part, range(1, len(starts) + 1), starts))
 
-    This function moves a file from one key to another within the same S3 bucket.
+        client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=new_key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except Exception:
+        client.abort_multipart_upload(Bucket=bucket, Key=new_key, UploadId=upload_id)
+        raise
 
-    Args:
-        bucket: The S3 bucket name
-        key: The current object key
-        new_key: The new object key
 
-    Returns:
-        dict: The response from the S3 copy operation
-    """
-    client = boto3.client("s3", region_name=BEDROCK_REGION)
-
-    # Check if the file exists
+def _copy_object_in_s3(client, bucket: str, key: str, new_key: str):
     try:
-        client.head_object(Bucket=bucket, Key=key)
+        client.copy_object(
+            Bucket=bucket, Key=new_key, CopySource={"Bucket": bucket, "Key": key}
+        )
     except ClientError as e:
-        if e.response["Error"]["Code"] == "404":
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
             raise FileNotFoundError(f"The file does not exist in bucket.")
-        else:
+        elif e.response["Error"]["Code"] != "InvalidRequest":
             raise
 
-    response = client.copy_object(
-        Bucket=bucket, Key=new_key, CopySource={"Bucket": bucket, "Key": key}
-    )
-    response = client.delete_object(Bucket=bucket, Key=key)
-    return response
+        # Copy with a multipart upload only if rejected for the size
+        size = client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        if size <= S3_MAX_COPY_OBJECT_SIZE:
+            raise
+        _multipart_copy_object_in_s3(client, bucket, key, new_key, size)
+
+
+def move_files_in_s3(bucket: str, keys: list[tuple[str, str]]):
+    """
+    Move files within S3 by copying them in parallel and deleting the originals.
+
+    Objects larger than 5GB are copied with a multipart upload. The originals are
+    deleted in batches only after all the copies succeeded.
+
+    Args:
+        bucket: The S3 bucket name
+        keys: Pairs of the current object key and the new object key
+
+    Raises:
+        FileNotFoundError: If one of the files does not exist
+    """
+    if not keys:
+        return
+
+    client = boto3.client("s3", region_name=BEDROCK_REGION)
+    with ThreadPoolExecutor(max_workers=S3_MAX_WORKERS) as executor:
+        futures = [
+            executor.submit(_copy_object_in_s3, client, bucket, key, new_key)
+            for key, new_key in keys
+        ]
+        for future in futures:
+            future.result()
+
+    delete_files_from_s3(bucket, [key for key, _ in keys])
 
 
 def start_codebuild_project(environment_variables: dict) -> str:
@@ -9,10 +9,13 @@ from threading import Thread
 from typing import BinaryIO, Literal, TypedDict
 
 import boto3
+from app import codec
 from app.auth import verify_token
 from app.agents.tools.agent_tool import (
     ToolRunResult,
 )
+from app.logging_utils import install_log_budget_filter, start_log_budget, summarize
+from app.repositories.common import QuotaExceededError
 from app.repositories.conversation import RecordNotFoundError
 from app.routes.schemas.conversation import ChatInput
 from app.stream import OnStopInput, OnThinking
@@ -28,6 +31,7 @@ table = dynamodb_client.Table(WEBSOCKET_SESSION_TABLE_NAME)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
+install_log_budget_filter()
 
 
 class _NotifyCommand(TypedDict):
@@ -97,28 +101,28 @@ class NotificationSender:
 
     def on_stream(self, token: str):
         # Send completion
-        payload = json.dumps(
+        payload = codec.dumps(
             dict(
                 status="STREAMING",
                 completion=token,
             )
-        ).encode("utf-8")
+        )
 
         self.notify(payload=payload)
 
     def on_stop(self, arg: OnStopInput):
-        payload = json.dumps(
+        payload = codec.dumps(
             dict(
                 status="STREAMING_END",
                 completion="",
                 stop_reason=arg["stop_reason"],
             )
-        ).encode("utf-8")
+        )
 
         self.notify(payload=payload)
 
     def on_agent_thinking(self, tool_use: OnThinking):
-        payload = json.dumps(
+        payload = codec.dumps(
             dict(
                 status="AGENT_THINKING",
                 log={
@@ -128,13 +132,13 @@ class NotificationSender:
                     },
                 },
             )
-        ).encode("utf-8")
+        )
 
         self.notify(payload=payload)
 
     def on_agent_tool_result(self, run_result: ToolRunResult):
         self.notify(
-            payload=json.dumps(
+            payload=codec.dumps(
                 dict(
                     status="AGENT_TOOL_RESULT",
                     result={
@@ -142,12 +146,12 @@ class NotificationSender:
                         "status": run_result["status"],
                     },
                 )
-            ).encode("utf-8")
+            )
         )
 
         for related_document in run_result["related_documents"]:
             self.notify(
-                payload=json.dumps(
+                payload=codec.dumps(
                     dict(
                         status="AGENT_RELATED_DOCUMENT",
                         result={
@@ -157,7 +161,7 @@ class NotificationSender:
                             ),
                         },
                     )
-                ).encode("utf-8")
+                )
             )
 
 
@@ -167,7 +171,7 @@ def process_chat_input(
     notificator: NotificationSender,
 ) -> dict:
     """Process chat input and send the message to the client."""
-    logger.info(f"Received chat input: {chat_input}")
+    logger.info("Received chat input: %s", summarize(chat_input))
 
     try:
         chat(
@@ -211,6 +215,18 @@ def process_chat_input(
                 ),
             }
 
+    except QuotaExceededError as e:
+        logger.warning(f"Rejected chat input of {user_id}: {e}")
+        return {
+            "statusCode": 429,
+            "body": json.dumps(
+                dict(
+                    status="ERROR",
+                    reason=str(e),
+                )
+            ),
+        }
+
     except Exception as e:
         logger.exception(f"Failed to run stream handler: {e}")
         return {
@@ -225,7 +241,8 @@ def process_chat_input(
 
 
 def handler(event, context):
-    logger.info(f"Received event: {event}")
+    start_log_budget()
+    logger.info("Received event: %s", summarize(event))
     route_key = event["requestContext"]["routeKey"]
 
     if route_key == "$connect":
@@ -331,7 +348,7 @@ def handler(event, context):
             full_message = "".join(item["MessagePart"] for item in message_parts)
 
             # Process the concatenated full message
-            chat_input = ChatInput(**json.loads(full_message))
+            chat_input = ChatInput(**codec.loads(full_message))
             return process_chat_input(
                 user_id=user_id,
                 chat_input=chat_input,
@@ -7,10 +7,12 @@ based on the event type (e.g., post-confirmation, post-authentication).
 Environment Variables:
 - USER_POOL_ID: The ID of the Cognito User Pool
 - AUTO_JOIN_USER_GROUPS: JSON list of groups to automatically add users to
+- USER_DIRECTORY_TABLE_NAME: (Optional) The table to pre-populate the user directory cache
 """
 
 import os
 import json
+import time
 
 import boto3
 from aws_lambda_powertools import Logger, Tracer
@@ -20,11 +22,15 @@ USER_POOL_ID: str = os.environ["USER_POOL_ID"]
 AUTO_JOIN_USER_GROUPS: list[str] = json.loads(
     os.environ.get("AUTO_JOIN_USER_GROUPS", "[]")
 )
+USER_DIRECTORY_TABLE_NAME: str | None = os.environ.get("USER_DIRECTORY_TABLE_NAME")
+# Same as `app.repositories.user_directory`
+USER_DIRECTORY_TABLE_TTL_SECONDS = 7 * 24 * 60 * 60
 
 logger = Logger()
 tracer = Tracer()
 
 cognito = boto3.client("cognito-idp")
+dynamodb = boto3.resource("dynamodb")
 
 
 @tracer.capture_lambda_handler
@@ -49,6 +55,12 @@ def handler(event: dict, context: LambdaContext) -> dict:
     trigger_source: str = event["triggerSource"]
     if trigger_source == "PostConfirmation_ConfirmSignUp":
         add_user_to_groups(USER_POOL_ID, user_name, AUTO_JOIN_USER_GROUPS)
+        if USER_DIRECTORY_TABLE_NAME and "email" in user_attributes:
+            store_user_directory_entry(
+                USER_DIRECTORY_TABLE_NAME,
+                user_attributes["sub"],
+                user_attributes["email"],
+            )
 
     elif trigger_source == "PostAuthentication_Authentication":
         user_status: str = user_attributes["cognito:user_status"]
@@ -74,3 +86,28 @@ def add_user_to_groups(user_pool_id: str, username: str, groups: list[str]):
             Username=username,
             GroupName=group,
         )
+
+
+def store_user_directory_entry(table_name: str, user_id: str, email: str):
+    """
+    Store the email of a new user to the user directory cache,
+    so that the admin usage views do not have to look it up from Cognito.
+
+    Args:
+        table_name: The name of the conversation table
+        user_id: The id (`sub`) of the user
+        email: The email of the user
+    """
+    key = f"USER_DIRECTORY#{user_id}"
+    try:
+        dynamodb.Table(table_name).put_item(
+            Item={
+                "PK": key,
+                "SK": key,
+                "Email": email,
+                "expire": int(time.time()) + USER_DIRECTORY_TABLE_TTL_SECONDS,
+            }
+        )
+    except Exception:
+        # The cache is filled on demand as well, so never block the sign-up
+        logger.exception(f"Failed to store the user directory entry of '{user_id}'")
@@ -0,0 +1,148 @@
+"""
+Compact an hourly DynamoDB export into Parquet files for analysis.
+
+This script is triggered when an incremental export is completed. It writes the latest
+image of every conversation updated in the hour, with only the columns used by the
+usage analysis, as Snappy compressed Parquet files under `compact/<datehour>/`.
+The usage analysis reads the export itself for the hours not compacted, such as the
+ones exported before this was deployed.
+
+Environment Variables:
+- BUCKET_NAME: The name of the S3 bucket the table is exported to
+- GLUE_DATABASE_NAME: The name of the Glue database
+- SOURCE_TABLE_NAME: The name of the Glue table of the exported JSON
+- WORKGROUP: The name of the Athena workgroup
+"""
+
+import os
+import re
+import time
+
+import boto3
+
+BUCKET_NAME = os.environ["BUCKET_NAME"]
+GLUE_DATABASE_NAME = os.environ["GLUE_DATABASE_NAME"]
+SOURCE_TABLE_NAME = os.environ["SOURCE_TABLE_NAME"]
+WORKGROUP = os.environ["WORKGROUP"]
+COMPACT_PREFIX = "compact"
+QUERY_POLL_INTERVAL_SECONDS = 2
+
+athena = boto3.client("athena")
+s3 = boto3.client("s3")
+
+# The export is written under `<YYYY>/<MM>/<DD>/<HH>/AWSDynamoDB/<export id>/`
+MANIFEST_KEY_PATTERN = re.compile(
+    r"^(\d{4}/\d{2}/\d{2}/\d{2})/AWSDynamoDB/.+/manifest-summary\.json$"
+)
+
+
+def delete_compacted_files(datehour: str):
+    """
+    Delete the files of a previous compaction of the hour, so that it can be run again.
+
+    Args:
+        datehour: The hour in `YYYY/MM/DD/HH` format
+    """
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(
+        Bucket=BUCKET_NAME, Prefix=f"{COMPACT_PREFIX}/{datehour}/"
+    ):
+        objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+        if objects:
+            s3.delete_objects(
+                Bucket=BUCKET_NAME, Delete={"Objects": objects, "Quiet": True}
+            )
+
+
+def run_query(query: str):
+    """
+    Run an Athena query and wait until it is completed.
+
+    Args:
+        query: The query to run
+    """
+    execution_id = athena.start_query_execution(
+        QueryString=query,
+        QueryExecutionContext={"Database": GLUE_DATABASE_NAME},
+        WorkGroup=WORKGROUP,
+    )["QueryExecutionId"]
+
+    while True:
+        status = athena.get_query_execution(QueryExecutionId=execution_id)[
+            "QueryExecution"
+        ]["Status"]
+        if status["State"] == "SUCCEEDED":
+            return
+        elif status["State"] in ("FAILED", "CANCELLED"):
+            raise Exception(
+                f"Query {execution_id} {status['State']}: "
+                f"{status.get('StateChangeReason')}"
+            )
+        time.sleep(QUERY_POLL_INTERVAL_SECONDS)
+
+
+def compact(datehour: str):
+    """
+    Compact the export of the hour by CTAS into a temporary table.
+    The temporary table is dropped afterwards, the files are read by the compacted table.
+
+    Args:
+        datehour: The hour in `YYYY/MM/DD/HH` format
+    """
+    delete_compacted_files(datehour)
+
+    temporary_table = f"compaction_{datehour.replace('/', '')}_{int(time.time())}"
+    run_query(
+        f"""
+CREATE TABLE {temporary_table}
+WITH (
+    format = 'PARQUET',
+    write_compression = 'SNAPPY',
+    external_location = 's3://{BUCKET_NAME}/{COMPACT_PREFIX}/{datehour}/'
+) AS
+SELECT
+    Keys.PK.S AS pk,
+    Keys.SK.S AS sk,
+    MAX_BY(NewImage.BotId.S, CAST(Metadata.WriteTimestampMicros.N AS BIGINT)) AS bot_id,
+    CAST(MAX_BY(NewImage.TotalPrice.N, CAST(Metadata.WriteTimestampMicros.N AS BIGINT)) AS DECIMAL(20,10)) AS total_price,
+    MAX_BY(NewImage.CreateTime.N, CAST(Metadata.WriteTimestampMicros.N AS BIGINT)) AS create_time,
+    MAX(CAST(Metadata.WriteTimestampMicros.N AS BIGINT)) AS write_timestamp_micros
+FROM
+    {SOURCE_TABLE_NAME}
+WHERE
+    datehour = '{datehour}'
+    AND Keys.SK.S LIKE '%#CONV#%'
+    AND NewImage IS NOT NULL
+GROUP BY
+    Keys.PK.S,
+    Keys.SK.S
+"""
+    )
+    run_query(f"DROP TABLE {temporary_table}")
+
+
+def handler(event, context):
+    """
+    Lambda handler to compact an hourly export.
+
+    Triggered by the `manifest-summary.json` written at the end of an export.
+    Can also be invoked with `{"datehour": "YYYY/MM/DD/HH"}` to compact an hour manually.
+
+    Args:
+        event: The S3 event, or the hour to compact
+        context: The Lambda execution context
+    """
+    print(event)
+
+    if "datehour" in event:
+        datehours = [event["datehour"]]
+    else:
+        datehours = []
+        for record in event["Records"]:
+            match = MANIFEST_KEY_PATTERN.match(record["s3"]["object"]["key"])
+            if match:
+                datehours.append(match.group(1))
+
+    for datehour in datehours:
+        print(f"Compacting: {datehour}")
+        compact(datehour)
@@ -0,0 +1,160 @@
+"""Microbenchmarks for the per-turn serialization and message tree hot paths.
+
+These are not collected by the regular test run. Run them explicitly with
+pytest-benchmark, storing the results as JSON so they can be compared across commits:
+
+    poetry run pytest tests/benchmarks/bench_conversation.py --benchmark-autosave
+    poetry run pytest tests/benchmarks/bench_conversation.py --benchmark-compare
+
+Use `-k` to narrow the matrix, e.g. `-k "100-text"`.
+"""
+
+import json
+import sys
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+sys.path.insert(0, ".")
+
+pytest.importorskip("pytest_benchmark")
+
+from app import codec
+from app.bedrock import compose_args_for_converse_api
+from app.prompt import build_rag_prompt
+from app.repositories.conversation import find_conversation_by_id, store_conversation
+from app.repositories.models.conversation import MessageModel
+from app.usecases.chat import fetch_conversation, trace_to_root
+from tests.benchmarks.utils.conversation_factory import (
+    MODEL,
+    create_test_conversation,
+    create_test_search_results,
+)
+
+MESSAGE_COUNTS = [10, 100, 1000]
+CODEC_FORMATS = ["stdlib_json", "json", "msgpack", "json+gzip", "msgpack+gzip"]
+VARIANTS = {
+    "text": dict(with_images=False, with_thinking_log=False),
+    "images": dict(with_images=True, with_thinking_log=False),
+    "thinking_log": dict(with_images=False, with_thinking_log=True),
+    "images_thinking_log": dict(with_images=True, with_thinking_log=True),
+}
+
+
+@pytest.fixture(
+    scope="module",
+    params=[
+        (count, variant) for count in MESSAGE_COUNTS for variant in VARIANTS.keys()
+    ],
+    ids=lambda param: f"{param[0]}-{param[1]}",
+)
+def conversation(request):
+    count, variant = request.param
+    return create_test_conversation(count, **VARIANTS[variant])
+
+
+@pytest.fixture(scope="module")
+def stored_item(conversation):
+    """DynamoDB item as written by `store_conversation`."""
+    table = MagicMock()
+    with patch(
+        "app.repositories.conversation._get_table_client", return_value=table
+    ), patch("app.repositories.conversation.s3_client"):
+        store_conversation("user", conversation, threshold=float("inf"))
+
+    return table.put_item.call_args.kwargs["Item"]
+
+
+def test_trace_to_root(benchmark, conversation):
+    benchmark(
+        trace_to_root,
+        node_id=conversation.last_message_id,
+        message_map=conversation.message_map,
+    )
+
+
+def test_message_model_validate(benchmark, stored_item):
+    message_map = json.loads(stored_item["MessageMap"])
+
+    benchmark(
+        lambda: {k: MessageModel.model_validate(v) for k, v in message_map.items()}
+    )
+
+
+def test_store_conversation(benchmark, conversation):
+    table = MagicMock()
+    s3_client = MagicMock()
+    s3_client.put_object.return_value = {"ETag": '"benchmark"'}
+    with patch(
+        "app.repositories.conversation._get_table_client", return_value=table
+    ), patch("app.repositories.conversation.s3_client", s3_client):
+        benchmark(store_conversation, "user", conversation)
+
+
+def test_find_conversation_by_id(benchmark, conversation, stored_item):
+    table = MagicMock()
+    table.get_item.return_value = {"Item": stored_item}
+    with patch("app.repositories.conversation._get_table_client", return_value=table):
+        benchmark(find_conversation_by_id, "user", conversation.id)
+
+
+def _encode(message_map: dict, format: str) -> bytes:
+    if format == "stdlib_json":
+        return json.dumps(message_map).encode("utf-8")
+
+    format, _, compression = format.partition("+")
+    return codec.encode(
+        message_map,
+        format=format,  # type: ignore[arg-type]
+        compression=compression or "none",  # type: ignore[arg-type]
+    )
+
+
+def _decode(data: bytes, format: str):
+    if format == "stdlib_json":
+        return json.loads(data.decode("utf-8"))
+
+    return codec.decode(data)
+
+
+@pytest.mark.parametrize("format", CODEC_FORMATS)
+def test_encode_message_map(benchmark, conversation, format):
+    message_map = conversation.dump_message_map()
+
+    encoded = benchmark(_encode, message_map, format)
+    benchmark.extra_info["size"] = len(encoded)
+
+
+@pytest.mark.parametrize("format", CODEC_FORMATS)
+def test_decode_message_map(benchmark, conversation, format):
+    encoded = _encode(conversation.dump_message_map(), format)
+
+    benchmark.extra_info["size"] = len(encoded)
+    benchmark(_decode, encoded, format)
+
+
+def test_compose_args_for_converse_api(benchmark, conversation):
+    messages = trace_to_root(
+        node_id=conversation.last_message_id,
+        message_map=conversation.message_map,
+    )
+
+    benchmark(compose_args_for_converse_api, messages=messages, model=MODEL)
+
+
+def test_fetch_conversation(benchmark, conversation):
+    with patch("app.usecases.chat.find_conversation_by_id", return_value=conversation):
+        benchmark(fetch_conversation, "user", conversation.id)
+
+
+@pytest.mark.parametrize("count", MESSAGE_COUNTS)
+@pytest.mark.parametrize("display_citation", [True, False])
+def test_build_rag_prompt(benchmark, count, display_citation):
+    search_results = create_test_search_results(count)
+
+    benchmark(
+        build_rag_prompt,
+        search_results=search_results,
+        model=MODEL,
+        display_citation=display_citation,
+    )
@@ -0,0 +1,174 @@
+import os
+import sys
+
+sys.path.append(".")
+
+from app.repositories.models.conversation import (
+    ConversationModel,
+    ImageContentModel,
+    JsonToolResultModel,
+    MessageModel,
+    SimpleMessageModel,
+    TextContentModel,
+    ToolResultContentModel,
+    ToolResultContentModelBody,
+    ToolUseContentModel,
+    ToolUseContentModelBody,
+)
+from app.routes.schemas.conversation import type_model_name
+from app.vector_search import SearchResult
+
+MODEL: type_model_name = "claude-v3-haiku"
+
+# Roughly the size of a small screenshot after client-side resizing.
+IMAGE_SIZE = 32 * 1024
+# Roughly the size of a knowledge base chunk returned by a tool.
+CHUNK_TEXT = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 16
+
+
+def _create_thinking_log(index: int) -> list[SimpleMessageModel]:
+    tool_use_id = f"tool_use_{index}"
+    return [
+        SimpleMessageModel(
+            role="assistant",
+            content=[
+                ToolUseContentModel(
+                    content_type="toolUse",
+                    body=ToolUseContentModelBody(
+                        tool_use_id=tool_use_id,
+                        name="knowledge_base_tool",
+                        input={"query": f"query {index}"},
+                    ),
+                ),
+            ],
+        ),
+        SimpleMessageModel(
+            role="user",
+            content=[
+                ToolResultContentModel(
+                    content_type="toolResult",
+                    body=ToolResultContentModelBody(
+                        tool_use_id=tool_use_id,
+                        content=[
+                            JsonToolResultModel(
+                                json={
+                                    "source_id": f"{tool_use_id}@{rank}",
+                                    "content": CHUNK_TEXT,
+                                },
+                            )
+                            for rank in range(3)
+                        ],
+                        status="success",
+                    ),
+                ),
+            ],
+        ),
+    ]
+
+
+def create_test_conversation(
+    message_count: int,
+    with_images: bool = False,
+    with_thinking_log: bool = False,
+    bot_id: str | None = None,
+) -> ConversationModel:
+    """Create a conversation with `message_count` messages below the root.
+    The messages form a single user/assistant chain, which is the shape the chat
+    path walks with `trace_to_root`. Every tenth message, an assistant one, gets an
+    additional regenerated sibling so that the tree also has inactive branches.
+    """
+    image = os.urandom(IMAGE_SIZE) if with_images else b""
+
+    message_map: dict[str, MessageModel] = {
+        "system": MessageModel(
+            role="system",
+            content=[TextContentModel(content_type="text", body="")],
+            model=MODEL,
+            children=[],
+            parent=None,
+            create_time=0,
+        ),
+    }
+    if bot_id is not None:
+        message_map["instruction"] = MessageModel(
+            role="instruction",
+            content=[TextContentModel(content_type="text", body="You are a bot.")],
+            model=MODEL,
+            children=[],
+            parent="system",
+            create_time=0,
+        )
+        message_map["system"].children.append("instruction")
+
+    parent_id = "instruction" if bot_id is not None else "system"
+    index = 0
+    while index < message_count:
+        is_user = index % 2 == 0
+        message_id = f"message_{index}"
+        if is_user:
+            content = [
+                TextContentModel(content_type="text", body=f"Question {index}"),
+            ]
+            if with_images:
+                content.append(
+                    ImageContentModel(
+                        content_type="image",
+                        media_type="image/png",
+                        body=image,
+                    )
+                )
+        else:
+            content = [
+                TextContentModel(content_type="text", body=f"Answer {index} " * 50),
+            ]
+
+        message_map[message_id] = MessageModel(
+            role="user" if is_user else "assistant",
+            content=content,  # type: ignore[arg-type]
+            model=MODEL,
+            children=[],
+            parent=parent_id,
+            create_time=float(index),
+            thinking_log=(
+                _create_thinking_log(index)
+                if with_thinking_log and not is_user
+                else None
+            ),
+        )
+        message_map[parent_id].children.append(message_id)
+
+        if not is_user and index % 10 == 9:
+            # Regenerated answer on an inactive branch, not counted in `message_count`
+            # not to break the user/assistant alternation of the chain
+            sibling_id = f"{message_id}_regenerated"
+            message_map[sibling_id] = message_map[message_id].model_copy(
+                update={"children": []}
+            )
+            message_map[parent_id].children.append(sibling_id)
+
+        parent_id = message_id
+        index += 1
+
+    return ConversationModel(
+        id="benchmark",
+        create_time=0,
+        title="Benchmark conversation",
+        total_price=0,
+        message_map=message_map,
+        last_message_id=parent_id,
+        bot_id=bot_id,
+        should_continue=False,
+    )
+
+
+def create_test_search_results(count: int) -> list[SearchResult]:
+    return [
+        {
+            "bot_id": "benchmark",
+            "content": CHUNK_TEXT,
+            "source_name": f"document_{rank}.pdf",
+            "source_link": f"s3://bucket/document_{rank}.pdf",
+            "rank": rank,
+        }
+        for rank in range(count)
+    ]
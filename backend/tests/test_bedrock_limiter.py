@@ -0,0 +1,101 @@
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.append(".")
+
+from app import bedrock_limiter
+from app.bedrock_limiter import (
+    AdaptiveConcurrencyLimiter,
+    BedrockQueueTimeoutError,
+    get_concurrency_limiter,
+    invoke_with_concurrency_limit,
+    is_throttling_error,
+)
+from botocore.exceptions import ClientError
+
+
+def _client_error(code: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, "ConverseStream")
+
+
+class TestAdaptiveConcurrencyLimiter(unittest.TestCase):
+    def test_increase_and_decrease(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=4, max_limit=8)
+
+        for _ in range(5):
+            limiter.acquire()
+            limiter.release()
+        # About one more per window of successful invocations
+        self.assertEqual(limiter.metrics()["limit"], 5)
+
+        limiter.acquire()
+        limiter.release(throttled=True)
+        self.assertEqual(limiter.metrics()["limit"], 2)
+        # Throttles of the same burst decrease the limit only once
+        limiter.acquire()
+        limiter.release(throttled=True)
+        self.assertEqual(limiter.metrics()["limit"], 2)
+        self.assertEqual(limiter.metrics()["throttles"], 2)
+
+    def test_queue_timeout(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1)
+        limiter.acquire()
+
+        with self.assertRaises(BedrockQueueTimeoutError):
+            limiter.acquire(timeout=0.01)
+
+        metrics = limiter.metrics()
+        self.assertEqual(metrics["queued"], 1)
+        self.assertEqual(metrics["queue_timeouts"], 1)
+
+
+class TestInvokeWithConcurrencyLimit(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(bedrock_limiter._limiters.clear)
+
+        patcher = patch("app.bedrock_limiter.time.sleep")
+        self.mock_sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retry_throttling(self):
+        invoke = MagicMock(side_effect=[_client_error("ThrottlingException"), "done"])
+
+        result = invoke_with_concurrency_limit("model", invoke)
+
+        self.assertEqual(result, "done")
+        self.assertEqual(invoke.call_count, 2)
+        metrics = get_concurrency_limiter("model").metrics()
+        self.assertEqual(metrics["retries"], 1)
+        self.assertEqual(metrics["throttles"], 1)
+        self.assertEqual(metrics["in_flight"], 0)
+
+    def test_not_retry_after_streamed(self):
+        invoke = MagicMock(
+            side_effect=ExceptionGroup(
+                "Exceptions in ConverseStream",
+                [
+                    _client_error("ThrottlingException"),
+                    _client_error("ThrottlingException"),
+                ],
+            )
+        )
+
+        with self.assertRaises(ExceptionGroup):
+            invoke_with_concurrency_limit("model", invoke, can_retry=lambda: False)
+
+        invoke.assert_called_once()
+        self.mock_sleep.assert_not_called()
+
+    def test_not_retry_validation_error(self):
+        invoke = MagicMock(side_effect=_client_error("ValidationException"))
+
+        with self.assertRaises(ClientError):
+            invoke_with_concurrency_limit("model", invoke)
+
+        invoke.assert_called_once()
+        self.assertFalse(is_throttling_error(invoke.side_effect))
+
+
+if __name__ == "__main__":
+    unittest.main()
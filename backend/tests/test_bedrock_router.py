@@ -0,0 +1,117 @@
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.append(".")
+
+from app import bedrock_limiter, bedrock_router
+from app.bedrock_router import invoke_with_routing, rank_regions, record_invocation
+from botocore.exceptions import ClientError
+
+REGIONS = ["us-east-1", "us-west-2"]
+
+
+def _client_error(code: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, "ConverseStream")
+
+
+class TestRankRegions(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(bedrock_router._health.clear)
+
+    def test_prefer_configured_order(self):
+        self.assertEqual(rank_regions("model", REGIONS), REGIONS)
+
+    def test_avoid_throttled_region(self):
+        record_invocation(
+            "us-east-1", "model", error=_client_error("ThrottlingException")
+        )
+
+        self.assertEqual(rank_regions("model", REGIONS), ["us-west-2", "us-east-1"])
+        # Health is tracked per model
+        self.assertEqual(rank_regions("other", REGIONS), REGIONS)
+
+    def test_prefer_faster_region(self):
+        record_invocation("us-east-1", "model", time_to_first_token=3.0)
+        record_invocation("us-west-2", "model", time_to_first_token=0.5)
+
+        self.assertEqual(rank_regions("model", REGIONS), ["us-west-2", "us-east-1"])
+
+
+class TestInvokeWithRouting(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(bedrock_router._health.clear)
+        self.addCleanup(bedrock_limiter._limiters.clear)
+
+        patcher = patch("app.bedrock_limiter.time.sleep")
+        self.mock_sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fail_over(self):
+        invoke = MagicMock(side_effect=[_client_error("ThrottlingException"), "done"])
+
+        result = invoke_with_routing(
+            "model", lambda region: f"{region}.model", invoke, regions=REGIONS
+        )
+
+        self.assertEqual(result, "done")
+        self.assertEqual(
+            [call.args[0].model_id for call in invoke.call_args_list],
+            ["us-east-1.model", "us-west-2.model"],
+        )
+        # Failed over without backoff
+        self.mock_sleep.assert_not_called()
+        self.assertEqual(rank_regions("model", REGIONS), ["us-west-2", "us-east-1"])
+
+    def test_not_fail_over_after_streamed(self):
+        invoke = MagicMock(side_effect=_client_error("ThrottlingException"))
+
+        with self.assertRaises(ClientError):
+            invoke_with_routing(
+                "model",
+                lambda region: "model",
+                invoke,
+                can_retry=lambda: False,
+                regions=REGIONS,
+            )
+
+        invoke.assert_called_once()
+
+    def test_not_fail_over_after_partial_stream(self):
+        streamed = False
+
+        def invoke(route):
+            nonlocal streamed
+            # Throttled after a part of the response has been streamed
+            streamed = True
+            raise _client_error("ThrottlingException")
+
+        mock_invoke = MagicMock(side_effect=invoke)
+
+        with self.assertRaises(ClientError):
+            invoke_with_routing(
+                "model",
+                lambda region: f"{region}.model",
+                mock_invoke,
+                can_retry=lambda: not streamed,
+                regions=REGIONS,
+            )
+
+        # Neither failed over nor retried
+        mock_invoke.assert_called_once()
+        self.mock_sleep.assert_not_called()
+
+    def test_not_penalize_invalid_request(self):
+        invoke = MagicMock(side_effect=_client_error("ValidationException"))
+
+        with self.assertRaises(ClientError):
+            invoke_with_routing(
+                "model", lambda region: "model", invoke, regions=REGIONS
+            )
+
+        invoke.assert_called_once()
+        self.assertEqual(bedrock_router._health, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.append(".")
+
+from app.bot_remove import handler
+
+
+def _record(sequence_number: str, sk: str):
+    return {
+        "dynamodb": {
+            "Keys": {"PK": {"S": "user"}, "SK": {"S": sk}},
+            "SequenceNumber": sequence_number,
+        }
+    }
+
+
+class TestBotRemove(unittest.TestCase):
+    @patch("app.bot_remove.delete_published_api")
+    @patch("app.bot_remove.delete_custom_bot_stack_by_bot_id")
+    @patch("app.bot_remove.delete_from_s3")
+    def test_report_failed_records(
+        self, mock_delete_from_s3, mock_delete_stack, mock_delete_published_api
+    ):
+        def mock_delete_stack_side_effect(bot_id):
+            if bot_id == "2":
+                raise Exception("Failed")
+
+        mock_delete_stack.side_effect = mock_delete_stack_side_effect
+
+        response = handler(
+            {
+                "Records": [
+                    _record("1", "user#BOT#1"),
+                    _record("2", "user#BOT#2"),
+                    _record("3", "user#CONV#1"),
+                ]
+            },
+            None,
+        )
+
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "2"}]})
+        # Every bot is removed, but not the other items
+        self.assertEqual(
+            [call.args for call in mock_delete_from_s3.call_args_list],
+            [("user", "1"), ("user", "2")],
+        )
+        # The other deletions of the failed bot are still done
+        mock_delete_published_api.assert_any_call("2")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import json
+import sys
+import unittest
+
+sys.path.append(".")
+
+from app import codec
+
+MESSAGE_MAP = {
+    "system": {
+        "role": "system",
+        "content": [{"content_type": "text", "body": "こんにちは"}],
+        "model": "claude-v3-haiku",
+        "children": ["a"],
+        "parent": None,
+        "create_time": 1627984879.9,
+        "feedback": None,
+    },
+}
+
+
+class TestCodec(unittest.TestCase):
+    def test_json_is_untagged(self):
+        encoded = codec.encode(MESSAGE_MAP, "json")
+
+        # Readable by the stdlib and older versions
+        self.assertEqual(json.loads(encoded), MESSAGE_MAP)
+        self.assertEqual(codec.decode(encoded), MESSAGE_MAP)
+        self.assertEqual(codec.decode(encoded.decode("utf-8")), MESSAGE_MAP)
+
+    def test_msgpack_roundtrip(self):
+        encoded = codec.encode(MESSAGE_MAP, "msgpack")
+
+        self.assertTrue(encoded.startswith(codec.TAG_MARKER))
+        self.assertEqual(codec.decode(encoded), MESSAGE_MAP)
+
+    def test_gzip_roundtrip(self):
+        for format in ["json", "msgpack"]:
+            with self.subTest(format=format):
+                encoded = codec.encode(MESSAGE_MAP, format, compression="gzip")
+
+                self.assertTrue(codec.is_tagged(encoded))
+                self.assertEqual(codec.decode(encoded), MESSAGE_MAP)
+                # Deterministic output
+                self.assertEqual(
+                    encoded, codec.encode(MESSAGE_MAP, format, compression="gzip")
+                )
+
+    def test_decode_legacy_json(self):
+        self.assertEqual(codec.decode(json.dumps(MESSAGE_MAP)), MESSAGE_MAP)
+        self.assertEqual(
+            codec.decode(json.dumps(MESSAGE_MAP).encode("utf-8")), MESSAGE_MAP
+        )
+
+    def test_decode_unknown_tag(self):
+        with self.assertRaises(ValueError):
+            codec.decode(codec.TAG_MARKER + b"?")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.append(".")
+
+from app import logging_utils
+from app.logging_utils import (
+    LogBudgetFilter,
+    RequestLoggingMiddleware,
+    start_log_budget,
+    summarize,
+)
+from app.repositories.models.conversation import ImageContentModel
+
+
+class TestSummarize(unittest.TestCase):
+    def test_truncate_long_string(self):
+        summary = str(summarize({"text": "a" * 1000}, max_length=10))
+
+        self.assertEqual(summary, "{'text': 'aaaaaaaaaa...(1000 chars)'}")
+
+    def test_redact_binary_and_secrets(self):
+        summary = str(
+            summarize(
+                {
+                    "image": {"source": {"bytes": b"\x00" * 2048}},
+                    "Authorization": "Bearer token",
+                }
+            )
+        )
+
+        self.assertIn("<2048 bytes>", summary)
+        self.assertNotIn("token", summary)
+
+    def test_cut_long_collection(self):
+        summary = str(summarize(list(range(100))))
+
+        self.assertIn("...(100 items)", summary)
+
+    def test_model(self):
+        content = ImageContentModel(
+            content_type="image", media_type="image/png", body=b"\x00" * 4096
+        )
+
+        summary = str(summarize(content))
+
+        self.assertIn("ImageContentModel", summary)
+        self.assertIn("<4096 bytes>", summary)
+
+    def test_lazy(self):
+        logger = logging.getLogger("test_lazy")
+        logger.setLevel(logging.WARNING)
+
+        with patch.object(logging_utils, "_summarize") as mock_summarize:
+            logger.info("Payload: %s", summarize({"text": "text"}))
+
+        mock_summarize.assert_not_called()
+
+
+class TestLogBudgetFilter(unittest.TestCase):
+    def setUp(self):
+        token = logging_utils._request_budget.set(None)
+        self.addCleanup(logging_utils._request_budget.reset, token)
+
+    def _record(self, msg: str, *args, level=logging.INFO):
+        return logging.LogRecord("test", level, __file__, 0, msg, args, None)
+
+    def test_drop_over_budget(self):
+        log_filter = LogBudgetFilter()
+        start_log_budget(budget_bytes=15)
+
+        self.assertTrue(log_filter.filter(self._record("0123456789")))
+        # The first record over the budget is replaced with a notice
+        record = self._record("0123456789")
+        self.assertTrue(log_filter.filter(record))
+        self.assertIn("exceeded", record.getMessage())
+        self.assertFalse(log_filter.filter(self._record("0123456789")))
+        # Warnings are always logged
+        self.assertTrue(
+            log_filter.filter(self._record("0123456789", level=logging.WARNING))
+        )
+
+    def test_sample_payloads(self):
+        log_filter = LogBudgetFilter()
+
+        with patch.object(logging_utils, "LOG_PAYLOAD_SAMPLE_RATE", 0.0):
+            self.assertFalse(
+                log_filter.filter(self._record("Payload: %s", summarize({})))
+            )
+            self.assertTrue(log_filter.filter(self._record("No payload")))
+
+
+class TestRequestLoggingMiddleware(unittest.IsolatedAsyncioTestCase):
+    async def test_pass_through_body(self):
+        received = []
+
+        async def app(scope, receive, send):
+            while True:
+                message = await receive()
+                received.append(message["body"])
+                if not message["more_body"]:
+                    break
+            await send({"type": "http.response.start", "status": 200})
+            await send({"type": "http.response.body", "body": b""})
+
+        chunks = [b"a" * 80, b"b" * 80, b"c" * 80]
+        messages = [
+            {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+            for i, chunk in enumerate(chunks)
+        ]
+
+        async def receive():
+            return messages.pop(0)
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            "type": "http",
+            "path": "/conversation",
+            "method": "POST",
+            "headers": [(b"authorization", b"Bearer token")],
+        }
+        with self.assertLogs("app.logging_utils", level=logging.INFO) as logs:
+            await RequestLoggingMiddleware(app)(scope, receive, send)
+
+        self.assertEqual(received, chunks)
+        self.assertEqual(len(sent), 2)
+        output = "\n".join(logs.output)
+        self.assertIn("a" * 80 + "b" * 20 + "...", output)
+        self.assertNotIn("b" * 21, output)
+        self.assertIn("status 200, body 240 bytes", output)
+        self.assertNotIn("token", output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,22 +2,42 @@ import base64
 import json
 import os
 import sys
+import tempfile
 import unittest
 from unittest.mock import MagicMock, patch
 
+import boto3
+from boto3.dynamodb.types import Binary
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
 sys.path.append(".")
 
 
+from app.repositories.common import (
+    BATCH_GET_MAX_ATTEMPTS,
+    PUBLISHED_API_PARTITION_SHARDS,
+    compose_partition_key,
+    compose_published_api_user_id,
+    find_partition_keys,
+)
 from app.repositories.conversation import (
     ConversationModel,
+    DeletionProgress,
     MessageModel,
     RecordNotFoundError,
+    _get_large_message,
+    _hash_content,
     change_conversation_title,
     delete_conversation_by_id,
     delete_conversation_by_user_id,
     find_conversation_by_id,
     find_conversation_by_user_id,
+    find_related_document_by_id,
+    find_related_document_source_links,
+    find_related_documents_by_conversation_id,
     store_conversation,
+    store_related_documents,
     update_feedback,
 )
 from app.repositories.custom_bot import (
@@ -25,12 +45,16 @@ from app.repositories.custom_bot import (
     find_private_bots_by_user_id,
     store_bot,
 )
+from app.repositories.large_message_cache import CachedBlob, LargeMessageCache
 from app.repositories.models.conversation import (
     ChunkModel,
     FeedbackModel,
     ImageContentModel,
+    LazyMessageMap,
+    RelatedDocumentModel,
     SimpleMessageModel,
     TextContentModel,
+    TextToolResultModel,
     ToolUseContentModel,
     ToolUseContentModelBody,
 )
@@ -130,8 +154,11 @@ class TestConversationRepository(unittest.TestCase):
     def setUp(self):
         self.patcher1 = patch("boto3.resource")
         self.patcher2 = patch("app.repositories.conversation.s3_client")
+        self.patcher3 = patch("app.repositories.conversation.large_message_cache")
         self.mock_boto3_resource = self.patcher1.start()
         self.mock_s3_client = self.patcher2.start()
+        self.mock_large_message_cache = self.patcher3.start()
+        self.mock_large_message_cache.get.return_value = None
 
         self.mock_table = MagicMock()
         self.mock_boto3_resource.return_value.Table.return_value = self.mock_table
@@ -149,6 +176,7 @@ class TestConversationRepository(unittest.TestCase):
     def tearDown(self):
         self.patcher1.stop()
         self.patcher2.stop()
+        self.patcher3.stop()
         os.environ.pop("CONVERSATION_TABLE_NAME", None)
         os.environ.pop("CONVERSATION_BUCKET_NAME", None)
         os.environ.pop("LARGE_MESSAGE_BUCKET", None)
@@ -275,6 +303,12 @@ class TestConversationRepository(unittest.TestCase):
 
         self.mock_table.query.side_effect = mock_query_side_effect
 
+        def mock_get_item_side_effect(**kwargs):
+            items = mock_query_side_effect(IndexName="SKIndex")["Items"]
+            return {"Item": items[0]} if items else {}
+
+        self.mock_table.get_item.side_effect = mock_get_item_side_effect
+
         # Test storing conversation
         response = store_conversation("user", conversation)
         self.assertIsNotNone(response)
@@ -414,7 +448,8 @@ class TestConversationRepository(unittest.TestCase):
             "ResponseMetadata": {"HTTPStatusCode": 200}
         }
         self.mock_s3_client.put_object.return_value = {
-            "ResponseMetadata": {"HTTPStatusCode": 200}
+            "ETag": '"etag"',
+            "ResponseMetadata": {"HTTPStatusCode": 200},
         }
 
         def mock_query_side_effect(**kwargs):
@@ -462,6 +497,12 @@ class TestConversationRepository(unittest.TestCase):
 
         self.mock_table.query.side_effect = mock_query_side_effect
 
+        def mock_get_item_side_effect(**kwargs):
+            items = mock_query_side_effect(IndexName="SKIndex")["Items"]
+            return {"Item": items[0]} if items else {}
+
+        self.mock_table.get_item.side_effect = mock_get_item_side_effect
+
         message_map_json = json.dumps(
             {
                 k: {
@@ -479,7 +520,8 @@ class TestConversationRepository(unittest.TestCase):
             }
         )
         self.mock_s3_client.get_object.return_value = {
-            "Body": MagicMock(read=lambda: message_map_json.encode())
+            "ETag": '"etag"',
+            "Body": MagicMock(read=lambda: message_map_json.encode()),
         }
 
         # Test storing large conversation
@@ -522,6 +564,36 @@ class TestConversationRepository(unittest.TestCase):
         conversations = find_conversation_by_user_id(user_id="user")
         self.assertEqual(len(conversations), 0)
 
+    def test_store_large_conversation_ignores_cache_failure(self):
+        conversation = ConversationModel(
+            id="3",
+            create_time=1627984879.9,
+            title="Large Conversation",
+            total_price=0,
+            message_map={
+                "system": MessageModel(
+                    role="system",
+                    content=[TextContentModel(content_type="text", body="")],
+                    model="claude-instant-v1",
+                    children=[],
+                    parent=None,
+                    create_time=1627984879.9,
+                    feedback=None,
+                    used_chunks=None,
+                    thinking_log=None,
+                )
+            },
+            last_message_id="system",
+            bot_id=None,
+            should_continue=False,
+        )
+        self.mock_s3_client.put_object.return_value = {"ETag": '"etag"'}
+        self.mock_large_message_cache.put.side_effect = TypeError("Failed")
+
+        store_conversation("user", conversation, threshold=0)
+
+        self.mock_table.put_item.assert_called_once()
+
 
 class TestConversationBotRepository(unittest.TestCase):
     def setUp(self):
@@ -774,5 +846,753 @@ def tearDown(self) -> None:
     delete_bot_by_id("user", "2")
 
 
+class TestCompressedMessageMap(unittest.TestCase):
+    def setUp(self):
+        self.conversation = ConversationModel(
+            id="1",
+            create_time=1627984879.9,
+            title="Test Conversation",
+            total_price=0,
+            message_map={
+                "system": MessageModel(
+                    role="system",
+                    content=[TextContentModel(content_type="text", body="")],
+                    model="claude-v3-haiku",
+                    children=["a"],
+                    parent=None,
+                    create_time=0,
+                ),
+                "a": MessageModel(
+                    role="user",
+                    content=[
+                        TextContentModel(content_type="text", body="Hello " * 1000)
+                    ],
+                    model="claude-v3-haiku",
+                    children=[],
+                    parent="system",
+                    create_time=1,
+                ),
+            },
+            last_message_id="a",
+            bot_id=None,
+            should_continue=False,
+        )
+        self.table = MagicMock()
+        self.table_patcher = patch(
+            "app.repositories.conversation._get_table_client",
+            return_value=self.table,
+        )
+        self.table_patcher.start()
+
+    def tearDown(self):
+        self.table_patcher.stop()
+
+    def _find_stored(self):
+        item = dict(self.table.put_item.call_args.kwargs["Item"])
+        if isinstance(item["MessageMap"], bytes):
+            # boto3 returns binary attributes as `Binary`
+            item["MessageMap"] = Binary(item["MessageMap"])
+        self.table.get_item.return_value = {"Item": item}
+        return item, find_conversation_by_id("user", "1")
+
+    @patch("app.codec.CONVERSATION_COMPRESSION", "gzip")
+    def test_store_compressed(self):
+        plain_size = len(json.dumps(self.conversation.dump_message_map()))
+        # Plain JSON would exceed the threshold but compressed one does not
+        store_conversation("user", self.conversation, threshold=plain_size // 2)
+
+        item, found = self._find_stored()
+        self.assertFalse(item["IsLargeMessage"])
+        self.assertIsInstance(item["MessageMap"], Binary)
+        self.assertLess(len(item["MessageMap"].value), plain_size // 2)
+        self.assertEqual(found.message_map["a"].content[0].body, "Hello " * 1000)  # type: ignore
+
+    def test_find_uncompressed(self):
+        store_conversation("user", self.conversation)
+
+        item, found = self._find_stored()
+        self.assertIsInstance(item["MessageMap"], str)
+        self.assertEqual(found.message_map["a"].content[0].body, "Hello " * 1000)  # type: ignore
+
+
+class TestPublishedApiPartition(unittest.TestCase):
+    def setUp(self):
+        self.user_id = compose_published_api_user_id("bot1")
+        self.table = MagicMock()
+        self.table_patcher = patch(
+            "app.repositories.conversation._get_table_client",
+            return_value=self.table,
+        )
+        self.table_patcher.start()
+
+    def tearDown(self):
+        self.table_patcher.stop()
+
+    def test_compose_partition_key(self):
+        self.assertEqual(compose_partition_key("user", "1"), "user")
+
+        partition_key = compose_partition_key(self.user_id, "1")
+        self.assertEqual(partition_key, compose_partition_key(self.user_id, "1"))
+        self.assertTrue(partition_key.startswith(f"{self.user_id}#"))
+        self.assertEqual(
+            len({compose_partition_key(self.user_id, str(i)) for i in range(1000)}),
+            PUBLISHED_API_PARTITION_SHARDS,
+        )
+
+    def test_find_partition_keys(self):
+        self.assertEqual(find_partition_keys("user"), ["user"])
+        self.assertEqual(
+            find_partition_keys(self.user_id, "1"),
+            [compose_partition_key(self.user_id, "1"), self.user_id],
+        )
+        self.assertEqual(
+            len(find_partition_keys(self.user_id)), PUBLISHED_API_PARTITION_SHARDS + 1
+        )
+
+    def test_store_to_shard(self):
+        conversation = ConversationModel(
+            id="1",
+            create_time=1627984879.9,
+            title="Test Conversation",
+            total_price=0,
+            message_map={},
+            last_message_id="",
+            bot_id="bot1",
+            should_continue=False,
+        )
+        store_conversation(self.user_id, conversation)
+
+        item = self.table.put_item.call_args.kwargs["Item"]
+        self.assertEqual(item["PK"], compose_partition_key(self.user_id, "1"))
+        self.assertEqual(item["SK"], f"{self.user_id}#CONV#1")
+
+    def test_migrate_legacy_conversation(self):
+        legacy_item = {
+            "PK": self.user_id,
+            "SK": f"{self.user_id}#CONV#1",
+            "Title": "Test Conversation",
+            "CreateTime": 1627984879.9,
+            "TotalPrice": 0,
+            "LastMessageId": "",
+            "MessageMap": "{}",
+            "IsLargeMessage": False,
+        }
+        related_document = {
+            "PK": self.user_id,
+            "SK": f"{self.user_id}#RELATED_DOCUMENT#1#source",
+        }
+
+        def mock_get_item_side_effect(**kwargs):
+            if kwargs["Key"]["PK"] == self.user_id:
+                return {"Item": legacy_item}
+            return {}
+
+        self.table.get_item.side_effect = mock_get_item_side_effect
+        self.table.query.return_value = {"Items": [related_document]}
+        writer = self.table.batch_writer.return_value.__enter__.return_value
+
+        conversation = find_conversation_by_id(self.user_id, "1")
+
+        self.assertEqual(conversation.title, "Test Conversation")
+        partition_key = compose_partition_key(self.user_id, "1")
+        self.assertEqual(
+            self.table.put_item.call_args.kwargs["Item"],
+            {**legacy_item, "PK": partition_key},
+        )
+        writer.put_item.assert_called_once_with(
+            Item={**related_document, "PK": partition_key}
+        )
+        writer.delete_item.assert_any_call(
+            Key={"PK": self.user_id, "SK": related_document["SK"]}
+        )
+        writer.delete_item.assert_any_call(
+            Key={"PK": self.user_id, "SK": legacy_item["SK"]}
+        )
+
+    def test_migrate_legacy_conversation_concurrently(self):
+        legacy_item = {
+            "PK": self.user_id,
+            "SK": f"{self.user_id}#CONV#1",
+            "Title": "Test Conversation",
+            "CreateTime": 1627984879.9,
+            "TotalPrice": 0,
+            "LastMessageId": "",
+            "MessageMap": "{}",
+            "IsLargeMessage": False,
+        }
+        partition_key = compose_partition_key(self.user_id, "1")
+        # Migrated and updated by another request after the legacy item was read
+        migrated_item = {**legacy_item, "PK": partition_key, "Title": "Updated"}
+
+        def mock_get_item_side_effect(**kwargs):
+            if kwargs["Key"]["PK"] == self.user_id:
+                return {"Item": legacy_item}
+            if kwargs.get("ConsistentRead"):
+                return {"Item": migrated_item}
+            return {}
+
+        self.table.get_item.side_effect = mock_get_item_side_effect
+        self.table.put_item.side_effect = ClientError(
+            {"Error": {"Code": "ConditionalCheckFailedException"}}, "PutItem"
+        )
+        self.table.query.return_value = {"Items": []}
+
+        conversation = find_conversation_by_id(self.user_id, "1")
+
+        self.assertEqual(conversation.title, "Updated")
+
+    def test_find_conversation_in_shard(self):
+        item = {
+            "PK": compose_partition_key(self.user_id, "1"),
+            "SK": f"{self.user_id}#CONV#1",
+            "Title": "Test Conversation",
+            "CreateTime": 1627984879.9,
+            "TotalPrice": 0,
+            "LastMessageId": "",
+            "MessageMap": "{}",
+            "IsLargeMessage": False,
+        }
+        self.table.get_item.return_value = {"Item": item}
+
+        find_conversation_by_id(self.user_id, "1")
+
+        self.table.get_item.assert_called_once()
+        self.table.put_item.assert_not_called()
+
+
+class TestFindRelatedDocumentSourceLinks(unittest.TestCase):
+    def setUp(self):
+        self.dynamodb = MagicMock()
+        self.resource_patcher = patch(
+            "app.repositories.conversation._get_aws_resource",
+            return_value=self.dynamodb,
+        )
+        self.resource_patcher.start()
+
+    def tearDown(self):
+        self.resource_patcher.stop()
+
+    def test_find_source_links(self):
+        table_name = "table"
+        unprocessed = {table_name: {"Keys": [{"PK": "user", "SK": "b"}]}}
+        self.dynamodb.batch_get_item.side_effect = [
+            {
+                "Responses": {
+                    table_name: [
+                        {"SK": "user#RELATED_DOCUMENT#1#a", "SourceLink": "link_a"}
+                    ]
+                },
+                "UnprocessedKeys": unprocessed,
+            },
+            {
+                "Responses": {
+                    table_name: [
+                        {"SK": "user#RELATED_DOCUMENT#1#b", "SourceLink": "link_b"}
+                    ]
+                },
+            },
+        ]
+
+        with patch("app.repositories.common.TABLE_NAME", table_name), patch(
+            "app.repositories.common.time.sleep"
+        ) as mock_sleep:
+            source_links = find_related_document_source_links(
+                "user", "1", ["a", "b", "a", "c"]
+            )
+
+        self.assertEqual(source_links, {"a": "link_a", "b": "link_b"})
+        # Backed off before retrying the unprocessed keys
+        mock_sleep.assert_called_once()
+        request_items = self.dynamodb.batch_get_item.call_args_list[0].kwargs[
+            "RequestItems"
+        ]
+        self.assertEqual(
+            request_items[table_name]["Keys"],
+            [
+                {"PK": "user", "SK": "user#RELATED_DOCUMENT#1#a"},
+                {"PK": "user", "SK": "user#RELATED_DOCUMENT#1#b"},
+                {"PK": "user", "SK": "user#RELATED_DOCUMENT#1#c"},
+            ],
+        )
+        self.assertEqual(
+            request_items[table_name]["ProjectionExpression"], "SK, SourceLink"
+        )
+        # Unprocessed keys are retried
+        self.assertEqual(
+            self.dynamodb.batch_get_item.call_args_list[1].kwargs["RequestItems"],
+            unprocessed,
+        )
+
+    def test_give_up_unprocessed_keys(self):
+        table_name = "table"
+        self.dynamodb.batch_get_item.return_value = {
+            "Responses": {},
+            "UnprocessedKeys": {table_name: {"Keys": [{"PK": "user", "SK": "a"}]}},
+        }
+
+        with patch("app.repositories.common.TABLE_NAME", table_name), patch(
+            "app.repositories.common.time.sleep"
+        ), self.assertRaises(RuntimeError):
+            find_related_document_source_links("user", "1", ["a"])
+
+        self.assertEqual(
+            self.dynamodb.batch_get_item.call_count, BATCH_GET_MAX_ATTEMPTS
+        )
+
+
+class TestRelatedDocumentDeduplication(unittest.TestCase):
+    def setUp(self):
+        self.dynamodb = MagicMock()
+        self.table = self.dynamodb.Table.return_value
+        self.writer = self.table.batch_writer.return_value.__enter__.return_value
+        self.patchers = [
+            patch(
+                "app.repositories.conversation._get_aws_resource",
+                return_value=self.dynamodb,
+            ),
+            patch(
+                "app.repositories.conversation._get_table_client",
+                return_value=self.table,
+            ),
+            patch("app.repositories.conversation.TABLE_NAME", "table"),
+            patch("app.repositories.common.TABLE_NAME", "table"),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+        self.content = TextToolResultModel(text="chunk")
+        self.content_hash = _hash_content(self.content.model_dump(by_alias=True))
+        self.content_item = {
+            "PK": "user",
+            "SK": f"user#RELATED_DOCUMENT_CONTENT#1#{self.content_hash}",
+            "Content": {"text": "chunk"},
+        }
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def _reference_item(self, source_id: str):
+        return {
+            "PK": "user",
+            "SK": f"user#RELATED_DOCUMENT#1#{source_id}",
+            "SourceName": "name",
+            "SourceLink": "link",
+            "ContentHash": self.content_hash,
+        }
+
+    def test_store_content_once(self):
+        self.dynamodb.batch_get_item.return_value = {"Responses": {"table": []}}
+
+        store_related_documents(
+            "user",
+            "1",
+            [
+                RelatedDocumentModel(
+                    content=self.content,
+                    source_id=source_id,
+                    source_name="name",
+                    source_link="link",
+                )
+                for source_id in ["a", "b"]
+            ],
+        )
+
+        items = [call.kwargs["Item"] for call in self.writer.put_item.call_args_list]
+        self.assertEqual(
+            items,
+            [
+                self.content_item,
+                self._reference_item("a"),
+                self._reference_item("b"),
+            ],
+        )
+
+    def test_skip_stored_content(self):
+        self.dynamodb.batch_get_item.return_value = {
+            "Responses": {"table": [{"SK": self.content_item["SK"]}]}
+        }
+
+        store_related_documents(
+            "user",
+            "1",
+            [
+                RelatedDocumentModel(
+                    content=self.content,
+                    source_id="a",
+                    source_name="name",
+                    source_link="link",
+                )
+            ],
+        )
+
+        self.writer.put_item.assert_called_once_with(Item=self._reference_item("a"))
+
+    def test_find_related_documents(self):
+        legacy_item = {
+            "PK": "user",
+            "SK": "user#RELATED_DOCUMENT#1#legacy",
+            "SourceName": "name",
+            "SourceLink": "link",
+            "Content": {"text": "inline"},
+        }
+
+        def mock_query_side_effect(**kwargs):
+            # PK = ... AND begins_with(SK, <prefix>)
+            sk_condition = kwargs["KeyConditionExpression"].get_expression()["values"][
+                1
+            ]
+            if (
+                "#RELATED_DOCUMENT_CONTENT#"
+                in sk_condition.get_expression()["values"][1]
+            ):
+                return {"Items": [self.content_item]}
+            return {"Items": [self._reference_item("a"), legacy_item]}
+
+        self.table.query.side_effect = mock_query_side_effect
+
+        related_documents = find_related_documents_by_conversation_id("user", "1")
+
+        self.assertEqual(
+            [(doc.source_id, doc.content.text) for doc in related_documents],  # type: ignore
+            [("a", "chunk"), ("legacy", "inline")],
+        )
+
+    def test_find_related_document_by_id(self):
+        self.table.get_item.side_effect = [
+            {"Item": self._reference_item("a")},
+            {"Item": self.content_item},
+        ]
+
+        related_document = find_related_document_by_id("user", "1", "a")
+
+        self.assertEqual(related_document.content, self.content)
+        self.assertEqual(
+            self.table.get_item.call_args.kwargs["Key"],
+            {"PK": "user", "SK": self.content_item["SK"]},
+        )
+
+
+class TestBulkDeletion(unittest.TestCase):
+    def setUp(self):
+        self.table = MagicMock()
+        self.client = self.table.meta.client
+        self.patchers = [
+            patch(
+                "app.repositories.conversation._get_table_client",
+                return_value=self.table,
+            ),
+            patch("app.repositories.conversation.s3_client"),
+            patch("app.repositories.conversation.large_message_cache"),
+            patch("app.repositories.conversation.TABLE_NAME", "table"),
+            patch("app.repositories.conversation.time.sleep"),
+        ]
+        _, self.s3_client, _, _, _ = [patcher.start() for patcher in self.patchers]
+        self.s3_client.delete_objects.return_value = {}
+
+        conversations = [
+            {
+                "PK": "user",
+                "SK": f"user#CONV#{i}",
+                "IsLargeMessage": i == 0,
+                "LargeMessagePath": f"user/{i}/message_map.json",
+            }
+            for i in range(30)
+        ]
+        pages = {
+            "user#CONV#": [conversations[:20], conversations[20:]],
+            "user#RELATED_DOCUMENT#": [[{"SK": "user#RELATED_DOCUMENT#1#a"}]],
+            "user#RELATED_DOCUMENT_CONTENT#": [],
+        }
+
+        def mock_query_side_effect(**kwargs):
+            sk_condition = kwargs["KeyConditionExpression"].get_expression()["values"][
+                1
+            ]
+            prefix = sk_condition.get_expression()["values"][1]
+            prefix_pages = pages[prefix] or [[]]
+            page = 1 if "ExclusiveStartKey" in kwargs else 0
+            return {
+                "Items": prefix_pages[page],
+                **({"LastEvaluatedKey": {}} if page + 1 < len(prefix_pages) else {}),
+            }
+
+        self.table.query.side_effect = mock_query_side_effect
+
+        self.calls: list[str] = []
+        self.s3_client.delete_objects.side_effect = lambda **kwargs: (
+            self.calls.append("delete_objects") or {}
+        )
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_delete_all(self):
+        unprocessed = {"table": [{"DeleteRequest": {"Key": {"PK": "user"}}}]}
+        responses = [{"UnprocessedItems": unprocessed}]
+
+        def mock_batch_write_item(**kwargs):
+            keys = [
+                request["DeleteRequest"]["Key"]["SK"]
+                for request in kwargs["RequestItems"]["table"]
+                if "SK" in request["DeleteRequest"]["Key"]
+            ]
+            self.calls.extend(keys)
+            return responses.pop() if responses else {}
+
+        self.client.batch_write_item.side_effect = mock_batch_write_item
+        progress = []
+
+        result = delete_conversation_by_user_id("user", on_progress=progress.append)
+
+        self.assertEqual(result, DeletionProgress(deleted_items=31, deleted_objects=1))
+        self.assertEqual(progress[-1], result)
+        self.assertEqual(
+            self.s3_client.delete_objects.call_args.kwargs["Delete"]["Objects"],
+            [{"Key": "user/0/message_map.json"}],
+        )
+        # The conversation with a large message is deleted after the object
+        self.assertLess(
+            self.calls.index("delete_objects"), self.calls.index("user#CONV#0")
+        )
+        self.assertEqual(
+            sorted(key for key in self.calls if key != "delete_objects"),
+            sorted(
+                [f"user#CONV#{i}" for i in range(30)] + ["user#RELATED_DOCUMENT#1#a"]
+            ),
+        )
+        # The unprocessed items are retried
+        self.assertIn(
+            unprocessed,
+            [
+                call.kwargs["RequestItems"]
+                for call in self.client.batch_write_item.call_args_list
+            ],
+        )
+
+    def test_delete_in_full_segments(self):
+        self.client.batch_write_item.return_value = {}
+
+        delete_conversation_by_user_id("user")
+
+        # 31 items are deleted in a full segment of 25 and the rest
+        self.assertEqual(
+            [
+                len(call.kwargs["RequestItems"]["table"])
+                for call in self.client.batch_write_item.call_args_list
+            ],
+            [25, 6],
+        )
+
+
+@mock_aws
+class TestBulkDeletionOnTable(unittest.TestCase):
+    def setUp(self):
+        dynamodb = boto3.resource("dynamodb", region_name="us-east-1")
+        self.table = dynamodb.create_table(
+            TableName="table",
+            KeySchema=[
+                {"AttributeName": "PK", "KeyType": "HASH"},
+                {"AttributeName": "SK", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "PK", "AttributeType": "S"},
+                {"AttributeName": "SK", "AttributeType": "S"},
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        self.patchers = [
+            patch(
+                "app.repositories.conversation._get_table_client",
+                return_value=self.table,
+            ),
+            patch("app.repositories.conversation.s3_client"),
+            patch("app.repositories.conversation.large_message_cache"),
+            patch("app.repositories.conversation.TABLE_NAME", "table"),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_delete_all(self):
+        with self.table.batch_writer() as writer:
+            for i in range(30):
+                writer.put_item(Item={"PK": "user", "SK": f"user#CONV#{i}"})
+            writer.put_item(Item={"PK": "user", "SK": "user#RELATED_DOCUMENT#1#a"})
+            writer.put_item(Item={"PK": "other", "SK": "other#CONV#1"})
+
+        result = delete_conversation_by_user_id("user")
+
+        self.assertEqual(result, DeletionProgress(deleted_items=31, deleted_objects=0))
+        self.assertEqual([item["PK"] for item in self.table.scan()["Items"]], ["other"])
+
+
+class TestLargeMessageCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = LargeMessageCache(
+            directory=self.directory.name,
+            max_memory_bytes=10,
+            max_disk_bytes=20,
+        )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_put_and_get(self):
+        self.cache.put("user/1/message_map.json", '"etag1"', b"12345")
+        self.assertEqual(
+            self.cache.get("user/1/message_map.json"),
+            CachedBlob(etag='"etag1"', body=b"12345"),
+        )
+        self.assertIsNone(self.cache.get("user/2/message_map.json"))
+
+    def test_read_from_disk(self):
+        self.cache.put("a", '"etag"', b"12345")
+
+        # e.g. a new process in the same container
+        cache = LargeMessageCache(directory=self.directory.name)
+        self.assertEqual(cache.get("a"), CachedBlob(etag='"etag"', body=b"12345"))
+
+    def test_evict(self):
+        self.cache.put("a", '"a"', b"0123456789")
+        self.cache.put("b", '"b"', b"0123456789")
+        # Evicted from memory, but still on disk
+        self.assertEqual(
+            self.cache.get("a"), CachedBlob(etag='"a"', body=b"0123456789")
+        )
+
+        self.cache.put("c", '"c"', b"0123456789")
+        # `b` is the least recently used one
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("a"))
+
+    def test_delete(self):
+        self.cache.put("a", '"a"', b"12345")
+        self.cache.delete("a")
+        self.assertIsNone(self.cache.get("a"))
+
+
+class TestGetLargeMessage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.s3_patcher = patch("app.repositories.conversation.s3_client")
+        self.cache_patcher = patch(
+            "app.repositories.conversation.large_message_cache",
+            LargeMessageCache(directory=self.directory.name),
+        )
+        self.mock_s3_client = self.s3_patcher.start()
+        self.cache = self.cache_patcher.start()
+
+    def tearDown(self):
+        self.s3_patcher.stop()
+        self.cache_patcher.stop()
+        self.directory.cleanup()
+
+    def test_not_modified(self):
+        self.cache.put("user/1/message_map.json", '"etag"', b"{}")
+        self.mock_s3_client.get_object.side_effect = ClientError(
+            {"Error": {"Code": "304", "Message": "Not Modified"}}, "GetObject"
+        )
+
+        self.assertEqual(_get_large_message("user/1/message_map.json"), b"{}")
+        self.assertEqual(
+            self.mock_s3_client.get_object.call_args.kwargs["IfNoneMatch"], '"etag"'
+        )
+
+    def test_modified(self):
+        self.cache.put("user/1/message_map.json", '"etag1"', b"{}")
+        self.mock_s3_client.get_object.return_value = {
+            "ETag": '"etag2"',
+            "Body": MagicMock(read=lambda: b'{"a": 1}'),
+        }
+
+        self.assertEqual(_get_large_message("user/1/message_map.json"), b'{"a": 1}')
+        self.assertEqual(
+            self.cache.get("user/1/message_map.json"),
+            CachedBlob(etag='"etag2"', body=b'{"a": 1}'),
+        )
+
+    def test_miss(self):
+        self.mock_s3_client.get_object.return_value = {
+            "ETag": '"etag"',
+            "Body": MagicMock(read=lambda: b"{}"),
+        }
+
+        self.assertEqual(_get_large_message("user/1/message_map.json"), b"{}")
+        self.assertNotIn("IfNoneMatch", self.mock_s3_client.get_object.call_args.kwargs)
+
+
+class TestLazyMessageMap(unittest.TestCase):
+    def setUp(self):
+        self.stored = {
+            "system": {
+                "role": "system",
+                "content": [{"content_type": "text", "body": ""}],
+                "model": "claude-v3-haiku",
+                "children": ["a"],
+                "parent": None,
+                "create_time": 0,
+            },
+            "a": {
+                "role": "user",
+                "content": {"content_type": "text", "body": "Hello"},
+                "model": "claude-v3-haiku",
+                "children": [],
+                "parent": "system",
+                "create_time": 1,
+                "thinking_log": "legacy",
+            },
+        }
+        self.message_map = LazyMessageMap(json.loads(json.dumps(self.stored)))
+
+    def test_hydrate_on_access(self):
+        self.assertTrue("a" in self.message_map)
+        self.assertEqual(len(self.message_map), 2)
+
+        message = self.message_map["a"]
+        self.assertIsInstance(message, MessageModel)
+        # Legacy shapes are normalized as by `model_validate`
+        self.assertEqual(message.content[0].body, "Hello")  # type: ignore
+        self.assertIsNone(message.thinking_log)
+        # Hydrated only once
+        self.assertIs(self.message_map.get("a"), message)
+        self.assertIsNone(self.message_map.get("b"))
+
+    def test_dump_items_reuses_stored_entries(self):
+        self.message_map["a"].feedback = FeedbackModel(
+            thumbs_up=True, category="Good", comment=""
+        )
+        dumped = dict(self.message_map.dump_items())
+
+        self.assertEqual(dumped["system"], self.stored["system"])
+        self.assertEqual(dumped["a"]["feedback"]["category"], "Good")
+        self.assertEqual(
+            dumped["a"]["content"], [{"content_type": "text", "body": "Hello"}]
+        )
+
+    def test_conversation_model_dump(self):
+        conversation = ConversationModel.model_construct(
+            id="1",
+            create_time=0,
+            title="Test",
+            total_price=0,
+            message_map=self.message_map,
+            last_message_id="a",
+            bot_id=None,
+            should_continue=False,
+        )
+        validated = ConversationModel.model_validate(
+            {**conversation.__dict__, "message_map": self.stored}
+        )
+
+        self.assertEqual(conversation.model_dump(), validated.model_dump())
+        self.assertEqual(conversation.dump_message_map(), validated.dump_message_map())
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,10 +1,16 @@
 import sys
 import unittest
+from decimal import Decimal
+from unittest.mock import patch
+
+import boto3
+from moto import mock_aws
 
 sys.path.insert(0, ".")
 
 
 from app.repositories.custom_bot import (
+    backfill_published_bot_index,
     delete_alias_by_id,
     delete_bot_by_id,
     delete_bot_publication,
@@ -534,5 +540,134 @@ class TestUpdateBotVisibility(unittest.TestCase):
         self.assertEqual(bots[2].available, False)
 
 
+class TestFindAllPublishedBotsPagination(unittest.TestCase):
+    @patch("app.repositories.custom_bot._get_table_public_client")
+    def test_next_token(self, mock_get_table):
+        table = mock_get_table.return_value
+        last_evaluated_key = {
+            "PK": "user1",
+            "SK": "user1#BOT#1",
+            "PublishedBotPartition": "PUBLISHED_BOT",
+            "ApiPublishedDatetime": Decimal(1700000000000),
+        }
+        table.query.return_value = {
+            "Items": [],
+            "LastEvaluatedKey": last_evaluated_key,
+        }
+
+        _, next_token = find_all_published_bots(limit=1)
+        find_all_published_bots(limit=1, next_token=next_token)
+
+        # Query the sparse index, and resume from where the previous page ended
+        self.assertEqual(table.query.call_args.kwargs["IndexName"], "PublishedBotIndex")
+        self.assertEqual(
+            table.query.call_args.kwargs["ExclusiveStartKey"], last_evaluated_key
+        )
+
+
+@mock_aws
+class TestPublishedBotIndex(unittest.TestCase):
+    PUBLISHED_BOT_INDEX = {
+        "IndexName": "PublishedBotIndex",
+        "KeySchema": [
+            {"AttributeName": "PublishedBotPartition", "KeyType": "HASH"},
+            {"AttributeName": "ApiPublishedDatetime", "KeyType": "RANGE"},
+        ],
+        "Projection": {"ProjectionType": "ALL"},
+    }
+    PUBLISHED_BOT_INDEX_ATTRIBUTES = [
+        {"AttributeName": "PublishedBotPartition", "AttributeType": "S"},
+        {"AttributeName": "ApiPublishedDatetime", "AttributeType": "N"},
+    ]
+
+    def setUp(self):
+        self.table = self._create_table(with_index=True)
+        self.patchers = [
+            patch(f"app.repositories.custom_bot.{target}", return_value=self.table)
+            for target in ["_get_table_client", "_get_table_public_client"]
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def _create_table(self, with_index: bool):
+        dynamodb = boto3.resource("dynamodb", region_name="us-east-1")
+        return dynamodb.create_table(
+            TableName="table",
+            KeySchema=[
+                {"AttributeName": "PK", "KeyType": "HASH"},
+                {"AttributeName": "SK", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "PK", "AttributeType": "S"},
+                {"AttributeName": "SK", "AttributeType": "S"},
+                *(self.PUBLISHED_BOT_INDEX_ATTRIBUTES if with_index else []),
+            ],
+            **(
+                {"GlobalSecondaryIndexes": [self.PUBLISHED_BOT_INDEX]}
+                if with_index
+                else {}
+            ),
+            BillingMode="PAY_PER_REQUEST",
+        )
+
+    def test_store_unpublished_bot(self):
+        store_bot("user1", create_test_private_bot("1", False, "user1"))
+
+        item = self.table.get_item(Key={"PK": "user1", "SK": "user1#BOT#1"})["Item"]
+        self.assertNotIn("ApiPublishedDatetime", item)
+        self.assertIsNone(find_private_bot_by_id("user1", "1").published_api_datetime)
+
+    def test_backfill(self):
+        store_bot(
+            "user1",
+            create_test_private_bot(
+                "1",
+                False,
+                "user1",
+                published_api_stack_name="ApiPublishmentStack1",
+                published_api_datetime=1700000000000,
+                published_api_codebuild_id="build1",
+            ),
+        )
+        store_bot("user1", create_test_private_bot("2", False, "user1"))
+
+        self.assertEqual(backfill_published_bot_index(), 1)
+
+        bots, _ = find_all_published_bots()
+        self.assertEqual([bot.id for bot in bots], ["1"])
+
+    def test_backfill_removes_null_publication(self):
+        # Stored with null publication attributes before the index was added
+        self.table.delete()
+        self._create_table(with_index=False)
+        store_bot("user1", create_test_private_bot("1", False, "user1"))
+        self.table.update_item(
+            Key={"PK": "user1", "SK": "user1#BOT#1"},
+            UpdateExpression="SET ApiPublishmentStackName = :null, ApiPublishedDatetime = :null, ApiPublishCodeBuildId = :null",
+            ExpressionAttributeValues={":null": None},
+        )
+        self.table.meta.client.update_table(
+            TableName="table",
+            AttributeDefinitions=self.PUBLISHED_BOT_INDEX_ATTRIBUTES,
+            GlobalSecondaryIndexUpdates=[{"Create": self.PUBLISHED_BOT_INDEX}],
+        )
+
+        self.assertEqual(backfill_published_bot_index(), 0)
+
+        item = self.table.get_item(Key={"PK": "user1", "SK": "user1#BOT#1"})["Item"]
+        for name in [
+            "ApiPublishmentStackName",
+            "ApiPublishedDatetime",
+            "ApiPublishCodeBuildId",
+            "PublishedBotPartition",
+        ]:
+            self.assertNotIn(name, item)
+        self.assertIsNone(find_private_bot_by_id("user1", "1").published_api_datetime)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,15 +1,19 @@
 import sys
 import unittest
+from datetime import datetime
+from unittest.mock import patch
 
 sys.path.append(".")
 
 from pprint import pprint
 
+from app.repositories import usage_analysis
 from app.repositories.usage_analysis import (
     _find_cognito_user_by_id,
     _find_cognito_users_by_ids,
     find_bots_sorted_by_price,
     find_users_sorted_by_price,
+    run_athena_query,
 )
 
 
@@ -42,5 +46,109 @@ class TestCognitoUser(unittest.IsolatedAsyncioTestCase):
         pprint(users)
 
 
+def _row(value: str):
+    return {"Data": [{"VarCharValue": value}]}
+
+
+class TestRunAthenaQuery(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patcher = patch("app.repositories.usage_analysis.athena")
+        self.athena = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(usage_analysis._query_cache.clear)
+
+        self.athena.start_query_execution.return_value = {"QueryExecutionId": "id1"}
+        self.athena.get_query_execution.side_effect = [
+            {"QueryExecution": {"Status": {"State": "RUNNING"}}},
+            {"QueryExecution": {"Status": {"State": "SUCCEEDED"}}},
+        ]
+        self.athena.get_query_results.side_effect = [
+            {"ResultSet": {"Rows": [_row("header"), _row("1")]}, "NextToken": "next"},
+            {"ResultSet": {"Rows": [_row("2")]}},
+        ]
+
+    async def _run(self, query: str):
+        with patch.object(usage_analysis, "ATHENA_POLL_INITIAL_INTERVAL_SECONDS", 0):
+            return [
+                row["Data"][0]["VarCharValue"]
+                async for row in run_athena_query(query, "db", "wg", "s3://output")
+            ]
+
+    async def test_read_all_pages(self):
+        rows = await self._run("SELECT 1")
+
+        self.assertEqual(rows, ["1", "2"])
+        self.assertEqual(
+            self.athena.get_query_results.call_args.kwargs["NextToken"], "next"
+        )
+        self.assertTrue(
+            self.athena.start_query_execution.call_args.kwargs[
+                "ResultReuseConfiguration"
+            ]["ResultReuseByAgeConfiguration"]["Enabled"]
+        )
+
+    async def test_cache_normalized_query(self):
+        await self._run("SELECT\n    1")
+        rows = await self._run("SELECT 1")
+
+        self.assertEqual(rows, ["1", "2"])
+        self.athena.start_query_execution.assert_called_once()
+
+    async def test_failed_query(self):
+        self.athena.get_query_execution.side_effect = [
+            {
+                "QueryExecution": {
+                    "Status": {"State": "FAILED", "StateChangeReason": "Syntax error"}
+                }
+            },
+        ]
+
+        with self.assertRaisesRegex(Exception, "Syntax error"):
+            await self._run("SELECT")
+
+
+class TestCompactTableQuery(unittest.IsolatedAsyncioTestCase):
+    async def find_bots_sorted_by_price(self, compacted_datehours: list[str]):
+        self.queries = []
+
+        async def mock_run_athena_query(query, *args, **kwargs):
+            self.queries.append(query)
+            if "SELECT DISTINCT" in query:
+                for datehour in compacted_datehours:
+                    yield {"Data": [{"VarCharValue": datehour}]}
+            else:
+                yield {"Data": [{"VarCharValue": "bot1"}, {"VarCharValue": "1.5"}]}
+
+        with patch.object(
+            usage_analysis, "USAGE_ANALYSIS_COMPACT_TABLE", "ddb_compact"
+        ), patch.object(usage_analysis, "run_athena_query", mock_run_athena_query):
+            return await usage_analysis._find_bots_sorted_by_price_from_athena(
+                10, datetime(2024, 1, 1, 0), datetime(2024, 1, 1, 23)
+            )
+
+    async def test_query_compact_table(self):
+        prices = await self.find_bots_sorted_by_price(
+            [f"2024/01/01/{hour:02}" for hour in range(24)]
+        )
+
+        self.assertEqual(prices, [("bot1", 1.5)])
+        self.assertIn(".ddb_compact", self.queries[1])
+        self.assertIn("BETWEEN '2024/01/01/00' AND '2024/01/01/23'", self.queries[1])
+        self.assertNotIn(".ddb_export", self.queries[1])
+
+    async def test_read_export_of_uncompacted_hours(self):
+        # Exported before the compaction was deployed, and not compacted yet
+        await self.find_bots_sorted_by_price(
+            [f"2024/01/01/{hour:02}" for hour in range(10, 23)]
+        )
+
+        self.assertIn(".ddb_export", self.queries[1])
+        self.assertIn(
+            "(datehour BETWEEN '2024/01/01/00' AND '2024/01/01/09'"
+            " OR datehour BETWEEN '2024/01/01/23' AND '2024/01/01/23')",
+            self.queries[1],
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,99 @@
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.append(".")
+
+from app.repositories import usage_quota
+from app.repositories.common import QuotaExceededError
+from app.repositories.usage_quota import admit_turn, charge_tokens
+from botocore.exceptions import ClientError
+
+
+class _FakeTable:
+    """Consumed counters of the buckets, updated as DynamoDB does."""
+
+    def __init__(self):
+        self.consumed: dict[str, int] = {}
+
+    def get_item(self, Key, **kwargs):
+        if Key["PK"] not in self.consumed:
+            return {}
+        return {"Item": {"Consumed": self.consumed[Key["PK"]]}}
+
+    def update_item(self, Key, ExpressionAttributeValues, **kwargs):
+        key = Key["PK"]
+        if "ConditionExpression" in kwargs:
+            if self.consumed.get(key) != ExpressionAttributeValues[":current"]:
+                raise ClientError(
+                    {"Error": {"Code": "ConditionalCheckFailedException"}},
+                    "UpdateItem",
+                )
+            self.consumed[key] = ExpressionAttributeValues[":consumed"]
+        else:
+            self.consumed[key] = (
+                self.consumed.get(key, 0) + ExpressionAttributeValues[":tokens"]
+            )
+        return {"Attributes": {"Consumed": self.consumed[key]}}
+
+
+class TestUsageQuota(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(usage_quota._cache.clear)
+        self.table = _FakeTable()
+
+        for target, value in [
+            ("_get_table_public_client", lambda: self.table),
+            ("QUOTA_USER_TOKENS_PER_MINUTE", 6000),
+            ("QUOTA_BOT_TOKENS_PER_MINUTE", 0),
+            ("QUOTA_MAX_WAIT_SECONDS", 0),
+        ]:
+            patcher = patch.object(usage_quota, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _refill(self, seconds: float):
+        usage_quota._cache.clear()
+        for key in self.table.consumed:
+            self.table.consumed[key] -= int(seconds * 100) + 1
+
+    def test_admit_within_capacity(self):
+        admit_turn("user1", "bot1", "claude-v3-haiku")
+        charge_tokens("user1", "bot1", "claude-v3-haiku", 5000)
+
+        # 1000 tokens are left of the capacity
+        admit_turn("user1", "bot1", "claude-v3-haiku")
+
+    def test_reject_over_capacity(self):
+        # Idle time does not fill the bucket over its capacity
+        charge_tokens("user1", "bot1", "claude-v3-haiku", 7000)
+
+        with self.assertRaises(QuotaExceededError) as cm:
+            admit_turn("user1", "bot1", "claude-v3-haiku")
+
+        # 100 tokens are refilled per second
+        self.assertAlmostEqual(cm.exception.retry_after_seconds, 10, delta=1)
+        # Buckets are separated by user and model
+        admit_turn("user2", "bot1", "claude-v3-haiku")
+        admit_turn("user1", "bot1", "claude-v3-sonnet")
+
+    def test_wait_for_refill(self):
+        charge_tokens("user1", "bot1", "claude-v3-haiku", 6050)
+
+        with patch.object(usage_quota, "QUOTA_MAX_WAIT_SECONDS", 10), patch(
+            "app.repositories.usage_quota.time.sleep", side_effect=self._refill
+        ) as mock_sleep:
+            admit_turn("user1", "bot1", "claude-v3-haiku")
+
+        mock_sleep.assert_called_once()
+
+    def test_disabled(self):
+        with patch.object(usage_quota, "QUOTA_USER_TOKENS_PER_MINUTE", 0):
+            charge_tokens("user1", "bot1", "claude-v3-haiku", 100000)
+            admit_turn("user1", "bot1", "claude-v3-haiku")
+
+        self.assertEqual(self.table.consumed, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
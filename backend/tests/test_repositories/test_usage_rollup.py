@@ -0,0 +1,126 @@
+import queue
+import sys
+import unittest
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+sys.path.append(".")
+
+from app.repositories import usage_rollup
+from app.repositories.usage_rollup import (
+    _split_range,
+    find_usage_sorted_by_price,
+    record_usage,
+)
+
+
+class TestSplitRange(unittest.TestCase):
+    def test_whole_days_and_edge_hours(self):
+        periods = _split_range(datetime(2024, 1, 1, 22), datetime(2024, 1, 3, 1))
+
+        self.assertEqual(
+            periods,
+            ["H2024010122", "H2024010123", "D20240102", "H2024010300", "H2024010301"],
+        )
+
+    def test_single_day(self):
+        periods = _split_range(datetime(2024, 1, 1, 0), datetime(2024, 1, 1, 23))
+
+        self.assertEqual(periods, ["D20240101"])
+
+
+class TestUsageRollup(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.table = MagicMock()
+        patcher = patch(
+            "app.repositories.usage_rollup._get_table_public_client",
+            return_value=self.table,
+        )
+        self.get_table_public_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        # Each test runs its own worker with the mocked client
+        for name, value in [("_usage_queue", queue.Queue()), ("_worker", None)]:
+            patcher = patch.object(usage_rollup, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_record_usage(self):
+        with patch.object(usage_rollup, "_since_recorded", True):
+            record_usage("user1", "bot1", 0.5, 100, 10)
+            usage_rollup._usage_queue.join()
+
+        keys = [
+            call.kwargs["Key"]["SK"] for call in self.table.update_item.call_args_list
+        ]
+        # Hourly and daily counters for both of the user and the bot
+        self.assertEqual(keys, ["USER#user1", "USER#user1", "BOT#bot1", "BOT#bot1"])
+        self.assertEqual(
+            self.table.update_item.call_args.kwargs["ExpressionAttributeValues"][
+                ":price"
+            ],
+            Decimal("0.5"),
+        )
+
+    def test_record_usage_failure_is_ignored(self):
+        self.table.update_item.side_effect = Exception("Failed")
+
+        with patch.object(usage_rollup, "_since_recorded", True):
+            record_usage("user1", None, 0.5, 100, 10)
+            usage_rollup._usage_queue.join()
+
+    def test_record_usage_reuses_table_client(self):
+        with patch.object(usage_rollup, "_since_recorded", True):
+            record_usage("user1", None, 0.5, 100, 10)
+            record_usage("user2", None, 0.5, 100, 10)
+            usage_rollup._usage_queue.join()
+
+        self.assertEqual(self.table.update_item.call_count, 4)
+        self.get_table_public_client.assert_called_once()
+
+    async def test_find_usage_sorted_by_price(self):
+        self.table.get_item.return_value = {"Item": {"Since": "2000010100"}}
+        start = datetime.combine(date.today() - timedelta(days=2), time())
+
+        def query(**kwargs):
+            return {
+                "Items": [
+                    {"SK": "BOT#bot1", "TotalPrice": Decimal("0.25")},
+                    {"SK": "BOT#bot2", "TotalPrice": Decimal("1")},
+                ]
+            }
+
+        self.table.meta.client.query.side_effect = query
+
+        usages = await find_usage_sorted_by_price(
+            "BOT", 1, start, start.replace(hour=1)
+        )
+
+        # 2 hours * shards
+        self.assertEqual(
+            self.table.meta.client.query.call_count,
+            2 * usage_rollup.USAGE_ROLLUP_SHARDS,
+        )
+        self.assertEqual(usages, [("bot2", 2.0 * usage_rollup.USAGE_ROLLUP_SHARDS)])
+
+    async def test_range_before_rollup(self):
+        self.table.get_item.return_value = {"Item": {"Since": "2024010100"}}
+
+        usages = await find_usage_sorted_by_price(
+            "USER", 10, datetime(2024, 1, 1, 0), datetime(2024, 1, 1, 23)
+        )
+
+        self.assertIsNone(usages)
+        self.table.meta.client.query.assert_not_called()
+
+    async def test_too_long_range(self):
+        usages = await find_usage_sorted_by_price(
+            "USER", 10, datetime(2024, 1, 1, 0), datetime(2024, 12, 31, 23)
+        )
+
+        self.assertIsNone(usages)
+        self.table.get_item.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import sys
+import time
+import unittest
+from unittest.mock import patch
+
+sys.path.append(".")
+
+from app.repositories import user_directory
+from app.repositories.user_directory import _RateLimiter, find_emails_by_user_ids
+
+
+class TestFindEmailsByUserIds(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(user_directory._cache.clear)
+
+        patcher = patch("app.repositories.user_directory._get_aws_resource")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch(
+            "app.repositories.user_directory._find_emails_from_table",
+            return_value={"user1": "user1@example.com"},
+        )
+        self.mock_find_from_table = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch("app.repositories.user_directory._store_emails_to_table")
+        self.mock_store_to_table = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch(
+            "app.repositories.user_directory._find_email_from_cognito",
+            side_effect=lambda user_id: (
+                "user2@example.com" if user_id == "user2" else None
+            ),
+        )
+        self.mock_find_from_cognito = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fill_misses(self):
+        emails = find_emails_by_user_ids(["user1", "user2", "user3"])
+
+        self.assertEqual(
+            emails, {"user1": "user1@example.com", "user2": "user2@example.com"}
+        )
+        # Only the users not in the table are looked up from Cognito
+        self.assertEqual(
+            sorted(call.args[0] for call in self.mock_find_from_cognito.call_args_list),
+            ["user2", "user3"],
+        )
+        self.assertEqual(
+            self.mock_store_to_table.call_args.args[1], {"user2": "user2@example.com"}
+        )
+
+    def test_cache_in_process(self):
+        find_emails_by_user_ids(["user1", "user2", "user3"])
+        self.mock_find_from_table.reset_mock()
+        self.mock_find_from_cognito.reset_mock()
+
+        emails = find_emails_by_user_ids(["user1", "user2", "user3"])
+
+        self.assertEqual(len(emails), 2)
+        # Unknown users are cached as well
+        self.mock_find_from_table.assert_not_called()
+        self.mock_find_from_cognito.assert_not_called()
+
+    def test_evict_least_recently_used(self):
+        with patch.object(user_directory, "USER_DIRECTORY_CACHE_MAX_ENTRIES", 2):
+            find_emails_by_user_ids(["user1", "user2"])
+            find_emails_by_user_ids(["user1"])
+            find_emails_by_user_ids(["user3"])
+
+        self.assertEqual(list(user_directory._cache), ["user1", "user3"])
+
+    def test_expire(self):
+        find_emails_by_user_ids(["user1"])
+        self.mock_find_from_table.reset_mock()
+
+        with patch.object(
+            user_directory.time,
+            "monotonic",
+            return_value=time.monotonic()
+            + user_directory.USER_DIRECTORY_CACHE_TTL_SECONDS,
+        ):
+            find_emails_by_user_ids(["user1"])
+
+        self.mock_find_from_table.assert_called_once()
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_space_out_calls(self):
+        limiter = _RateLimiter(20)
+
+        start = time.monotonic()
+        for _ in range(3):
+            limiter.wait()
+
+        # The first call is not delayed
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,6 +4,7 @@ sys.path.append(".")
 import unittest
 
 from app.routes.schemas.api_publication import (
+    ApiKeyInput,
     BotPublishInput,
     PublishedApiQuota,
     PublishedApiThrottle,
@@ -53,5 +54,16 @@ class TestBotPublishInput(unittest.TestCase):
             )
 
 
+class TestApiKeyInput(unittest.TestCase):
+    def test_create_input(self):
+        obj = ApiKeyInput(description="key", webhook_url="https://example.com/webhook")
+        self.assertEqual(obj.webhook_url, "https://example.com/webhook")
+        self.assertIsNone(ApiKeyInput(description="key").webhook_url)
+
+    def test_create_input_invalid_webhook_url(self):
+        with self.assertRaises(ValueError):
+            ApiKeyInput(description="key", webhook_url="http://example.com/webhook")
+
+
 if __name__ == "__main__":
     unittest.main()
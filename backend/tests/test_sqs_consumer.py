@@ -0,0 +1,176 @@
+import json
+import sys
+import threading
+import unittest
+from unittest.mock import patch
+
+sys.path.append(".")
+
+from app.repositories.models.idempotency import MessageStatusModel
+from app.sqs_consumer import handler, process_record
+
+
+class TestSqsConsumer(unittest.TestCase):
+    def _event(self, count: int):
+        return {
+            "Records": [
+                {"messageId": str(i), "body": f'{{"index": {i}}}'} for i in range(count)
+            ]
+        }
+
+    def test_report_failed_messages(self):
+        def mock_process_record(record):
+            if record["messageId"] == "1":
+                raise Exception("Failed")
+
+        with patch("app.sqs_consumer.process_record", mock_process_record):
+            response = handler(self._event(3), None)
+
+        self.assertEqual(response["batchItemFailures"], [{"itemIdentifier": "1"}])
+
+    def test_process_concurrently(self):
+        # Every record waits for all the others, so this only finishes if they
+        # are processed concurrently
+        barrier = threading.Barrier(3, timeout=5)
+
+        with patch("app.sqs_consumer.process_record", lambda record: barrier.wait()):
+            response = handler(self._event(3), None)
+
+        self.assertEqual(response["batchItemFailures"], [])
+
+    def test_process_conversation_in_order(self):
+        event = {
+            "Records": [
+                {"messageId": str(i), "body": f'{{"conversationId": "{c}"}}'}
+                for i, c in enumerate(["a", "b", "a", "a"])
+            ]
+        }
+        processed = []
+
+        def mock_process_record(record):
+            if record["messageId"] == "2":
+                raise Exception("Failed")
+            processed.append(record["messageId"])
+
+        with patch("app.sqs_consumer.process_record", mock_process_record):
+            response = handler(event, None)
+
+        # The messages after the failed one are not processed but redelivered
+        self.assertEqual(sorted(processed), ["0", "1"])
+        self.assertEqual(
+            response["batchItemFailures"],
+            [{"itemIdentifier": "2"}, {"itemIdentifier": "3"}],
+        )
+
+    def _record(self):
+        return {
+            "messageId": "0",
+            "body": json.dumps(
+                {
+                    "conversationId": "conversation1",
+                    "message": {
+                        "role": "user",
+                        "content": [{"contentType": "text", "body": "Hello"}],
+                        "model": "claude-v3-haiku",
+                        "parentMessageId": None,
+                        "messageId": "message1",
+                    },
+                    "botId": "bot1",
+                }
+            ),
+        }
+
+    @patch("app.sqs_consumer.chat")
+    @patch("app.sqs_consumer.acquire_idempotency_key", return_value=None)
+    def test_skip_duplicate_message(self, mock_acquire, mock_chat):
+        process_record(self._record())
+
+        mock_acquire.assert_called_once_with(
+            "PUBLISHED_API#bot1", "conversation1", "message1"
+        )
+        mock_chat.assert_not_called()
+
+    @patch("app.sqs_consumer.requests.post")
+    @patch(
+        "app.sqs_consumer.find_webhook_url",
+        return_value="https://example.com/webhook",
+    )
+    @patch("app.sqs_consumer.chat_output_from_message")
+    @patch("app.sqs_consumer.chat", return_value=(None, None))
+    @patch("app.sqs_consumer.complete_idempotency_key")
+    @patch(
+        "app.sqs_consumer.acquire_idempotency_key",
+        return_value=MessageStatusModel(status="IN_PROGRESS", api_key_id="key1"),
+    )
+    def test_notify_completion(
+        self,
+        mock_acquire,
+        mock_complete,
+        mock_chat,
+        mock_output,
+        mock_find_webhook,
+        mock_post,
+    ):
+        process_record(self._record())
+
+        mock_complete.assert_called_once_with(
+            "PUBLISHED_API#bot1", "conversation1", "message1"
+        )
+        # The webhook configured for the API key the message was sent with
+        mock_find_webhook.assert_called_once_with("bot1", "key1")
+        self.assertEqual(mock_post.call_args.args[0], "https://example.com/webhook")
+        self.assertEqual(
+            json.loads(mock_post.call_args.kwargs["data"]),
+            {
+                "conversationId": "conversation1",
+                "messageId": "message1",
+                "status": "COMPLETED",
+            },
+        )
+
+    @patch("app.sqs_consumer.release_idempotency_key")
+    @patch("app.sqs_consumer.chat", side_effect=Exception("Failed"))
+    @patch(
+        "app.sqs_consumer.acquire_idempotency_key",
+        return_value=MessageStatusModel(status="IN_PROGRESS", api_key_id=None),
+    )
+    def test_release_on_failure(self, mock_acquire, mock_chat, mock_release):
+        with self.assertRaises(Exception):
+            process_record(self._record())
+
+        # Released to be processed again on redelivery
+        mock_release.assert_called_once_with(
+            "PUBLISHED_API#bot1", "conversation1", "message1", failed=False
+        )
+
+    @patch("app.sqs_consumer.requests.post")
+    @patch(
+        "app.sqs_consumer.find_webhook_url",
+        return_value="https://example.com/webhook",
+    )
+    @patch("app.sqs_consumer.release_idempotency_key")
+    @patch("app.sqs_consumer.chat", side_effect=Exception("Failed"))
+    @patch(
+        "app.sqs_consumer.acquire_idempotency_key",
+        return_value=MessageStatusModel(status="IN_PROGRESS", api_key_id="key1"),
+    )
+    def test_fail_on_last_receive(
+        self, mock_acquire, mock_chat, mock_release, mock_find_webhook, mock_post
+    ):
+        record = {**self._record(), "attributes": {"ApproximateReceiveCount": "2"}}
+
+        with patch("app.sqs_consumer.SQS_MAX_RECEIVE_COUNT", 2), self.assertRaises(
+            Exception
+        ):
+            process_record(record)
+
+        mock_release.assert_called_once_with(
+            "PUBLISHED_API#bot1", "conversation1", "message1", failed=True
+        )
+        self.assertEqual(
+            json.loads(mock_post.call_args.kwargs["data"])["status"], "FAILED"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
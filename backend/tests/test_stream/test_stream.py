@@ -4,8 +4,10 @@ import sys
 sys.path.append(".")
 
 import unittest
+from unittest.mock import MagicMock, patch
 
 import boto3
+from app import bedrock_limiter, bedrock_router
 from app.repositories.models.conversation import (
     TextContentModel,
     ImageContentModel,
@@ -15,6 +17,7 @@ from app.repositories.models.conversation import (
 from app.repositories.models.custom_bot import GenerationParamsModel
 from app.repositories.models.custom_bot_guardrails import BedrockGuardrailsModel
 from app.stream import ConverseApiStreamHandler, OnStopInput
+from botocore.exceptions import ClientError
 from get_aws_logo import get_aws_logo, get_cdk_logo
 from get_pdf import get_aws_overview, get_test_markdown
 from ulid import ULID
@@ -250,5 +253,63 @@ class TestConverseApiStreamHandlerGuardrail(unittest.TestCase):
         self._run(message, guardrail=guardrail)
 
 
+class TestConverseApiStreamHandlerRetry(unittest.TestCase):
+    MODEL = "claude-v3-haiku"
+
+    def setUp(self):
+        self.addCleanup(bedrock_router._health.clear)
+        self.addCleanup(bedrock_limiter._limiters.clear)
+        for patcher in [
+            patch("app.bedrock_limiter.time.sleep"),
+            patch(
+                "app.bedrock_router.BEDROCK_ROUTING_REGIONS",
+                ["us-east-1", "us-west-2"],
+            ),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @patch("app.stream.get_bedrock_runtime_client")
+    def test_not_retry_after_streamed(self, mock_get_client):
+        client = mock_get_client.return_value
+        client.exceptions.ThrottlingException = ClientError
+        # Throttled in the middle of the stream
+        client.converse_stream.return_value = {
+            "stream": [
+                {"messageStart": {"role": "assistant"}},
+                {
+                    "contentBlockDelta": {
+                        "contentBlockIndex": 0,
+                        "delta": {"text": "Hello"},
+                    }
+                },
+                {"throttlingException": {"message": "Too many requests"}},
+            ]
+        }
+        on_stream = MagicMock()
+        stream_handler = ConverseApiStreamHandler(model=self.MODEL, on_stream=on_stream)
+
+        with self.assertRaises(ClientError):
+            stream_handler.run(
+                messages=[
+                    MessageModel(
+                        role="user",
+                        content=[TextContentModel(content_type="text", body="Hello")],
+                        model=self.MODEL,
+                        children=[],
+                        parent=None,
+                        create_time=0,
+                        feedback=None,
+                        used_chunks=None,
+                        thinking_log=None,
+                    )
+                ]
+            )
+
+        # Neither retried nor failed over, not to stream the text twice
+        client.converse_stream.assert_called_once()
+        on_stream.assert_called_once_with("Hello")
+
+
 if __name__ == "__main__":
     unittest.main()
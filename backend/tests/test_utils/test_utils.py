@@ -1,6 +1,9 @@
 import logging
 import sys
 import unittest
+from unittest.mock import patch
+
+from botocore.exceptions import ClientError
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.DEBUG)
@@ -40,5 +43,128 @@ class TestUtils(unittest.TestCase):
         assert reg == "us-west-2"
 
 
+class TestDeleteFilesWithPrefixFromS3(unittest.TestCase):
+    @patch("boto3.client")
+    def test_delete_all_pages(self, mock_client):
+        from app.utils import delete_files_with_prefix_from_s3
+
+        client = mock_client.return_value
+        client.get_paginator.return_value.paginate.return_value = [
+            {"Contents": [{"Key": f"prefix/{i}"} for i in range(1000)]},
+            {"Contents": [{"Key": "prefix/1000"}]},
+        ]
+        client.delete_objects.return_value = {}
+
+        deleted = delete_files_with_prefix_from_s3("bucket", "prefix/")
+
+        self.assertEqual(deleted, 1001)
+        self.assertEqual(client.delete_objects.call_count, 2)
+        client.delete_object.assert_not_called()
+
+    @patch("boto3.client")
+    def test_raise_on_errors(self, mock_client):
+        from app.utils import delete_files_with_prefix_from_s3
+
+        client = mock_client.return_value
+        client.get_paginator.return_value.paginate.return_value = [
+            {"Contents": [{"Key": "prefix/0"}]},
+        ]
+        client.delete_objects.return_value = {
+            "Errors": [{"Key": "prefix/0", "Code": "AccessDenied"}]
+        }
+
+        with self.assertRaises(RuntimeError):
+            delete_files_with_prefix_from_s3("bucket", "prefix/")
+
+
+class TestMoveFilesInS3(unittest.TestCase):
+    @patch("boto3.client")
+    def test_move_files(self, mock_client):
+        from app.utils import move_files_in_s3
+
+        client = mock_client.return_value
+        client.delete_objects.return_value = {}
+
+        move_files_in_s3("bucket", [(f"_temp/{i}", f"documents/{i}") for i in range(3)])
+
+        self.assertEqual(client.copy_object.call_count, 3)
+        client.head_object.assert_not_called()
+        # The originals are deleted in a batch
+        client.delete_objects.assert_called_once_with(
+            Bucket="bucket",
+            Delete={
+                "Objects": [{"Key": f"_temp/{i}"} for i in range(3)],
+                "Quiet": True,
+            },
+        )
+
+    @patch("boto3.client")
+    def test_file_not_found(self, mock_client):
+        from app.utils import move_files_in_s3
+
+        client = mock_client.return_value
+        client.copy_object.side_effect = ClientError(
+            {"Error": {"Code": "NoSuchKey", "Message": ""}}, "CopyObject"
+        )
+
+        with self.assertRaises(FileNotFoundError):
+            move_files_in_s3("bucket", [("_temp/a", "documents/a")])
+
+        client.delete_objects.assert_not_called()
+
+    @patch("app.utils.S3_MAX_COPY_OBJECT_SIZE", 8)
+    @patch("app.utils.S3_COPY_PART_SIZE", 4)
+    @patch("boto3.client")
+    def test_multipart_copy(self, mock_client):
+        from app.utils import move_files_in_s3
+
+        client = mock_client.return_value
+        client.copy_object.side_effect = ClientError(
+            {"Error": {"Code": "InvalidRequest", "Message": ""}}, "CopyObject"
+        )
+        client.head_object.return_value = {"ContentLength": 10}
+        client.create_multipart_upload.return_value = {"UploadId": "upload"}
+        client.upload_part_copy.side_effect = lambda **kwargs: {
+            "CopyPartResult": {"ETag": str(kwargs["PartNumber"])}
+        }
+        client.delete_objects.return_value = {}
+
+        move_files_in_s3("bucket", [("_temp/a", "documents/a")])
+
+        self.assertEqual(
+            [
+                call.kwargs["CopySourceRange"]
+                for call in client.upload_part_copy.call_args_list
+            ],
+            ["bytes=0-3", "bytes=4-7", "bytes=8-9"],
+        )
+        client.complete_multipart_upload.assert_called_once_with(
+            Bucket="bucket",
+            Key="documents/a",
+            UploadId="upload",
+            MultipartUpload={
+                "Parts": [{"PartNumber": i, "ETag": str(i)} for i in range(1, 4)]
+            },
+        )
+
+    @patch("app.utils.S3_MAX_COPY_OBJECT_SIZE", 8)
+    @patch("boto3.client")
+    def test_invalid_copy(self, mock_client):
+        from app.utils import move_files_in_s3
+
+        client = mock_client.return_value
+        client.copy_object.side_effect = ClientError(
+            {"Error": {"Code": "InvalidRequest", "Message": ""}}, "CopyObject"
+        )
+        client.head_object.return_value = {"ContentLength": 8}
+
+        with self.assertRaises(ClientError):
+            move_files_in_s3("bucket", [("_temp/a", "documents/a")])
+
+        # Not larger than the limit of CopyObject
+        client.create_multipart_upload.assert_not_called()
+        client.delete_objects.assert_not_called()
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -43,6 +43,8 @@ const USE_STAND_BY_REPLICAS: boolean =
 const ENABLE_BEDROCK_CROSS_REGION_INFERENCE: boolean = app.node.tryGetContext(
   "enableBedrockCrossRegionInference"
 );
+const BEDROCK_ROUTING_REGIONS: string[] =
+  app.node.tryGetContext("bedrockRoutingRegions") ?? [];
 const ENABLE_LAMBDA_SNAPSTART: boolean = app.node.tryGetContext("enableLambdaSnapStart");
 
 // WAF for frontend
@@ -98,6 +100,7 @@ const chat = new BedrockChatStack(app, `BedrockChatStack`, {
   documentBucket: bedrockRegionResources.documentBucket,
   useStandbyReplicas: USE_STAND_BY_REPLICAS,
   enableBedrockCrossRegionInference: ENABLE_BEDROCK_CROSS_REGION_INFERENCE,
+  bedrockRoutingRegions: BEDROCK_ROUTING_REGIONS,
   enableLambdaSnapStart: ENABLE_LAMBDA_SNAPSTART,
   alternateDomainName: ALTERNATE_DOMAIN_NAME,
   hostedZoneId: HOSTED_ZONE_ID,
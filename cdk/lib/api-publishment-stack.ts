@@ -33,13 +33,14 @@ export class ApiPublishmentStack extends Stack {
 
     const deploymentStage = props.deploymentStage ?? "dev";
 
+    const chatQueueMaxReceiveCount = 2; // one retry
     const chatQueueDLQ = new sqs.Queue(this, "ChatQueueDlq", {
       retentionPeriod: cdk.Duration.days(14),
     });
     const chatQueue = new sqs.Queue(this, "ChatQueue", {
       visibilityTimeout: cdk.Duration.minutes(30),
       deadLetterQueue: {
-        maxReceiveCount: 2, // one retry
+        maxReceiveCount: chatQueueMaxReceiveCount,
         queue: chatQueueDLQ,
       },
     });
@@ -128,13 +129,17 @@ export class ApiPublishmentStack extends Stack {
           REGION: Stack.of(this).region,
           BEDROCK_REGION: props.bedrockRegion,
           TABLE_ACCESS_ROLE_ARN: props.tableAccessRoleArn,
+          SQS_MAX_RECEIVE_COUNT: chatQueueMaxReceiveCount.toString(),
         },
         role: handlerRole,
         logRetention: logs.RetentionDays.THREE_MONTHS,
       }
     );
     sqsConsumeHandler.addEventSource(
-      new lambdaEventSources.SqsEventSource(chatQueue)
+      new lambdaEventSources.SqsEventSource(chatQueue, {
+        // Redeliver only the failed messages of a batch
+        reportBatchItemFailures: true,
+      })
     );
     chatQueue.grantSendMessages(apiHandler);
     chatQueue.grantConsumeMessages(sqsConsumeHandler);
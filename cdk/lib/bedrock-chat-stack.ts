@@ -39,6 +39,7 @@ export interface BedrockChatStackProps extends StackProps {
   readonly documentBucket: Bucket;
   readonly useStandbyReplicas: boolean;
   readonly enableBedrockCrossRegionInference: boolean;
+  readonly bedrockRoutingRegions?: string[];
   readonly enableLambdaSnapStart: boolean;
   readonly alternateDomainName?: string;
   readonly hostedZoneId?: string;
@@ -130,6 +131,11 @@ export class BedrockChatStack extends cdk.Stack {
       hostedZoneId: props.hostedZoneId,
     });
 
+    const database = new Database(this, "Database", {
+      // Enable PITR to export data to s3
+      pointInTimeRecovery: true,
+    });
+
     const auth = new Auth(this, "Auth", {
       origin: frontend.getOrigin(),
       userPoolDomainPrefixKey: props.userPoolDomainPrefix,
@@ -137,6 +143,7 @@ export class BedrockChatStack extends cdk.Stack {
       allowedSignUpEmailDomains: props.allowedSignUpEmailDomains,
       autoJoinUserGroups: props.autoJoinUserGroups,
       selfSignUpEnabled: props.selfSignUpEnabled,
+      userDirectoryTable: database.table,
     });
     const largeMessageBucket = new Bucket(this, "LargeMessageBucket", {
       encryption: BucketEncryption.S3_MANAGED,
@@ -149,11 +156,6 @@ export class BedrockChatStack extends cdk.Stack {
       serverAccessLogsPrefix: "LargeMessageBucket",
     });
 
-    const database = new Database(this, "Database", {
-      // Enable PITR to export data to s3
-      pointInTimeRecovery: true,
-    });
-
     const usageAnalysis = new UsageAnalysis(this, "UsageAnalysis", {
       accessLogBucket,
       sourceDatabase: database,
@@ -172,6 +174,7 @@ export class BedrockChatStack extends cdk.Stack {
       enableMistral: props.enableMistral,
       enableBedrockCrossRegionInference:
         props.enableBedrockCrossRegionInference,
+      bedrockRoutingRegions: props.bedrockRoutingRegions,
       enableLambdaSnapStart: props.enableLambdaSnapStart,
     });
     props.documentBucket.grantReadWrite(backendApi.handler);
@@ -189,6 +192,7 @@ export class BedrockChatStack extends cdk.Stack {
       enableMistral: props.enableMistral,
       enableBedrockCrossRegionInference:
         props.enableBedrockCrossRegionInference,
+      bedrockRoutingRegions: props.bedrockRoutingRegions,
       enableLambdaSnapStart: props.enableLambdaSnapStart,
     });
     frontend.buildViteApp({
@@ -39,6 +39,8 @@ export interface ApiProps {
   readonly usageAnalysis?: UsageAnalysis;
   readonly enableMistral: boolean;
   readonly enableBedrockCrossRegionInference: boolean;
+  // Regions to route the model invocations to, in addition to `bedrockRegion`
+  readonly bedrockRoutingRegions?: string[];
   readonly enableLambdaSnapStart: boolean;
 }
 
@@ -161,6 +163,7 @@ export class Api extends Construct {
           props.usageAnalysis?.database.databaseArn || "",
           props.usageAnalysis?.database.catalogArn || "",
           props.usageAnalysis?.ddbExportTable.tableArn || "",
+          props.usageAnalysis?.ddbCompactTable.tableArn || "",
         ],
       })
     );
@@ -204,11 +207,14 @@ export class Api extends Construct {
           props.usageAnalysis?.database.databaseName || "",
         USAGE_ANALYSIS_TABLE:
           props.usageAnalysis?.ddbExportTable.tableName || "",
+        USAGE_ANALYSIS_COMPACT_TABLE:
+          props.usageAnalysis?.ddbCompactTable.tableName || "",
         USAGE_ANALYSIS_WORKGROUP: props.usageAnalysis?.workgroupName || "",
         USAGE_ANALYSIS_OUTPUT_LOCATION: usageAnalysisOutputLocation,
         ENABLE_MISTRAL: props.enableMistral.toString(),
         ENABLE_BEDROCK_CROSS_REGION_INFERENCE:
           props.enableBedrockCrossRegionInference.toString(),
+        BEDROCK_ROUTING_REGIONS: (props.bedrockRoutingRegions ?? []).join(","),
         AWS_LAMBDA_EXEC_WRAPPER: "/opt/bootstrap",
         PORT: "8000",
       },
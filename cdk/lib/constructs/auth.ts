@@ -8,6 +8,7 @@ import {
   CfnUserPoolGroup,
   UserPoolIdentityProviderOidc,
 } from "aws-cdk-lib/aws-cognito";
+import { ITable } from "aws-cdk-lib/aws-dynamodb";
 import * as iam from "aws-cdk-lib/aws-iam";
 import * as secretsmanager from "aws-cdk-lib/aws-secretsmanager";
 import * as logs from "aws-cdk-lib/aws-logs";
@@ -25,6 +26,8 @@ export interface AuthProps {
   readonly allowedSignUpEmailDomains: string[];
   readonly autoJoinUserGroups: string[];
   readonly selfSignUpEnabled: boolean;
+  // Pre-populated with the emails of new users, used by the admin usage views
+  readonly userDirectoryTable?: ITable;
 }
 
 export class Auth extends Construct {
@@ -230,6 +233,9 @@ export class Auth extends Construct {
           environment: {
             USER_POOL_ID: userPool.userPoolId,
             AUTO_JOIN_USER_GROUPS: JSON.stringify(props.autoJoinUserGroups),
+            ...(props.userDirectoryTable
+              ? { USER_DIRECTORY_TABLE_NAME: props.userDirectoryTable.tableName }
+              : {}),
           },
           logRetention: logs.RetentionDays.THREE_MONTHS,
         }
@@ -243,6 +249,20 @@ export class Auth extends Construct {
         addUserToGroupsFunction,
         "cognito-idp:AdminAddUserToGroup"
       );
+      if (props.userDirectoryTable) {
+        // Only the user directory items, not the conversations on the same table
+        addUserToGroupsFunction.addToRolePolicy(
+          new iam.PolicyStatement({
+            actions: ["dynamodb:PutItem"],
+            resources: [props.userDirectoryTable.tableArn],
+            conditions: {
+              "ForAllValues:StringLike": {
+                "dynamodb:LeadingKeys": ["USER_DIRECTORY#*"],
+              },
+            },
+          })
+        );
+      }
 
       const cognitoTriggerRegistrationFunction = new SingletonFunction(
         this,
@@ -31,6 +31,8 @@ export class Database extends Construct {
       stream: StreamViewType.NEW_IMAGE,
       pointInTimeRecovery: props?.pointInTimeRecovery,
       encryption: TableEncryption.AWS_MANAGED,
+      // Used to expire idempotency keys of the published API
+      timeToLiveAttribute: "expire",
     });
     table.addGlobalSecondaryIndex({
       // Used to fetch conversation or bot by id
@@ -44,6 +46,12 @@ export class Database extends Construct {
       // TODO: add `nonKeyAttributes` for efficiency
       // For now we project all attributes to keep future compatibility
     });
+    table.addGlobalSecondaryIndex({
+      // Used to fetch published bots. Sparse, only the published bots have the key
+      indexName: "PublishedBotIndex",
+      partitionKey: { name: "PublishedBotPartition", type: AttributeType.STRING },
+      sortKey: { name: "ApiPublishedDatetime", type: AttributeType.NUMBER },
+    });
     table.addLocalSecondaryIndex({
       // Used to fetch all bots for a user. Sorted by bot used time
       indexName: "LastBotUsedIndex",
@@ -574,7 +574,7 @@ export class Embedding extends Construct {
           exclude: [...excludeDockerImage],
         }
       ),
-      timeout: Duration.minutes(1),
+      timeout: Duration.minutes(5),
       environment: {
         ACCOUNT: Stack.of(this).account,
         REGION: Stack.of(this).region,
@@ -589,8 +589,10 @@ export class Embedding extends Construct {
     this._removalHandler.addEventSource(
       new DynamoEventSource(props.database, {
         startingPosition: lambda.StartingPosition.TRIM_HORIZON,
-        batchSize: 1,
+        batchSize: 10,
         retryAttempts: 2,
+        // Retry only from the first failed record of a batch
+        reportBatchItemFailures: true,
         filters: [
           {
             pattern: '{"eventName":["REMOVE"]}',
@@ -1,9 +1,10 @@
 import { Construct } from "constructs";
 import * as s3 from "aws-cdk-lib/aws-s3";
 import * as athena from "aws-cdk-lib/aws-athena";
-import { CfnOutput, RemovalPolicy, Stack } from "aws-cdk-lib";
+import { CfnOutput, Duration, RemovalPolicy, Stack } from "aws-cdk-lib";
 import * as glue from "@aws-cdk/aws-glue-alpha";
 import * as events from "aws-cdk-lib/aws-events";
+import * as s3n from "aws-cdk-lib/aws-s3-notifications";
 import * as targets from "aws-cdk-lib/aws-events-targets";
 import * as python from "@aws-cdk/aws-lambda-python-alpha";
 import * as path from "path";
@@ -21,6 +22,7 @@ export interface UsageAnalysisProps {
 export class UsageAnalysis extends Construct {
   public readonly database: glue.IDatabase;
   public readonly ddbExportTable: glue.ITable;
+  public readonly ddbCompactTable: glue.ITable;
   public readonly ddbBucket: s3.IBucket;
   public readonly resultOutputBucket: s3.IBucket;
   public readonly workgroupName: string;
@@ -32,6 +34,7 @@ export class UsageAnalysis extends Construct {
       this
     ).stackName.toLowerCase()}_usage_analysis`;
     const DDB_EXPORT_TABLE_NAME = "ddb_export";
+    const DDB_COMPACT_TABLE_NAME = "ddb_compact";
 
     // Bucket to export DynamoDB data
     const ddbBucket = new s3.Bucket(this, "DdbBucket", {
@@ -233,6 +236,44 @@ export class UsageAnalysis extends Construct {
         `s3://${ddbBucket.bucketName}/` + "${datehour}/AWSDynamoDB/data/",
     });
 
+    // Latest image of the conversations updated in each hour, compacted from the export.
+    // See `backend/s3_exporter/compaction.py`
+    const ddbCompactTable = new glue.S3Table(this, "DdbCompactTable", {
+      database,
+      bucket: ddbBucket,
+      s3Prefix: "compact/",
+      tableName: DDB_COMPACT_TABLE_NAME,
+      partitionKeys: [
+        {
+          name: "datehour",
+          type: glue.Schema.STRING,
+        },
+      ],
+      columns: [
+        { name: "pk", type: glue.Schema.STRING },
+        { name: "sk", type: glue.Schema.STRING },
+        { name: "bot_id", type: glue.Schema.STRING },
+        { name: "total_price", type: glue.Schema.decimal(20, 10) },
+        { name: "create_time", type: glue.Schema.STRING },
+        { name: "write_timestamp_micros", type: glue.Schema.BIG_INT },
+      ],
+      dataFormat: glue.DataFormat.PARQUET,
+    });
+    const cfnDdbCompactTable = ddbCompactTable.node
+      .defaultChild as aws_glue.CfnTable;
+    cfnDdbCompactTable.addPropertyOverride("TableInput.Parameters", {
+      has_encrypted_data: false,
+      "parquet.compression": "SNAPPY",
+      "projection.enabled": true,
+      "projection.datehour.type": "date",
+      "projection.datehour.range": "2023/01/01/00,2123/01/01/00",
+      "projection.datehour.format": "yyyy/MM/dd/HH",
+      "projection.datehour.interval": 1,
+      "projection.datehour.interval.unit": "HOURS",
+      "storage.location.template":
+        `s3://${ddbBucket.bucketName}/compact/` + "${datehour}/",
+    });
+
     const exportHandler = new python.PythonFunction(this, "ExportHandler", {
       entry: path.join(__dirname, "../../../backend/s3_exporter/"),
       runtime: Runtime.PYTHON_3_11,
@@ -255,6 +296,64 @@ export class UsageAnalysis extends Construct {
       targets: [new targets.LambdaFunction(exportHandler)],
     });
 
+    const compactionHandler = new python.PythonFunction(
+      this,
+      "CompactionHandler",
+      {
+        entry: path.join(__dirname, "../../../backend/s3_exporter/"),
+        index: "compaction.py",
+        runtime: Runtime.PYTHON_3_11,
+        timeout: Duration.minutes(5),
+        environment: {
+          BUCKET_NAME: ddbBucket.bucketName,
+          GLUE_DATABASE_NAME: GLUE_DATABASE_NAME,
+          SOURCE_TABLE_NAME: DDB_EXPORT_TABLE_NAME,
+          WORKGROUP: wg.name,
+        },
+        logRetention: logs.RetentionDays.THREE_MONTHS,
+      }
+    );
+    compactionHandler.addToRolePolicy(
+      new iam.PolicyStatement({
+        actions: [
+          "athena:StartQueryExecution",
+          "athena:GetQueryExecution",
+          "athena:GetWorkGroup",
+        ],
+        resources: [
+          `arn:aws:athena:${Stack.of(this).region}:${
+            Stack.of(this).account
+          }:workgroup/${wg.name}`,
+        ],
+      })
+    );
+    compactionHandler.addToRolePolicy(
+      new iam.PolicyStatement({
+        actions: [
+          "glue:GetDatabase",
+          "glue:GetTable",
+          "glue:GetPartitions",
+          "glue:CreateTable",
+          "glue:DeleteTable",
+        ],
+        resources: [
+          database.catalogArn,
+          database.databaseArn,
+          `arn:aws:glue:${Stack.of(this).region}:${
+            Stack.of(this).account
+          }:table/${GLUE_DATABASE_NAME}/*`,
+        ],
+      })
+    );
+    ddbBucket.grantReadWrite(compactionHandler);
+    queryResultBucket.grantReadWrite(compactionHandler);
+    // Written at the end of each export
+    ddbBucket.addEventNotification(
+      s3.EventType.OBJECT_CREATED,
+      new s3n.LambdaDestination(compactionHandler),
+      { suffix: "manifest-summary.json" }
+    );
+
     new CfnOutput(this, "UsageAnalysisWorkgroup", {
       value: wg.name,
     });
@@ -265,6 +364,7 @@ export class UsageAnalysis extends Construct {
     this.database = database;
     this.ddbBucket = ddbBucket;
     this.ddbExportTable = ddbExportTable;
+    this.ddbCompactTable = ddbCompactTable;
     this.workgroupName = wg.name;
     this.resultOutputBucket = queryResultBucket;
     this.workgroupArn = `arn:aws:athena:*:${Stack.of(this).account}:workgroup/${
@@ -29,6 +29,8 @@ export interface WebSocketProps {
   readonly accessLogBucket?: s3.Bucket;
   readonly enableMistral: boolean;
   readonly enableBedrockCrossRegionInference: boolean;
+  // Regions to route the model invocations to, in addition to `bedrockRegion`
+  readonly bedrockRoutingRegions?: string[];
   readonly enableLambdaSnapStart: boolean;
 }
 
@@ -109,6 +111,7 @@ export class WebSocket extends Construct {
         ENABLE_MISTRAL: props.enableMistral.toString(),
         ENABLE_BEDROCK_CROSS_REGION_INFERENCE:
           props.enableBedrockCrossRegionInference.toString(),
+        BEDROCK_ROUTING_REGIONS: (props.bedrockRoutingRegions ?? []).join(","),
       },
       role: handlerRole,
       snapStart: props.enableLambdaSnapStart ? SnapStartConf.ON_PUBLISHED_VERSIONS : undefined,